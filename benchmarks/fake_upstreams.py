@@ -0,0 +1,205 @@
+"""
+Local stand-ins for OpenRouter, SerpApi and Wikipedia, for benchmarks.
+
+One server answers all three with canned data after configurable delays:
+
+    POST /api/v1/chat/completions     OpenRouter (plain and streamed)
+    GET  /search                      SerpApi Google Flights
+    GET  /w/api.php                   Wikipedia search
+    GET  /api/rest_v1/page/summary/*  Wikipedia page summary
+
+Point the app at it with OPENROUTER_BASE_URL=http://HOST:PORT/api/v1,
+SERPAPI_BASE_URL=http://HOST:PORT, WIKIPEDIA_API_URL=http://HOST:PORT/w/api.php
+and WIKIPEDIA_REST_URL=http://HOST:PORT/api/rest_v1 (load_bench.py does).
+
+    python benchmarks/fake_upstreams.py --port 9100 --token-latency 0.02
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "Morning walk along the beach, breakfast at a local cafe, visit the old fort, "
+    "lunch with regional thali, museum tour, sunset cruise, dinner at the night market"
+).split()
+
+
+class Settings:
+    first_token_latency = 0.4 # Seconds before the first token (queueing + prompt processing)
+    token_latency = 0.02 # Seconds per generated token
+    chat_tokens = 150 # Reply length for chat requests
+    plan_tokens = 900 # Reply length for whole-plan prompts
+    chunk_tokens = 4 # Tokens per streamed SSE chunk
+    error_rate = 0.0 # Share of completions answered with a 503
+    serpapi_latency = 0.8
+    wikipedia_latency = 0.15
+
+
+settings = Settings()
+app = FastAPI()
+# System prompts answered before: their tokens are reported as cached, like a
+# provider with prefix caching would
+seen_prefixes: set[str] = set()
+
+
+def sentence(words: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def fake_days(num_days: int, words: int) -> list[dict]:
+    return [{"day": d + 1, "title": sentence(4), "slots": [
+        {"time": time_of_day, "title": sentence(3), "description": sentence(words),
+         "places": [{"name": sentence(2)}], "cost_inr": 500}
+        for time_of_day in ("Morning", "Afternoon", "Evening")
+    ]} for d in range(num_days)]
+
+
+def fake_itinerary(num_days: int, tokens: int) -> str:
+    """Itinerary JSON (utils/itinerary.py shape) of roughly `tokens` tokens."""
+    words = max(3, tokens * 3 // 4 // max(num_days * 3, 1) - 10) # Description words per time slot
+    return json.dumps({
+        "title": "Your trip ✨",
+        "summary": sentence(20),
+        "hotels": [{"name": f"Hotel {n}", "area": "Old Town", "price_per_night_inr": 3500 + 1500 * n,
+                    "description": sentence(12)} for n in range(3)],
+        "days": fake_days(num_days, words),
+        "budget": [{"category": c, "amount_inr": 5000} for c in ("Hotels", "Food", "Activities", "Local Transport")],
+    }, ensure_ascii=False)
+
+
+def fake_outline(num_days: int) -> str:
+    return json.dumps({
+        "title": "Your trip ✨",
+        "summary": sentence(20),
+        "hotels": [{"name": f"Hotel {n}", "area": "Old Town", "price_per_night_inr": 3500 + 1500 * n,
+                    "description": sentence(12)} for n in range(3)],
+        "budget": [{"category": c, "amount_inr": 5000} for c in ("Hotels", "Food", "Activities", "Local Transport")],
+        "days": [{"day": d + 1, "area": sentence(2), "theme": sentence(4)} for d in range(num_days)],
+    }, ensure_ascii=False)
+
+
+def text_of(message: dict) -> str:
+    content = message.get("content") or ""
+    return content if isinstance(content, str) else "".join(part.get("text", "") for part in content)
+
+
+def fake_reply(messages: list[dict]) -> str:
+    prompt = "\n".join(text_of(m) for m in messages)
+    # Day edits and long-trip chunks: only the requested days, at the same length per day
+    match = re.search(r"holding exactly (\d+) day", prompt)
+    if match:
+        return json.dumps({"days": fake_days(int(match.group(1)), 20)}, ensure_ascii=False)
+    if '"theme"' in prompt:
+        match = re.search(r"(\d+)-day", prompt)
+        return fake_outline(int(match.group(1)) if match else 3)
+    if '"slots"' in prompt: # Whole-plan JSON shape
+        match = re.search(r"(\d+)-day", prompt)
+        return fake_itinerary(int(match.group(1)) if match else 3, settings.plan_tokens)
+    return " ".join(random.choice(WORDS) for _ in range(settings.chat_tokens))
+
+
+def usage(messages: list[dict], completion_tokens: int) -> dict:
+    prompt_tokens = sum(len(text_of(m)) for m in messages) // 4
+    system = "".join(text_of(m) for m in messages if m.get("role") == "system")
+    cached = len(system) // 4 if system in seen_prefixes else 0
+    if system:
+        seen_prefixes.add(system)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached}}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model, messages = body.get("model", "fake"), body.get("messages", [])
+    if random.random() < settings.error_rate:
+        await asyncio.sleep(settings.first_token_latency)
+        return JSONResponse({"error": {"message": "overloaded"}}, status_code=503)
+
+    text = fake_reply(messages)
+    tokens = max(1, len(text) // 4) # ~4 characters per token
+    if not body.get("stream"):
+        await asyncio.sleep(settings.first_token_latency + settings.token_latency * tokens)
+        return {
+            "id": f"gen-{time.time_ns()}",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage(messages, tokens),
+        }
+
+    async def events():
+        await asyncio.sleep(settings.first_token_latency)
+        step = max(1, settings.chunk_tokens)
+        for i in range(0, len(text), step * 4):
+            chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": text[i:i + step * 4]}}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(settings.token_latency * step)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield f"data: {json.dumps({'model': model, 'choices': [], 'usage': usage(messages, tokens)})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/search")
+async def serpapi_search(request: Request):
+    await asyncio.sleep(settings.serpapi_latency)
+    params = request.query_params
+    return {
+        "search_metadata": {"status": "Success"},
+        "best_flights": [{
+            "flights": [{
+                "airline": random.choice(["IndiGo", "Air India", "Vistara"]),
+                "flight_number": f"6E {random.randint(100, 999)}",
+                "departure_airport": {"id": params.get("departure_id"), "time": f"{params.get('outbound_date')} 08:10"},
+                "arrival_airport": {"id": params.get("arrival_id"), "time": f"{params.get('outbound_date')} 10:25"},
+            }],
+            "total_duration": 135,
+            "price": random.randint(3500, 9000),
+        }],
+    }
+
+
+@app.get("/w/api.php")
+async def wikipedia_search(request: Request):
+    await asyncio.sleep(settings.wikipedia_latency)
+    query = request.query_params.get("srsearch", "")
+    return {"query": {"search": [{"title": query.title()}] if query else []}}
+
+
+@app.get("/api/rest_v1/page/summary/{title}")
+async def wikipedia_summary(title: str):
+    await asyncio.sleep(settings.wikipedia_latency)
+    return {"title": title, "thumbnail": {"source": f"https://upload.example/{title}.jpg"}}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    for name, value in vars(Settings).items():
+        if not name.startswith("_"):
+            parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    for name in vars(Settings):
+        if not name.startswith("_"):
+            setattr(settings, name, getattr(args, name))
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main_cli()
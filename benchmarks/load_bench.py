@@ -0,0 +1,618 @@
+"""
+End-to-end load benchmark.
+
+Starts benchmarks/fake_upstreams.py (OpenRouter, SerpApi, Wikipedia
+stand-ins) and main:app as a real multi-worker server against it, in a
+throwaway directory (SQLite unless --env DATABASE_URL=... is given). Then
+`--concurrency` virtual users, each signed in as their own account, loop over
+a weighted mix of requests for `--duration` seconds:
+
+    token        POST /token
+    chat         POST /chat
+    chat_stream  POST /chat/stream (time to first event is reported too)
+    history      GET /history, revalidated with the last ETag
+    plan         POST /plan
+    plan_stream  POST /plan/stream
+    trips        GET /trips/, revalidated with the last ETag
+    trip         GET /trips/{id}
+
+Reports RPS, p50/p95/p99 latency per request type, the RSS of every server
+process, and upstream calls and cache events as the server's /metrics saw
+them, and writes it all to JSON. Exits 1 when an upstream call failed (the
+app often degrades instead of failing the request, e.g. a plan without
+flights), or, with --baseline, when throughput dropped or p95 grew by more
+than --max-regression.
+
+    python benchmarks/load_bench.py --workers 4 --concurrency 50 --duration 60
+    python benchmarks/load_bench.py --baseline benchmarks/results/main.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+try:
+    import psutil
+except ImportError: # Optional: falls back to /proc (Linux)
+    psutil = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MIX = "history=25,trips=20,trip=5,chat=12,chat_stream=10,plan=4,plan_stream=4,token=5"
+DESTINATIONS = ["Goa", "Jaipur", "Manali", "Kerala", "Udaipur", "Rishikesh", "Leh", "Varanasi",
+                "Pondicherry", "Darjeeling", "Hampi", "Andaman"]
+CHAT_MESSAGES = ["Suggest a weekend trip from Mumbai", "What should I pack for Manali in December?",
+                 "Is Goa good for families?", "Cheapest way to get to Jaipur?", "Best street food in Delhi"]
+PASSWORD = "bench-password"
+
+
+def percentile(samples: list[float], pct: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_summary(samples: list[float]) -> dict:
+    ms = lambda value: None if value is None else round(value * 1000, 1)
+    return {
+        "p50_ms": ms(percentile(samples, 50)),
+        "p95_ms": ms(percentile(samples, 95)),
+        "p99_ms": ms(percentile(samples, 99)),
+        "max_ms": ms(max(samples) if samples else None),
+    }
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, weight = part.split("=")
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"Unknown operation {name!r}, expected one of {', '.join(OPERATIONS)}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+# --- Server processes ---
+
+def start_process(args: list[str], env: dict, cwd: str, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(args, env={**os.environ, **env}, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise SystemExit(f"{url} exited during startup (code {process.returncode})")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit(f"{url} not ready after {timeout}s")
+
+
+def stop_process(process: subprocess.Popen):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def process_tree(pid: int) -> list[int]:
+    """`pid` and all of its descendants."""
+    if psutil is not None:
+        try:
+            parent = psutil.Process(pid)
+            return [pid] + [p.pid for p in parent.children(recursive=True)]
+        except psutil.NoSuchProcess:
+            return []
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The command name may contain spaces; fields after ")" are fixed
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree, frontier = [pid], [pid]
+    while frontier:
+        children = [child for child, parent in parents.items() if parent in frontier]
+        tree += children
+        frontier = children
+    return tree
+
+
+def cmdline(pid: int) -> str:
+    try:
+        if psutil is not None:
+            return " ".join(psutil.Process(pid).cmdline())
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode(errors="replace")
+    except Exception:
+        return ""
+
+
+def rss_mb(pid: int) -> float | None:
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss / 1024 / 1024
+        except psutil.NoSuchProcess:
+            return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class MemorySampler:
+    """Samples RSS of the server's process tree once a second."""
+
+    def __init__(self, root_pid: int):
+        self.root_pid = root_pid
+        self.samples: dict[int, list[float]] = {}
+        self.roles: dict[int, str] = {}
+
+    def role(self, pid: int) -> str:
+        if pid == self.root_pid:
+            return "master"
+        # multiprocessing's resource tracker and the like are not workers
+        return "helper" if "multiprocessing" in cmdline(pid) and "spawn_main" not in cmdline(pid) else "worker"
+
+    def sample(self):
+        for pid in process_tree(self.root_pid):
+            if pid not in self.roles:
+                self.roles[pid] = self.role(pid)
+            rss = rss_mb(pid)
+            if rss is not None:
+                self.samples.setdefault(pid, []).append(rss)
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            self.sample()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+        self.sample()
+
+    def report(self) -> list[dict]:
+        return [
+            {
+                "pid": pid,
+                "role": self.roles[pid],
+                "rss_start_mb": round(values[0], 1),
+                "rss_peak_mb": round(max(values), 1),
+                "rss_end_mb": round(values[-1], 1),
+            }
+            for pid, values in self.samples.items()
+        ]
+
+
+# --- Load ---
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.first_event: dict[str, list[float]] = {}
+        self.statuses: dict[str, dict[str, int]] = {}
+        self.recording = False
+
+    def record(self, name: str, status: int | str, latency: float, first_event: float | None = None):
+        if not self.recording:
+            return
+        self.statuses.setdefault(name, {})
+        self.statuses[name][str(status)] = self.statuses[name].get(str(status), 0) + 1
+        ok = isinstance(status, int) and (200 <= status < 300 or status == 304)
+        if ok:
+            self.latencies.setdefault(name, []).append(latency)
+            if first_event is not None:
+                self.first_event.setdefault(name, []).append(first_event)
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, email: str, stats: Stats):
+        self.client = client
+        self.email = email
+        self.stats = stats
+        self.token: str | None = None
+        self.trip_id: str | None = None
+        self.etags: dict[str, str] = {}
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+    async def timed(self, name: str, method: str, url: str, **kwargs) -> httpx.Response | None:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats.record(name, type(e).__name__, time.perf_counter() - started)
+            return None
+        self.stats.record(name, response.status_code, time.perf_counter() - started)
+        return response
+
+    async def timed_stream(self, name: str, url: str, body: dict):
+        """POSTs to an SSE endpoint; records total time and time to the first event."""
+        started = time.perf_counter()
+        first_event = None
+        status: int | str = "incomplete"
+        try:
+            async with self.client.stream("POST", url, json=body, headers=self.headers) as response:
+                status = response.status_code
+                async for line in response.aiter_lines():
+                    if first_event is None and line.startswith("event:"):
+                        first_event = time.perf_counter() - started
+                    if line.startswith("event: error"):
+                        status = "stream_error"
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.stats.record(name, status, time.perf_counter() - started, first_event)
+
+    async def sign_up(self):
+        await self.client.post("/signup", json={"email": self.email, "password": PASSWORD, "name": "Bench"})
+        await self.token_op(record=False)
+        trip_id = f"bench-{self.email.split('@')[0]}"
+        await self.client.post("/trips/", headers=self.headers, json={
+            "id": trip_id, "destination": random.choice(DESTINATIONS), "start_date": "2026-03-01",
+            "end_date": "2026-03-04", "travelers": 2, "itinerary_markdown": "### Day 1\n" + "Sightseeing. " * 200,
+        })
+        self.trip_id = trip_id
+
+    async def token_op(self, record: bool = True):
+        response = await (self.timed("token", "POST", "/token", data={"username": self.email, "password": PASSWORD})
+                          if record else self.client.post("/token", data={"username": self.email, "password": PASSWORD}))
+        if response is not None and response.status_code == 200:
+            self.token = response.json()["access_token"]
+
+    async def chat(self):
+        await self.timed("chat", "POST", "/chat", json={"message": random.choice(CHAT_MESSAGES)}, headers=self.headers)
+
+    async def chat_stream(self):
+        await self.timed_stream("chat_stream", "/chat/stream", {"message": random.choice(CHAT_MESSAGES)})
+
+    async def conditional_get(self, name: str, url: str):
+        headers = dict(self.headers)
+        if url in self.etags:
+            headers["If-None-Match"] = self.etags[url]
+        response = await self.timed(name, "GET", url, headers=headers)
+        if response is not None and response.headers.get("etag"):
+            self.etags[url] = response.headers["etag"]
+
+    async def history(self):
+        await self.conditional_get("history", "/history?limit=50")
+
+    async def trips(self):
+        await self.conditional_get("trips", "/trips/")
+
+    async def trip(self):
+        await self.timed("trip", "GET", f"/trips/{self.trip_id}", headers=self.headers)
+
+    def plan_body(self) -> dict:
+        # A small set of destinations and dates, so the itinerary cache sees both hits and misses
+        start = datetime(2026, 5, 1) + timedelta(days=random.randrange(0, 60, 7))
+        return {
+            "source": "Mumbai",
+            "destination": random.choice(DESTINATIONS),
+            "start_date": start.strftime("%Y-%m-%d"),
+            "end_date": (start + timedelta(days=random.randint(2, 5))).strftime("%Y-%m-%d"),
+            "travelers": random.randint(1, 4),
+        }
+
+    async def plan(self):
+        await self.timed("plan", "POST", "/plan", json=self.plan_body(), headers=self.headers, timeout=300)
+
+    async def plan_stream(self):
+        await self.timed_stream("plan_stream", "/plan/stream", self.plan_body())
+
+    async def loop(self, mix: dict[str, float], stop: asyncio.Event):
+        names, weights = list(mix), list(mix.values())
+        while not stop.is_set():
+            await OPERATIONS[random.choices(names, weights)[0]](self)
+
+
+OPERATIONS = {
+    "token": VirtualUser.token_op,
+    "chat": VirtualUser.chat,
+    "chat_stream": VirtualUser.chat_stream,
+    "history": VirtualUser.history,
+    "plan": VirtualUser.plan,
+    "plan_stream": VirtualUser.plan_stream,
+    "trips": VirtualUser.trips,
+    "trip": VirtualUser.trip,
+}
+
+
+async def drive(base_url: str, args, mix: dict[str, float], sampler: MemorySampler) -> tuple[Stats, float]:
+    stats = Stats()
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        users = [VirtualUser(client, f"bench{i}@example.com", stats) for i in range(args.concurrency)]
+        semaphore = asyncio.Semaphore(8) # Sign-ups hash passwords: don't let setup dominate
+        async def sign_up(user):
+            async with semaphore:
+                await user.sign_up()
+        await asyncio.gather(*[sign_up(u) for u in users])
+        if any(u.token is None for u in users):
+            raise SystemExit("Some benchmark users could not sign in; see the server log")
+
+        stop, sampler_stop = asyncio.Event(), asyncio.Event()
+        sampler_task = asyncio.create_task(sampler.run(sampler_stop))
+        tasks = [asyncio.create_task(u.loop(mix, stop)) for u in users]
+        await asyncio.sleep(args.warmup)
+        stats.recording = True
+        started = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        stats.recording = False
+        elapsed = time.perf_counter() - started
+        stop.set()
+        # In-flight requests finish on their own; their results are not recorded
+        await asyncio.gather(*tasks, return_exceptions=True)
+        sampler_stop.set()
+        await sampler_task
+    return stats, elapsed
+
+
+# --- Report ---
+
+async def scrape_metrics(base_url: str) -> tuple[dict, dict] | None:
+    """(upstream calls by upstream, cache events by namespace) from /metrics; None if unreadable."""
+    from prometheus_client.parser import text_string_to_metric_families
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            text = (await client.get(f"{base_url}/metrics")).raise_for_status().text
+    except httpx.HTTPError as e:
+        print(f"Could not read {base_url}/metrics: {e}")
+        return None
+    upstreams, caches = {}, {}
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name.startswith("upstream_request_duration_seconds_"):
+                upstream = upstreams.setdefault(
+                    sample.labels["upstream"], {"calls": 0, "errors": 0, "cancelled": 0, "seconds": 0.0}
+                )
+                if sample.name.endswith("_count"):
+                    upstream["calls"] += int(sample.value)
+                    if sample.labels["outcome"] in ("error", "cancelled"):
+                        upstream["errors" if sample.labels["outcome"] == "error" else "cancelled"] += int(sample.value)
+                elif sample.name.endswith("_sum"):
+                    upstream["seconds"] += sample.value
+            elif sample.name == "cache_events_total":
+                caches.setdefault(sample.labels["namespace"], {})[sample.labels["event"]] = int(sample.value)
+    for upstream in upstreams.values():
+        upstream["mean_ms"] = round(upstream.pop("seconds") * 1000 / upstream["calls"], 1) if upstream["calls"] else None
+    return upstreams, caches
+
+
+def upstream_failures(report: dict, args) -> list[str]:
+    """Failed upstream calls; OpenRouter errors are expected (and not counted) with --error-rate."""
+    if report["upstreams"] is None:
+        return ["upstream metrics unavailable"]
+    return [
+        f"{name}: {upstream['errors']} of {upstream['calls']} calls failed"
+        for name, upstream in report["upstreams"].items()
+        if upstream["errors"] and not (name == "openrouter" and args.error_rate > 0)
+    ]
+
+
+def build_report(args, mix, stats: Stats, elapsed: float, sampler: MemorySampler, scraped: tuple | None) -> dict:
+    operations = {}
+    for name in mix:
+        latencies = stats.latencies.get(name, [])
+        statuses = stats.statuses.get(name, {})
+        total = sum(statuses.values())
+        operations[name] = {
+            "requests": total,
+            "errors": total - len(latencies),
+            "rps": round(len(latencies) / elapsed, 2),
+            **latency_summary(latencies),
+            "statuses": statuses,
+        }
+        if name in stats.first_event:
+            operations[name]["first_event"] = latency_summary(stats.first_event[name])
+
+    everything = [value for values in stats.latencies.values() for value in values]
+    total = sum(sum(s.values()) for s in stats.statuses.values())
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": commit or None,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+            "mix": mix,
+        },
+        "overall": {
+            "duration_s": round(elapsed, 2),
+            "requests": total,
+            "errors": total - len(everything),
+            "rps": round(len(everything) / elapsed, 2),
+            **latency_summary(everything),
+        },
+        "operations": operations,
+        "memory": sampler.report(),
+        "upstreams": scraped[0] if scraped else None,
+        "caches": scraped[1] if scraped else None,
+    }
+
+
+def print_report(report: dict):
+    overall = report["overall"]
+    print(f"\n{'operation':<12} {'reqs':>7} {'err':>5} {'rps':>8} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8}")
+    for name, op in [*report["operations"].items(), ("TOTAL", overall)]:
+        print(f"{name:<12} {op['requests']:>7} {op['errors']:>5} {op['rps']:>8} "
+              f"{op['p50_ms'] or '-':>8} {op['p95_ms'] or '-':>8} {op['p99_ms'] or '-':>8}")
+    for name, op in report["operations"].items():
+        if "first_event" in op:
+            print(f"{name} first event: p50={op['first_event']['p50_ms']}ms p95={op['first_event']['p95_ms']}ms")
+    if report["upstreams"] is not None:
+        print(f"\n{'upstream':<12} {'calls':>7} {'err':>5} {'cancel':>6} {'mean ms':>8}")
+        for name, upstream in sorted(report["upstreams"].items()):
+            print(f"{name:<12} {upstream['calls']:>7} {upstream['errors']:>5} {upstream['cancelled']:>6} "
+                  f"{upstream['mean_ms'] or '-':>8}")
+        for namespace, events in sorted(report["caches"].items()):
+            lookups = events.get("hits", 0) + events.get("misses", 0)
+            ratio = f"{events.get('hits', 0) / lookups:.0%}" if lookups else "-"
+            print(f"cache {namespace}: hit ratio {ratio} {events}")
+    print("\nmemory (MB):")
+    for proc in report["memory"]:
+        print(f"  {proc['role']:<6} pid={proc['pid']:<7} start={proc['rss_start_mb']} peak={proc['rss_peak_mb']} end={proc['rss_end_mb']}")
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list[str]:
+    """Operations whose RPS fell or p95 rose by more than `max_regression` (a fraction)."""
+    regressions = []
+    for name, op in report["operations"].items():
+        before = baseline.get("operations", {}).get(name)
+        if not before or not before.get("rps"):
+            continue
+        if op["rps"] < before["rps"] * (1 - max_regression):
+            regressions.append(f"{name}: rps {before['rps']} -> {op['rps']}")
+        if before.get("p95_ms") and op["p95_ms"] and op["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {op['p95_ms']}ms")
+    peak = lambda r: max((p["rss_peak_mb"] for p in r.get("memory", []) if p["role"] == "worker"), default=None)
+    if peak(baseline) and peak(report) and peak(report) > peak(baseline) * (1 + max_regression):
+        regressions.append(f"worker peak RSS {peak(baseline)}MB -> {peak(report)}MB")
+    return regressions
+
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix="tripmate-load-")
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    fake = start_process([
+        sys.executable, os.path.join(HERE, "fake_upstreams.py"), "--port", str(args.fake_port),
+        "--first-token-latency", str(args.first_token_latency), "--token-latency", str(args.token_latency),
+        "--chat-tokens", str(args.chat_tokens), "--plan-tokens", str(args.plan_tokens),
+        "--error-rate", str(args.error_rate),
+        "--serpapi-latency", str(args.serpapi_latency), "--wikipedia-latency", str(args.wikipedia_latency),
+    ], {}, workdir, os.path.join(workdir, "fake_upstreams.log"))
+
+    env = {
+        "PYTHONPATH": ROOT,
+        "OPENROUTER_API_KEY": "bench",
+        "OPENROUTER_BASE_URL": f"{fake_url}/api/v1",
+        "SERPAPI_API_KEY": "bench",
+        "SERPAPI_BASE_URL": fake_url,
+        "WIKIPEDIA_API_URL": f"{fake_url}/w/api.php",
+        "WIKIPEDIA_REST_URL": f"{fake_url}/api/rest_v1",
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(workdir, "prometheus"),
+        "RATE_LIMIT_ENABLED": "1" if args.rate_limit else "0",
+        "LOG_LEVEL": "WARNING",
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    os.makedirs(env["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    # Create the schema once up front: workers racing create_all on a fresh
+    # database crash with "table already exists"
+    subprocess.run([sys.executable, os.path.join(ROOT, "init_db.py")], env={**os.environ, **env}, cwd=workdir,
+                   check=True, stdout=subprocess.DEVNULL)
+
+    if args.server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "main:app", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+                   "-w", str(args.workers), "-k", "uvicorn.workers.UvicornWorker", "-b", f"127.0.0.1:{args.port}"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+                   "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"]
+    server = start_process(command, env, workdir, os.path.join(workdir, "server.log"))
+
+    try:
+        await wait_ready(f"{fake_url}/health", fake)
+        await wait_ready(f"{base_url}/health", server)
+        print(f"Benchmarking {args.server} x{args.workers} for {args.duration}s "
+              f"({args.concurrency} users, {args.warmup}s warm-up); logs in {workdir}")
+        sampler = MemorySampler(server.pid)
+        stats, elapsed = await drive(base_url, args, mix, sampler)
+        scraped = await scrape_metrics(base_url)
+    finally:
+        stop_process(server)
+        stop_process(fake)
+
+    report = build_report(args, mix, stats, elapsed, sampler, scraped)
+    print_report(report)
+
+    output = args.output or os.path.join(HERE, "results", f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {output}")
+
+    status = 0
+    failures = upstream_failures(report, args)
+    if failures:
+        print(f"\nUpstream failures (see the server log in {workdir}):")
+        for line in failures:
+            print(f"  {line}")
+        status = 1
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print(f"\nRegressions beyond {args.max_regression:.0%} vs {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            status = 1
+        else:
+            print(f"\nNo regressions beyond {args.max_regression:.0%} vs {args.baseline}")
+    return status
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=["uvicorn", "gunicorn"], default="uvicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds first")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weights per operation (default {DEFAULT_MIX})")
+    parser.add_argument("--first-token-latency", type=float, default=0.4)
+    parser.add_argument("--token-latency", type=float, default=0.02, help="fake OpenRouter seconds per token")
+    parser.add_argument("--chat-tokens", type=int, default=150)
+    parser.add_argument("--plan-tokens", type=int, default=900)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake completions failing with 503")
+    parser.add_argument("--serpapi-latency", type=float, default=0.8)
+    parser.add_argument("--wikipedia-latency", type=float, default=0.15)
+    parser.add_argument("--rate-limit", action="store_true", help="keep the per-user rate limiter on")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app environment")
+    parser.add_argument("--output", help="result JSON (default benchmarks/results/load-<time>.json)")
+    parser.add_argument("--baseline", help="earlier result JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.15)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main_cli()
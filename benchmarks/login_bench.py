@@ -0,0 +1,107 @@
+"""
+Login throughput benchmark.
+
+Boots main:app in-process against a throwaway SQLite database, creates test
+users, then fires concurrent POST /token requests while a probe keeps hitting
+/health. Reports login p50/p99 and how much the probe was delayed, i.e. how
+much password hashing stalls the event loop for everyone else.
+
+    python benchmarks/login_bench.py --users 50 --concurrency 25 --rounds 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: list[float]) -> str:
+    return (
+        f"p50={percentile(samples, 50) * 1000:.1f}ms "
+        f"p99={percentile(samples, 99) * 1000:.1f}ms "
+        f"max={max(samples) * 1000:.1f}ms n={len(samples)}"
+    )
+
+
+async def run(args):
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        emails = [f"bench{i}@example.com" for i in range(args.users)]
+        await asyncio.gather(*[
+            client.post("/signup", json={"email": e, "password": "bench-password", "name": "Bench"}) for e in emails
+        ])
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        login_latencies: list[float] = []
+        probe_latencies: list[float] = []
+        done = asyncio.Event()
+
+        async def login(email):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/token", data={"username": email, "password": "bench-password"})
+                login_latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        async def probe():
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get("/health")
+                probe_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.01)
+
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*[login(e) for _ in range(args.rounds) for e in emails])
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe_task
+
+    print(f"rounds={os.environ['PASSWORD_HASH_ROUNDS']} executor={os.environ['PASSWORD_HASH_EXECUTOR']} "
+          f"workers={os.environ['PASSWORD_HASH_WORKERS']} concurrency={args.concurrency}")
+    print(f"logins:  {summarize(login_latencies)} throughput={len(login_latencies) / elapsed:.1f}/s")
+    print(f"/health: {summarize(probe_latencies)}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=25)
+    parser.add_argument("--rounds", type=int, default=4, help="logins per user")
+    parser.add_argument("--hash-rounds", type=int, default=None, help="PASSWORD_HASH_ROUNDS override")
+    parser.add_argument("--executor", choices=["thread", "process"], default=None)
+    parser.add_argument("--workers", type=int, default=None, help="PASSWORD_HASH_WORKERS override")
+    args = parser.parse_args()
+
+    if args.hash_rounds:
+        os.environ["PASSWORD_HASH_ROUNDS"] = str(args.hash_rounds)
+    if args.executor:
+        os.environ["PASSWORD_HASH_EXECUTOR"] = args.executor
+    if args.workers:
+        os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+    os.environ.setdefault("PASSWORD_HASH_ROUNDS", "29000")
+    os.environ.setdefault("PASSWORD_HASH_EXECUTOR", "thread")
+    os.environ.setdefault("PASSWORD_HASH_WORKERS", "4")
+    os.environ.setdefault("OPENROUTER_API_KEY", "bench-not-used")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0") # Measures hashing, not the /token limit
+
+    # The app creates its SQLite files relative to the working directory
+    sys.path.insert(0, ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="tripmate-bench-"))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,155 @@
+"""
+Migrates trips.itinerary_markdown to compressed storage and reports sizes.
+
+    python compress_itineraries.py --report     # sizes only, no changes
+    python compress_itineraries.py              # train a dictionary, recompress every row
+    python compress_itineraries.py --no-dict    # recompress without a shared dictionary
+    python compress_itineraries.py --vacuum     # also VACUUM (SQLite) so the file shrinks
+
+Safe to re-run: rows already compressed are decoded and re-encoded with the
+newest dictionary, and every row is checked to round-trip before it is written.
+Old dictionaries are kept, so rows that were not rewritten still decode.
+"""
+import argparse
+import os
+from sqlalchemy import text
+import models
+from database import engine, IS_SQLITE, SessionLocal
+from utils import compression
+
+BATCH_SIZE = 200
+
+
+def sqlite_file_size() -> int | None:
+    if not IS_SQLITE:
+        return None
+    path = engine.url.database
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def iter_rows(conn):
+    # Raw values (bypassing CompressedText) so we see what is actually stored
+    last_id = ""
+    while True:
+        rows = conn.execute(
+            text("SELECT id, itinerary_markdown FROM trips WHERE id > :last ORDER BY id LIMIT :n"),
+            {"last": last_id, "n": BATCH_SIZE},
+        ).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def stored_size(value) -> int:
+    if value is None:
+        return 0
+    return len(value.encode("utf-8")) if isinstance(value, str) else len(bytes(value))
+
+
+def report(label: str):
+    rows = plain = text_bytes = stored_bytes = 0
+    with engine.connect() as conn:
+        for batch in iter_rows(conn):
+            for _, value in batch:
+                if value is None:
+                    continue
+                rows += 1
+                plain += isinstance(value, str) or bytes(value)[:2] != compression.MAGIC
+                text_bytes += len(compression.decompress_text(value).encode("utf-8"))
+                stored_bytes += stored_size(value)
+    ratio = text_bytes / stored_bytes if stored_bytes else 0
+    print(f"[{label}] {rows} itineraries ({plain} uncompressed): "
+          f"{text_bytes:,} bytes of text stored in {stored_bytes:,} bytes (ratio {ratio:.2f}x)")
+    file_size = sqlite_file_size()
+    if file_size is not None:
+        print(f"[{label}] database file: {file_size:,} bytes")
+
+
+def ensure_binary_column():
+    if IS_SQLITE:
+        return # SQLite keeps BLOBs as-is in a TEXT column
+    with engine.begin() as conn:
+        data_type = conn.execute(text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_name = 'trips' AND column_name = 'itinerary_markdown'"
+        )).scalar()
+        if data_type != "bytea":
+            print(f"Converting trips.itinerary_markdown from {data_type} to bytea...")
+            conn.execute(text(
+                "ALTER TABLE trips ALTER COLUMN itinerary_markdown TYPE bytea "
+                "USING convert_to(itinerary_markdown, 'UTF8')"
+            ))
+
+
+def train(max_samples: int):
+    samples = []
+    with engine.connect() as conn:
+        for batch in iter_rows(conn):
+            samples.extend(compression.decompress_text(v) for _, v in batch if v is not None)
+            if len(samples) >= max_samples:
+                break
+    samples = samples[:max_samples]
+    if len(samples) < 10:
+        print(f"Only {len(samples)} itineraries: not enough to train a dictionary, skipping")
+        return
+
+    codec = compression.codec_byte(compression.ITINERARY_CODEC)
+    data = compression.train_dictionary(samples)
+    with SessionLocal() as db:
+        row = models.CompressionDict(codec=codec.decode(), data=data, sample_count=len(samples))
+        db.add(row)
+        db.commit()
+        compression.register_dictionary(row.id, codec, data)
+        print(f"Trained {compression.ITINERARY_CODEC} dictionary #{row.id}: {len(data):,} bytes from {len(samples)} itineraries")
+
+
+def recompress():
+    rewritten = 0
+    with engine.connect() as read_conn:
+        for batch in iter_rows(read_conn):
+            updates = []
+            for trip_id, value in batch:
+                if value is None:
+                    continue
+                original = compression.decompress_text(value)
+                packed = compression.compress_text(original)
+                if compression.decompress_text(packed) != original:
+                    raise RuntimeError(f"Round-trip mismatch for trip {trip_id}, aborting")
+                updates.append({"id": trip_id, "value": packed})
+            if updates:
+                with engine.begin() as conn:
+                    conn.execute(text("UPDATE trips SET itinerary_markdown = :value WHERE id = :id"), updates)
+                rewritten += len(updates)
+    print(f"Recompressed {rewritten} itineraries")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--report", action="store_true", help="Only print sizes")
+    parser.add_argument("--no-dict", action="store_true", help="Do not train a shared dictionary")
+    parser.add_argument("--samples", type=int, default=1000, help="Itineraries to train the dictionary on")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards (SQLite)")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine) # compression_dicts
+    with engine.connect() as conn:
+        compression.load_dictionaries(conn)
+
+    report("before")
+    if args.report:
+        return
+
+    ensure_binary_column()
+    if not args.no_dict:
+        train(args.samples)
+    recompress()
+    if args.vacuum and IS_SQLITE:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.exec_driver_sql("VACUUM")
+    report("after")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ import zipfile
 def create_zip(source_dir, output_filename):
     # Files/Dirs to exclude
     EXCLUDE_DIRS = {'.venv', 'venv', '__pycache__', '.git', '.idea', 'env'}
-    EXCLUDE_FILES = {'tripmate.db', '.env', '.DS_Store', output_filename}
+    EXCLUDE_FILES = {'tripmate.db', 'tripmate.db-wal', 'tripmate.db-shm', 'tripmate_cache.db', 'tripmate_cache.db-wal', 'tripmate_cache.db-shm', '.env', '.DS_Store', output_filename}
     
     with zipfile.ZipFile(output_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
         for root, dirs, files in os.walk(source_dir):
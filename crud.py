@@ -1,18 +1,82 @@
+from sqlalchemy import select, update, delete, or_, and_, text
+from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects import sqlite, postgresql
+from database import IS_SQLITE
 import models, schemas
 from passlib.context import CryptContext
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+import asyncio
+import os
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# --- Password hashing ---
+# pbkdf2 deliberately burns CPU, so async endpoints hand it to a bounded pool
+# instead of running it on the event loop. Changing PASSWORD_HASH_ROUNDS makes
+# every stored hash with other rounds "need update"; it is re-hashed on the
+# next successful login.
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "29000")) # passlib's default
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread") # "thread" or "process"
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__min_rounds=PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__max_rounds=PASSWORD_HASH_ROUNDS,
+)
+
+_hash_executor: Executor | None = None
+
+def get_hash_executor() -> Executor:
+    global _hash_executor
+    if _hash_executor is None:
+        if PASSWORD_HASH_EXECUTOR == "process":
+            _hash_executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        else:
+            # hashlib's pbkdf2 releases the GIL, so threads run it in parallel
+            _hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pwhash")
+    return _hash_executor
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password, hashed_password) -> tuple[bool, str | None]:
+    """Returns (valid, new_hash); new_hash is set when the stored hash uses outdated parameters."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def get_password_hash_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hash_executor(), get_password_hash, password)
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hash_executor(), verify_and_update_password, plain_password, hashed_password)
+
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
+def get_user(db: Session, user_id: int):
+    return db.query(models.User).filter(models.User.id == user_id).first()
+
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email).limit(1))
+    return result.scalars().first()
+
+async def get_user_async(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+def bump_token_version(db: Session, user: models.User):
+    # Every token issued with the old version stops validating
+    user.token_version = (user.token_version or 0) + 1
+    db.commit()
+    db.refresh(user)
+    return user
+
 def create_user(db: Session, user: schemas.UserCreate):
     hashed_password = get_password_hash(user.password)
     db_user = models.User(email=user.email, hashed_password=hashed_password)
@@ -21,12 +85,108 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     return db_user
 
+# --- Change versions (ETag / conditional GET) ---
+TRIPS_SCOPE = "trips"
+HISTORY_SCOPE = "history"
+
+def _change_version_bump(user_id: int, scope: str):
+    # Single-statement upsert, so concurrent writers can't lose a bump
+    insert = sqlite.insert if IS_SQLITE else postgresql.insert
+    stmt = insert(models.ChangeVersion).values(
+        user_id=user_id, scope=scope, version=1, updated_at=datetime.utcnow()
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "scope"],
+        set_={"version": models.ChangeVersion.version + 1, "updated_at": stmt.excluded.updated_at},
+    )
+
+def bump_change_version(db: Session, user_id: int, scope: str):
+    """Part of the caller's transaction: commit together with the change itself."""
+    db.execute(_change_version_bump(user_id, scope))
+
+async def bump_change_version_async(db: AsyncSession, user_id: int, scope: str):
+    await db.execute(_change_version_bump(user_id, scope))
+
+def _change_version_query(user_id: int, scope: str):
+    return select(models.ChangeVersion.version, models.ChangeVersion.updated_at).where(
+        models.ChangeVersion.user_id == user_id, models.ChangeVersion.scope == scope
+    )
+
+def get_change_version(db: Session, user_id: int, scope: str) -> tuple[int, datetime | None]:
+    """(version, updated_at); (0, None) if nothing changed since versions were introduced."""
+    row = db.execute(_change_version_query(user_id, scope)).first()
+    return (row.version, row.updated_at) if row else (0, None)
+
+async def get_change_version_async(db: AsyncSession, user_id: int, scope: str) -> tuple[int, datetime | None]:
+    row = (await db.execute(_change_version_query(user_id, scope))).first()
+    return (row.version, row.updated_at) if row else (0, None)
+
+# --- Chat ---
+async def add_chat_message_async(db: AsyncSession, user_id: int, role: str, content: str, is_partial: bool = False):
+    message = models.ChatMessage(user_id=user_id, role=role, content=content, is_partial=is_partial)
+    db.add(message)
+    await bump_change_version_async(db, user_id, HISTORY_SCOPE)
+    await db.commit()
+    return message
+
+async def get_chat_page_async(db: AsyncSession, user_id: int, limit: int, before: tuple[datetime, int] | None = None):
+    """
+    Keyset page of chat history, newest first by (timestamp, id), served from
+    ix_chat_messages_user_ts_id. Returns (messages oldest first, has_more).
+    """
+    query = select(models.ChatMessage).where(models.ChatMessage.user_id == user_id)
+    if before is not None:
+        ts, msg_id = before
+        query = query.where(or_(
+            models.ChatMessage.timestamp < ts,
+            and_(models.ChatMessage.timestamp == ts, models.ChatMessage.id < msg_id),
+        ))
+    query = query.order_by(models.ChatMessage.timestamp.desc(), models.ChatMessage.id.desc()).limit(limit + 1)
+    rows = (await db.execute(query)).scalars().all()
+    return rows[:limit][::-1], len(rows) > limit
+
+async def get_messages_between_async(
+    db: AsyncSession, user_id: int, after_id: int, before_id: int | None = None,
+    limit: int = 50, newest_first: bool = False,
+):
+    """Messages with after_id < id (< before_id), by id."""
+    query = select(models.ChatMessage).where(
+        models.ChatMessage.user_id == user_id, models.ChatMessage.id > after_id
+    )
+    if before_id is not None:
+        query = query.where(models.ChatMessage.id < before_id)
+    order = models.ChatMessage.id.desc() if newest_first else models.ChatMessage.id.asc()
+    return (await db.execute(query.order_by(order).limit(limit))).scalars().all()
+
+async def get_chat_summary_async(db: AsyncSession, user_id: int):
+    return await db.get(models.ChatSummary, user_id)
+
+async def save_chat_summary_async(db: AsyncSession, user_id: int, summary: str, through_message_id: int):
+    # Upsert that never moves backwards, in case two workers summarize at once
+    insert = sqlite.insert if IS_SQLITE else postgresql.insert
+    stmt = insert(models.ChatSummary).values(
+        user_id=user_id, summary=summary, through_message_id=through_message_id, updated_at=datetime.utcnow()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={
+            "summary": stmt.excluded.summary,
+            "through_message_id": stmt.excluded.through_message_id,
+            "updated_at": stmt.excluded.updated_at,
+        },
+        where=models.ChatSummary.through_message_id < stmt.excluded.through_message_id,
+    )
+    await db.execute(stmt)
+    await db.commit()
+
 def create_trip(db: Session, trip: schemas.TripCreate, user_id: int):
     # Convert Pydantic models to JSON/Dict for storage if needed, 
     # but SQLAlchemy handles JSON fields pretty well if mapped correctly.
     # Pydantic .dict() or .model_dump() helps.
     
     trip_data = trip.dict(exclude={"flights"}) # Flights stored separately in JSON column
+    if trip.itinerary is not None:
+        trip_data["itinerary_markdown"] = None # Rendered from the structured form on demand
     flights_json = [f.dict() for f in (trip.flights or [])]
     
     db_trip = models.Trip(
@@ -35,29 +195,157 @@ def create_trip(db: Session, trip: schemas.TripCreate, user_id: int):
         flights_data=flights_json # Store as JSON list
     )
     db.add(db_trip)
+    bump_change_version(db, user_id, TRIPS_SCOPE)
     db.commit()
     db.refresh(db_trip)
     return db_trip
 
-def get_trips(db: Session, user_id: int):
-    trips = db.query(models.Trip).filter(models.Trip.user_id == user_id).order_by(models.Trip.created_at.desc()).all()
-    # Map back to Pydantic schema structure if needed, 
-    # but strictly speaking FastAPI response_model handles it if attributes match.
-    # We might need to map `flights_data` back to `flights` attribute manually if names differ,
-    # but here I named the DB column `flights_data`. schema expects `flights`.
-    
-    result = []
-    for t in trips:
-        # Convert DB object to Schema compatible dict
-        t_dict = t.__dict__.copy()
-        t_dict["flights"] = t.flights_data
-        result.append(t_dict)
-    return result
+def trip_to_dict(t: models.Trip) -> dict:
+    # Schema expects `flights`, the DB column is `flights_data`
+    return {
+        "id": t.id,
+        "user_id": t.user_id,
+        "destination": t.destination,
+        "start_date": t.start_date,
+        "end_date": t.end_date,
+        "travelers": t.travelers,
+        "budget_inr": t.budget_inr,
+        "itinerary": t.itinerary,
+        "itinerary_markdown": t.itinerary_markdown,
+        "prompt_version": t.prompt_version,
+        "flights": t.flights_data,
+        "image_url": t.image_url,
+        "created_at": t.created_at,
+    }
+
+def get_trip(db: Session, trip_id: str, user_id: int):
+    t = db.query(models.Trip).filter(models.Trip.id == trip_id, models.Trip.user_id == user_id).first()
+    return trip_to_dict(t) if t else None
+
+async def get_trip_async(db: AsyncSession, trip_id: str, user_id: int):
+    query = select(models.Trip).where(models.Trip.id == trip_id, models.Trip.user_id == user_id)
+    t = (await db.execute(query)).scalars().first()
+    return trip_to_dict(t) if t else None
+
+async def replace_trip_days_async(db: AsyncSession, trip_id: str, user_id: int, days: list[dict]):
+    """
+    Swaps regenerated days (matched by day number) into the stored itinerary.
+    The rest is re-read here, not taken from the caller, so edits of other
+    days that finished meanwhile are kept. None if the trip is gone.
+    """
+    query = select(models.Trip).where(models.Trip.id == trip_id, models.Trip.user_id == user_id)
+    if IS_SQLITE:
+        # No row locks: take the write lock before reading instead, so two edits
+        # of the same trip (from any worker) run one after the other
+        await db.execute(text("BEGIN IMMEDIATE"))
+    else:
+        query = query.with_for_update()
+    t = (await db.execute(query)).scalars().first()
+    if t is None or t.itinerary is None:
+        return None
+    by_number = {day["day"]: day for day in days}
+    # A new dict: the JSON column only notices assignment, not in-place changes
+    t.itinerary = {**t.itinerary, "days": [by_number.get(day["day"], day) for day in t.itinerary["days"]]}
+    await bump_change_version_async(db, user_id, TRIPS_SCOPE)
+    await db.commit()
+    return trip_to_dict(t)
+
+def get_trip_summaries(db: Session, user_id: int, limit: int, before: tuple[datetime, str] | None = None):
+    """
+    Keyset page of the user's trips, newest first by (created_at, id). Only the
+    summary columns are loaded, never the itinerary text or flights JSON.
+    Returns (rows, has_more).
+    """
+    query = db.query(
+        models.Trip.id,
+        models.Trip.destination,
+        models.Trip.start_date,
+        models.Trip.end_date,
+        models.Trip.image_url,
+        models.Trip.created_at,
+    ).filter(models.Trip.user_id == user_id)
+    if before is not None:
+        created_at, trip_id = before
+        query = query.filter(or_(
+            models.Trip.created_at < created_at,
+            and_(models.Trip.created_at == created_at, models.Trip.id < trip_id),
+        ))
+    rows = query.order_by(models.Trip.created_at.desc(), models.Trip.id.desc()).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
 
 def delete_trip(db: Session, trip_id: str, user_id: int):
     db_trip = db.query(models.Trip).filter(models.Trip.id == trip_id, models.Trip.user_id == user_id).first()
     if db_trip:
         db.delete(db_trip)
+        bump_change_version(db, user_id, TRIPS_SCOPE)
         db.commit()
         return True
     return False
+
+# --- Plan jobs ---
+async def create_plan_job_async(db: AsyncSession, job_id: str, user_id: int | None, request: dict, save_as_trip: bool):
+    job = models.PlanJob(id=job_id, user_id=user_id, status="queued", request=request, save_as_trip=save_as_trip)
+    db.add(job)
+    await db.commit()
+    return job
+
+async def get_plan_job_async(db: AsyncSession, job_id: str):
+    return await db.get(models.PlanJob, job_id)
+
+async def claim_plan_job_async(db: AsyncSession, worker_id: str, lease_seconds: float):
+    """
+    Takes the oldest runnable job: queued (and past its backoff), or running
+    under an expired lease (its worker died). Safe across workers: the claim is
+    a conditional UPDATE, so exactly one of them wins.
+    """
+    Job = models.PlanJob
+    now = datetime.utcnow()
+    claimable = or_(
+        and_(Job.status == "queued", or_(Job.run_after.is_(None), Job.run_after <= now)),
+        and_(Job.status == "running", Job.lease_expires_at < now),
+    )
+    candidates = (await db.execute(
+        select(Job.id).where(claimable).order_by(Job.created_at).limit(5)
+    )).scalars().all()
+    for job_id in candidates:
+        claimed = await db.execute(
+            update(Job)
+            .where(Job.id == job_id, claimable)
+            .values(
+                status="running",
+                locked_by=worker_id,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                started_at=now,
+                attempts=Job.attempts + 1,
+            )
+        )
+        await db.commit()
+        if claimed.rowcount == 1:
+            return await db.get(Job, job_id, populate_existing=True)
+    return None
+
+async def update_plan_job_async(db: AsyncSession, job_id: str, worker_id: str, **values) -> bool:
+    """Writes a claimed job's outcome; False if the lease was lost to another worker."""
+    result = await db.execute(
+        update(models.PlanJob)
+        .where(models.PlanJob.id == job_id, models.PlanJob.locked_by == worker_id)
+        .values(**values)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def release_plan_jobs_async(db: AsyncSession, worker_id: str):
+    """Requeues this worker's running jobs (clean shutdown); the interrupted attempt doesn't count."""
+    await db.execute(
+        update(models.PlanJob)
+        .where(models.PlanJob.locked_by == worker_id, models.PlanJob.status == "running")
+        .values(status="queued", locked_by=None, lease_expires_at=None, attempts=models.PlanJob.attempts - 1)
+    )
+    await db.commit()
+
+async def delete_finished_plan_jobs_async(db: AsyncSession, older_than: datetime):
+    await db.execute(
+        delete(models.PlanJob)
+        .where(models.PlanJob.status.in_(("succeeded", "failed")), models.PlanJob.finished_at < older_than)
+    )
+    await db.commit()
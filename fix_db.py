@@ -27,6 +27,33 @@ def fix_db():
             except Exception as e:
                 print(f"Could not create unique index (might already exist or duplicate data): {e}")
 
+        if 'token_version' not in columns:
+            print("Adding 'token_version' column...")
+            cursor.execute("ALTER TABLE users ADD COLUMN token_version INTEGER DEFAULT 0")
+
+        # Streaming chat marks replies cut short by a disconnect
+        cursor.execute("PRAGMA table_info(chat_messages)")
+        chat_columns = [info[1] for info in cursor.fetchall()]
+        if chat_columns and 'is_partial' not in chat_columns:
+            print("Adding 'is_partial' column to chat_messages...")
+            cursor.execute("ALTER TABLE chat_messages ADD COLUMN is_partial BOOLEAN DEFAULT 0")
+        if chat_columns:
+            print("Ensuring chat history index...")
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_chat_messages_user_ts_id ON chat_messages (user_id, timestamp, id)")
+
+        cursor.execute("PRAGMA table_info(trips)")
+        trip_columns = [info[1] for info in cursor.fetchall()]
+        if trip_columns and 'itinerary' not in trip_columns:
+            # Structured itinerary (compressed JSON); old trips keep only itinerary_markdown
+            print("Adding 'itinerary' column to trips...")
+            cursor.execute("ALTER TABLE trips ADD COLUMN itinerary BLOB")
+        if trip_columns and 'prompt_version' not in trip_columns:
+            print("Adding 'prompt_version' column to trips...")
+            cursor.execute("ALTER TABLE trips ADD COLUMN prompt_version VARCHAR")
+        if trip_columns:
+            print("Ensuring trip listing index...")
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_trips_user_created ON trips (user_id, created_at, id)")
+
         # Update is_verified to 1 (True) for all users since we removed verification
         if 'is_verified' in columns:
              print("Updating is_verified to True for all users...")
@@ -0,0 +1,22 @@
+# Picked up automatically by `gunicorn` (see Procfile); command line flags win.
+import os
+import shutil
+import tempfile
+
+# --- CONFIG ---
+# Every worker writes its Prometheus samples here so that /metrics, served by
+# whichever worker, reports the whole server. Set before the workers fork.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "tripmate_prometheus"))
+
+
+def on_starting(server):
+    # Samples of a previous run would otherwise be added to this one's
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges (in-flight counts)
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,12 +1,43 @@
+import os
+import asyncio
 import models
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from database import engine
-from routers import chat, plan, recommend, auth, trips, verify
+from database import engine, async_engine, describe_engine
+from routers import chat, plan, plan_jobs, recommend, auth, trips, verify
+from utils import llm, http, compression, metrics
+from utils.log import get_logger
+from utils.rate_limit import RateLimitMiddleware
 
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="ORBIS Planner API", version="2.0.0")
+logger = get_logger("main")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Database", extra={"database": describe_engine()})
+    with engine.connect() as conn:
+        compression.load_dictionaries(conn) # Shared itinerary compression dictionaries
+    # Optionally fill the destination image cache from the most planned trips
+    prewarm_limit = int(os.getenv("PREWARM_IMAGE_CACHE", "0"))
+    prewarm_task = asyncio.create_task(plan.prewarm_destination_images(prewarm_limit)) if prewarm_limit else None
+    if plan_jobs.PLAN_JOBS_ENABLED:
+        plan_jobs.runner.start()
+    yield
+    if prewarm_task:
+        prewarm_task.cancel()
+    if plan_jobs.PLAN_JOBS_ENABLED:
+        await plan_jobs.runner.stop()
+    # Close pooled upstream connections on worker shutdown
+    await llm.aclose()
+    await http.aclose()
+    await async_engine.dispose()
+
+app = FastAPI(title="ORBIS Planner API", version="2.0.0", lifespan=lifespan)
+
+# Added before CORS so that CORS wraps it and 429s still carry CORS headers
+app.add_middleware(RateLimitMiddleware, identify=auth.rate_limit_identity)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,13 +45,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Last-Modified", "Retry-After", "X-Request-ID"], # Pagination cursor / validators for browser clients
 )
 
+# Outermost: request ids and latency cover everything, 429s included
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
 app.include_router(auth.router)
 app.include_router(verify.router)
 app.include_router(trips.router)
 app.include_router(chat.router)
 app.include_router(plan.router)
+app.include_router(plan_jobs.router)
 app.include_router(recommend.router)
 
 @app.get("/")
@@ -31,6 +67,12 @@ def home():
 def health():
     return {"status": "ok", "service": "orbis_planners_api"}
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus text exposition, aggregated over all gunicorn workers."""
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
 if __name__ == "__main__":
     import uvicorn
     # Host on 0.0.0.0 to allow access from other devices (like your phone)
@@ -1,6 +1,7 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, Text, JSON, DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, Text, JSON, DateTime, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from database import Base
+from utils.compression import CompressedText, CompressedJSON
 import datetime
 
 class User(Base):
@@ -14,6 +15,7 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     is_verified = Column(Boolean, default=True) # Default to True now
     verification_token = Column(String, nullable=True) # Simple token for MVP
+    token_version = Column(Integer, default=0) # Bump to revoke every issued JWT
 
     trips = relationship("Trip", back_populates="owner")
     messages = relationship("ChatMessage", back_populates="user")
@@ -26,9 +28,25 @@ class ChatMessage(Base):
     role = Column(String) # "user" or "assistant"
     content = Column(Text)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    is_partial = Column(Boolean, default=False) # Reply cut short (client disconnected mid-stream)
 
     user = relationship("User", back_populates="messages")
 
+    __table_args__ = (
+        # History reads: WHERE user_id = ? ORDER BY timestamp DESC, id DESC
+        Index("ix_chat_messages_user_ts_id", "user_id", "timestamp", "id"),
+    )
+
+class ChatSummary(Base):
+    __tablename__ = "chat_summaries"
+
+    # Rolling summary of a user's older chat turns (see utils/chat_context.py),
+    # covering every message with id <= through_message_id
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    summary = Column(Text)
+    through_message_id = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
 class Trip(Base):
     __tablename__ = "trips"
 
@@ -41,10 +59,65 @@ class Trip(Base):
     travelers = Column(Integer)
     budget_inr = Column(Float, nullable=True)
     
-    itinerary_markdown = Column(Text)
+    itinerary = Column(CompressedJSON, nullable=True) # Structured plan (utils/itinerary.py)
+    itinerary_markdown = Column(CompressedText, nullable=True) # Trips saved before structured plans only
+    prompt_version = Column(String, nullable=True) # Prompt template that wrote the plan ("plan@1", utils/prompts.py)
     flights_data = Column(JSON, nullable=True) # Store list of flights (JSON)
     image_url = Column(String, nullable=True)
     
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     owner = relationship("User", back_populates="trips")
+
+    __table_args__ = (
+        # Trip listing: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+        Index("ix_trips_user_created", "user_id", "created_at", "id"),
+    )
+
+class ChangeVersion(Base):
+    __tablename__ = "change_versions"
+
+    # Per-user counter bumped in the same transaction as every change to a
+    # listing, so conditional GETs can answer 304 from this row alone
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    scope = Column(String, primary_key=True) # "trips" or "history"
+    version = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class PlanJob(Base):
+    __tablename__ = "plan_jobs"
+
+    # Background /plan run (routers/plan_jobs.py). Lives in the database so a
+    # worker restart loses nothing: queued jobs wait, and a running job whose
+    # lease expired is picked up again by any worker.
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True) # None for anonymous jobs
+    status = Column(String, default="queued") # queued / running / succeeded / failed
+    request = Column(JSON) # PlanRequest fields
+    save_as_trip = Column(Boolean, default=False)
+    result = Column(JSON, nullable=True) # The /plan response body
+    error = Column(Text, nullable=True)
+    trip_id = Column(String, nullable=True)
+    attempts = Column(Integer, default=0)
+    run_after = Column(DateTime, nullable=True) # Retry backoff
+    locked_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Claiming: WHERE status = ? ORDER BY created_at
+        Index("ix_plan_jobs_status_created", "status", "created_at"),
+    )
+
+class CompressionDict(Base):
+    __tablename__ = "compression_dicts"
+
+    # Shared dictionaries for CompressedText columns (see compress_itineraries.py).
+    # Rows are immutable: compressed values reference them by id.
+    id = Column(Integer, primary_key=True)
+    codec = Column(String) # "z" (zlib) or "s" (zstd)
+    data = Column(LargeBinary)
+    sample_count = Column(Integer)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
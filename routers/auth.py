@@ -2,9 +2,11 @@ from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 import crud, models, schemas, database
 import os
+from utils.cache import MemoryStore
 
 router = APIRouter(tags=["auth"])
 
@@ -15,6 +17,8 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60 # 30 days for mobile app convenience
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# For routes that also serve anonymous callers
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -26,7 +30,41 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+# In-process cache of authenticated users, keyed by id. Tokens carry the user
+# id and token_version, so a cache hit needs no database round-trip.
+# invalidate_user() drops an entry in this worker; other workers pick up a
+# bumped token_version once their entry expires (AUTH_USER_CACHE_TTL).
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+user_cache = MemoryStore("auth_user", max_entries=int(os.getenv("AUTH_USER_CACHE_MAX_ENTRIES", "10000")))
+
+def token_claims(user: models.User) -> dict:
+    return {"sub": user.email, "uid": user.id, "ver": user.token_version or 0}
+
+def cache_user(user: models.User) -> schemas.CurrentUser:
+    current = schemas.CurrentUser(
+        id=user.id,
+        email=user.email,
+        is_active=user.is_active,
+        name=user.name,
+        username=user.username,
+        token_version=user.token_version or 0,
+    )
+    user_cache.set(current.id, current, ttl=AUTH_USER_CACHE_TTL)
+    return current
+
+def invalidate_user(user_id: int):
+    user_cache.delete(user_id)
+
+async def load_user(token_data: schemas.TokenData) -> schemas.CurrentUser | None:
+    async with database.AsyncSessionLocal() as db:
+        if token_data.user_id is not None:
+            user = await crud.get_user_async(db, token_data.user_id)
+        else:
+            # Tokens issued before uid/ver claims existed
+            user = await crud.get_user_by_email_async(db, email=token_data.email)
+        return cache_user(user) if user else None
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> schemas.CurrentUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -37,21 +75,49 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
-        token_data = schemas.TokenData(email=email)
+        token_data = schemas.TokenData(email=email, user_id=payload.get("uid"), version=payload.get("ver"))
     except JWTError:
         raise credentials_exception
-        
-    user = crud.get_user_by_email(db, email=token_data.email)
+
+    user = None
+    if token_data.user_id is not None:
+        entry = user_cache.get(token_data.user_id)
+        # A token newer than the cached snapshot means the cache is behind
+        if entry is not None and entry.value.token_version >= (token_data.version or 0):
+            user = entry.value
     if user is None:
+        user = await load_user(token_data)
+
+    if user is None or user.email != token_data.email:
         raise credentials_exception
+    if (token_data.version or 0) != user.token_version:
+        raise credentials_exception # Revoked by a token_version bump (tokens without "ver" count as 0)
     return user
 
+async def get_optional_user(token: str | None = Depends(oauth2_scheme_optional)) -> schemas.CurrentUser | None:
+    """Like get_current_user, but no token means None. A bad token is still a 401."""
+    if token is None:
+        return None
+    return await get_current_user(token)
+
+def rate_limit_identity(authorization: str) -> str | None:
+    """Rate limiter key for a valid bearer token: signature check only, no DB or cache."""
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    subject = payload.get("uid") or payload.get("sub")
+    return f"user:{subject}" if subject else None
+
 import secrets
 from utils.email import send_verification_email
 
 @router.post("/signup")
-async def signup(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+async def signup(user: schemas.UserCreate, db: AsyncSession = Depends(database.get_async_db)):
+    db_user = await crud.get_user_by_email_async(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
@@ -61,7 +127,7 @@ async def signup(user: schemas.UserCreate, db: Session = Depends(database.get_db
     random_suffix = random.randint(100000, 999999)
     username = f"user_{random_suffix}"
     
-    hashed_password = crud.get_password_hash(user.password)
+    hashed_password = await crud.get_password_hash_async(user.password)
     new_user = models.User(
         email=user.email, 
         hashed_password=hashed_password,
@@ -71,16 +137,15 @@ async def signup(user: schemas.UserCreate, db: Session = Depends(database.get_db
         verification_token=None
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
     
     # No Email Sent
     
     return {"message": "Account created successfully."}
 
 @router.post("/resend-verification-email")
-async def resend_verification_email(email: str, db: Session = Depends(database.get_db)):
-    user = crud.get_user_by_email(db, email=email)
+async def resend_verification_email(email: str, db: AsyncSession = Depends(database.get_async_db)):
+    user = await crud.get_user_by_email_async(db, email=email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -91,21 +156,29 @@ async def resend_verification_email(email: str, db: Session = Depends(database.g
     # For simplicity, let's reuse or generate new. Let's generate new to be safe.
     token = secrets.token_urlsafe(32)
     user.verification_token = token
-    db.commit()
+    await db.commit()
     
     await send_verification_email(user.email, token)
     return {"message": "Verification email resent"}
 
 @router.post("/token", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_async_db)):
     # OAuth2PasswordRequestForm expects 'username' field, so we treat email as username
-    user = crud.get_user_by_email(db, email=form_data.username)
-    if not user or not crud.verify_password(form_data.password, user.hashed_password):
+    user = await crud.get_user_by_email_async(db, email=form_data.username)
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await crud.verify_and_update_password_async(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    if new_hash:
+        # Hashing parameters changed since this password was stored
+        user.hashed_password = new_hash
+        await db.commit()
         
     # Verification check removed
     # if not user.is_verified:
@@ -113,7 +186,19 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email},
+        data=token_claims(user),
         expires_delta=access_token_expires
     )
+    cache_user(user)
     return {"access_token": access_token, "token_type": "bearer", "user_name": user.name, "username": user.username}
+
+@router.post("/logout-all")
+def logout_all_sessions(
+    current_user: schemas.CurrentUser = Depends(get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    # Revokes every token issued so far, on every device
+    user = crud.get_user(db, current_user.id)
+    crud.bump_token_version(db, user)
+    invalidate_user(user.id)
+    return {"message": "Logged out from all sessions"}
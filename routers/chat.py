@@ -1,138 +1,188 @@
 import os
-import requests
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from utils import llm, llm_gateway
+from utils.log import get_logger
 
 load_dotenv()
 
 router = APIRouter()
-api_key = os.getenv("OPENROUTER_API_KEY")
+logger = get_logger("chat")
 model = os.getenv("MODEL", "meta-llama/llama-3.1-8b-instruct")
-
-if not api_key:
-    raise ValueError("Missing OPENROUTER_API_KEY in .env file")
-
-BASE_URL = "https://openrouter.ai/api/v1/chat/completions"
+# Tried in order when `model` keeps failing (see utils/llm_gateway.py)
+CHAT_MODELS = llm_gateway.model_list(model, os.getenv("CHAT_FALLBACK_MODELS", ""))
 
 class ChatRequest(BaseModel):
     message: str
 
-from datetime import datetime
-import crud, models, database
+import crud, schemas, database
 from .auth import get_current_user
-from sqlalchemy.orm import Session
-from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import Depends, Query, Request, Response
+from utils.pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor
+from utils.conditional import make_etag, if_none_match, set_validators, not_modified
+import anyio
+from utils.sse import format_event, event_stream_response
+from utils import chat_context
+
+HISTORY_MAX_PAGE_SIZE = 200
+
+SYSTEM_PROMPT = "You are a helpful AI travel planner. Please be professional. Use emojis ONLY for bullet points or lists, and very sparingly in paragraphs. Do not overuse them."
+
+async def save_user_message(db: AsyncSession, user_id: int, content: str):
+    try:
+        await crud.add_chat_message_async(db, user_id, "user", content)
+        logger.debug("Saved user message to database")
+    except Exception as e:
+        logger.error(f"DATABASE ERROR (User Message): {e}")
+        await db.rollback()
+        # Even if DB fails, we should try to get helpful AI response back if possible
+        # but for a production app, we usually want persistence.
+        # Let's keep going but log it.
+
+async def build_messages_payload(db: AsyncSession, user_id: int, message: str) -> list[dict]:
+    try:
+        # System prompt + rolling summary + newest turns within the token budget
+        messages_payload = await chat_context.build_context(db, user_id, SYSTEM_PROMPT)
+        logger.debug(
+            f"Prepared payload with {len(messages_payload)} messages",
+            extra={"context_tokens": chat_context.payload_tokens(messages_payload)},
+        )
+    except Exception as e:
+        logger.error(f"DATABASE ERROR (History Fetch): {e}")
+        messages_payload = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if messages_payload[-1] != {"role": "user", "content": message}:
+        # The user message didn't make it into history (the save failed)
+        messages_payload.append({"role": "user", "content": message})
+    return messages_payload
+
+async def save_bot_message(db: AsyncSession, user_id: int, content: str, is_partial: bool = False):
+    try:
+        await crud.add_chat_message_async(db, user_id, "assistant", content, is_partial=is_partial)
+        logger.debug("Saved bot response to database")
+    except Exception as e:
+        logger.error(f"DATABASE ERROR (Bot Message): {e}")
+        await db.rollback()
 
 @router.get("/history")
 async def get_chat_history(
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(database.get_db)
+    request: Request,
+    response: Response,
+    before: str | None = Query(None, description="Cursor from a previous page's X-Next-Cursor header"),
+    limit: int = Query(50, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    current_user: schemas.CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    # Fetch last 50 messages
-    messages = db.query(models.ChatMessage).filter(
-        models.ChatMessage.user_id == current_user.id
-    ).order_by(models.ChatMessage.timestamp.desc()).limit(50).all()
+    # Newest page first; within the page, chronological order. When older
+    # messages exist, X-Next-Cursor points at them (pass it back as ?before=).
+    before_key = None
+    if before:
+        ts, msg_id = decode_cursor(before)
+        if not msg_id.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        before_key = (ts, int(msg_id))
+
+    # Polling: if nothing changed since the client's copy, skip the history query
+    version, changed_at = await crud.get_change_version_async(db, current_user.id, crud.HISTORY_SCOPE)
+    etag = make_etag(crud.HISTORY_SCOPE, current_user.id, version, before, limit)
+    if if_none_match(request, etag):
+        return not_modified(etag, changed_at)
+    set_validators(response, etag, changed_at)
+
+    messages, has_more = await crud.get_chat_page_async(db, current_user.id, limit=limit, before=before_key)
+    if has_more and messages:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(messages[0].timestamp, messages[0].id)
     
-    # Return in chronological order
     return [
         {
+            "id": m.id,
             "role": m.role,
             "content": m.content,
-            "timestamp": m.timestamp.isoformat()
-        } for m in messages[::-1]
+            "timestamp": m.timestamp.isoformat(),
+            "partial": bool(m.is_partial)
+        } for m in messages
     ]
 
 @router.post("/chat")
 async def chat_with_bot(
     req: ChatRequest, 
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(database.get_db)
+    current_user: schemas.CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    print(f"DEBUG: Received chat request from user {current_user.email}")
+    logger.debug("Received chat request", extra={"user_id": current_user.id})
     
     # 1. Save User Message
-    try:
-        user_msg = models.ChatMessage(
-            user_id=current_user.id,
-            role="user",
-            content=req.message
-        )
-        db.add(user_msg)
-        db.commit()
-        print("DEBUG: Saved user message to database")
-    except Exception as e:
-        print(f"DATABASE ERROR (User Message): {e}")
-        # Even if DB fails, we should try to get helpful AI response back if possible
-        # but for a production app, we usually want persistence.
-        # Let's keep going but log it.
-
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:8000",
-        "X-Title": "TripMate AI",
-    }
-    
-    messages_payload = [{"role": "system", "content": "You are a helpful AI travel planner. Please be professional. Use emojis ONLY for bullet points or lists, and very sparingly in paragraphs. Do not overuse them."}]
-    
-    try:
-        recent_history = db.query(models.ChatMessage).filter(
-            models.ChatMessage.user_id == current_user.id
-        ).order_by(models.ChatMessage.timestamp.desc()).limit(6).all()
-        # Reverse to chrono order
-        recent_history = recent_history[::-1]
-        
-        for msg in recent_history:
-            messages_payload.append({"role": msg.role, "content": msg.content})
-        print(f"DEBUG: Prepared payload with {len(messages_payload)} messages")
-    except Exception as e:
-        print(f"DATABASE ERROR (History Fetch): {e}")
-        messages_payload.append({"role": "user", "content": req.message})
-        
-    payload = {
-        "model": model,
-        "messages": messages_payload,
-    }
+    await save_user_message(db, current_user.id, req.message)
+    messages_payload = await build_messages_payload(db, current_user.id, req.message)
 
     try:
-        print(f"DEBUG: Calling OpenRouter API with model {model}")
-        # Using a timeout to prevent hanging
-        response = requests.post(BASE_URL, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code != 200:
-            error_detail = response.text
-            print(f"OPENROUTER API ERROR: Status {response.status_code}, Body: {error_detail}")
-            raise HTTPException(status_code=response.status_code, detail=f"OpenRouter Error: {error_detail}")
-
-        data = response.json()
-        if "choices" not in data or not data["choices"]:
-             print(f"OPENROUTER INVALID RESPONSE: {data}")
-             raise HTTPException(status_code=502, detail="Invalid response from AI provider")
-             
-        bot_reply = data["choices"][0]["message"]["content"]
-        print("DEBUG: Received AI reply")
+        # Per-attempt timeout; the gateway retries / falls back within its deadline
+        bot_reply, served_by = await llm_gateway.complete(messages_payload, models=CHAT_MODELS, timeout=30)
+        logger.debug(f"Received AI reply from {served_by}")
         
         # 2. Save Bot Response
-        try:
-            bot_msg = models.ChatMessage(
-                user_id=current_user.id,
-                role="assistant",
-                content=bot_reply
-            )
-            db.add(bot_msg)
-            db.commit()
-            print("DEBUG: Saved bot response to database")
-        except Exception as e:
-            print(f"DATABASE ERROR (Bot Message): {e}")
+        await save_bot_message(db, current_user.id, bot_reply)
         
         return {"reply": bot_reply}
         
-    except requests.exceptions.Timeout:
-        print("OPENROUTER TIMEOUT")
+    except llm.LLMTimeout:
+        logger.error("OPENROUTER TIMEOUT")
         raise HTTPException(status_code=504, detail="AI Assistant timed out. Please try again.")
+    except llm.LLMError as e:
+        logger.error(f"OPENROUTER API ERROR: {e.detail}", extra={"status": e.status_code})
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.retry_headers())
     except Exception as e:
-        print(f"CHAT UNEXPECTED ERROR: {e}")
+        logger.exception(f"CHAT UNEXPECTED ERROR: {e}")
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+
+@router.post("/chat/stream")
+async def chat_with_bot_stream(
+    req: ChatRequest,
+    current_user: schemas.CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """
+    Streaming variant of /chat (Server-Sent Events):
+      event: token -> {"text": ...} reply deltas
+      event: done  -> {"reply": ...} full reply
+      event: error -> {"status_code": ..., "detail": ...}
+    The assistant reply is written once when the stream ends. If the client
+    disconnects (or the upstream fails) mid-reply, whatever arrived so far is
+    saved with is_partial=True.
+    """
+    logger.debug("Received streaming chat request", extra={"user_id": current_user.id})
+
+    await save_user_message(db, current_user.id, req.message)
+    messages_payload = await build_messages_payload(db, current_user.id, req.message)
+    user_id = current_user.id
+
+    async def events():
+        parts = []
+        completed = False
+        try:
+            served_by, deltas = await llm_gateway.open_stream(messages_payload, models=CHAT_MODELS, timeout=30)
+            async for delta in deltas:
+                parts.append(delta)
+                yield format_event("token", {"text": delta})
+            completed = True
+            yield format_event("done", {"reply": "".join(parts)})
+        except llm.LLMTimeout:
+            logger.error("OPENROUTER TIMEOUT")
+            yield format_event("error", {"status_code": 504, "detail": "AI Assistant timed out. Please try again."})
+        except llm.LLMError as e:
+            logger.error(f"OPENROUTER API ERROR: {e.detail}", extra={"status": e.status_code})
+            yield format_event("error", {"status_code": e.status_code, "detail": e.detail})
+        finally:
+            # Runs on normal completion, upstream errors and client disconnects
+            # (the generator is cancelled). Use a fresh session: the request's
+            # one may already be closed by the time the stream ends. Shielded,
+            # or the pending cancellation would abort the write too.
+            if parts:
+                with anyio.CancelScope(shield=True):
+                    async with database.AsyncSessionLocal() as write_db:
+                        await save_bot_message(write_db, user_id, "".join(parts), is_partial=not completed)
+
+    return event_stream_response(events())
@@ -1,20 +1,44 @@
 import os
-import requests
+import asyncio
 import httpx
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from utils import llm, llm_gateway, itinerary_cache, itinerary, metrics, prompts
+from utils.log import get_logger
+from utils.http import get_http_client
+from utils.cache import get_store
+from utils.coalesce import SingleFlight
+from utils.itinerary_cache import canonical_destination
+from sqlalchemy import func
+import models, database
+from utils.sse import format_event, event_stream_response
 
 load_dotenv()
 
 router = APIRouter()
+logger = get_logger("plan")
 
-# ✅ Use OpenRouter instead of OpenAI
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-if not OPENROUTER_API_KEY:
-    raise ValueError("OPENROUTER_API_KEY not found in .env")
-
+# ✅ Use OpenRouter instead of OpenAI (shared pooled client in utils/llm.py)
 MODEL = os.getenv("MODEL", "meta-llama/llama-3.3-70b-instruct")
+# Long multi-day plans from the 70B model take a while, but never hang forever
+PLAN_LLM_TIMEOUT = float(os.getenv("PLAN_LLM_TIMEOUT", "120"))
+# Tried in order when MODEL keeps failing (see utils/llm_gateway.py)
+PLAN_MODELS = llm_gateway.model_list(MODEL, os.getenv("PLAN_FALLBACK_MODELS", "meta-llama/llama-3.1-8b-instruct"))
+# Generations tried when the model's JSON does not validate as an itinerary
+PLAN_JSON_ATTEMPTS = int(os.getenv("PLAN_JSON_ATTEMPTS", "2"))
+# Long-trip mode: plans of at least LONG_TRIP_DAYS days (0 = off) start with a
+# short outline from a cheap model, then their days are written in chunks of
+# PLAN_CHUNK_DAYS, PLAN_CHUNK_CONCURRENCY chunks at a time, and stitched in
+# order. With every chunk in flight at once, latency is about one chunk's.
+LONG_TRIP_DAYS = int(os.getenv("LONG_TRIP_DAYS", "8"))
+PLAN_CHUNK_DAYS = int(os.getenv("PLAN_CHUNK_DAYS", "3"))
+PLAN_CHUNK_CONCURRENCY = int(os.getenv("PLAN_CHUNK_CONCURRENCY", "7"))
+OUTLINE_MODELS = llm_gateway.model_list(
+    os.getenv("OUTLINE_MODEL", "meta-llama/llama-3.1-8b-instruct"), os.getenv("OUTLINE_FALLBACK_MODELS", MODEL)
+)
+# Most days one edit of a saved trip may regenerate (POST /trips/{id}/days/regenerate)
+DAY_EDIT_MAX_DAYS = int(os.getenv("DAY_EDIT_MAX_DAYS", "7"))
 
 class PlanRequest(BaseModel):
     source: str
@@ -24,255 +48,645 @@ class PlanRequest(BaseModel):
     travelers: int
     budget_inr: float | None = None
     preferences: list[str] | None = None
+    fresh: bool = False # Skip the itinerary cache and force a new generation
+    markdown: bool = False # Also return the itinerary rendered as markdown
+
+WIKIPEDIA_API_URL = os.getenv("WIKIPEDIA_API_URL", "https://en.wikipedia.org/w/api.php")
+WIKIPEDIA_REST_URL = os.getenv("WIKIPEDIA_REST_URL", "https://en.wikipedia.org/api/rest_v1")
+
+# Per-dependency deadlines for the /plan fan-out. Image and flights are
+# optional extras: if they miss their deadline the plan ships without them.
+IMAGE_DEADLINE = float(os.getenv("PLAN_IMAGE_DEADLINE", "6"))
+FLIGHTS_DEADLINE = float(os.getenv("PLAN_FLIGHTS_DEADLINE", "15"))
+
+# Destination -> (page title, thumbnail) cache. Misses are cached too, for a
+# shorter time, so destinations without a picture don't hit Wikipedia forever.
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", str(30 * 24 * 3600)))
+IMAGE_NEGATIVE_CACHE_TTL = float(os.getenv("IMAGE_NEGATIVE_CACHE_TTL", str(24 * 3600)))
+image_store = get_store("destination_image", max_entries=int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "20000")))
+image_lookups = SingleFlight()
+
+class UpstreamLookupError(Exception):
+    """Transient upstream failure: report it, but don't cache it."""
+
+async def lookup_wikipedia_image(destination: str) -> dict:
+    """
+    Resolves a destination to {"title", "image_url"} via Wikipedia.
+    Either may be None when Wikipedia has no match; raises UpstreamLookupError
+    on transient failures.
+    """
+    client = get_http_client()
 
-def fetch_destination_image(destination: str) -> str | None:
+    # Search for the page title first
+    search_params = {
+        "action": "query",
+        "format": "json",
+        "list": "search",
+        "srsearch": destination,
+        "srlimit": 1
+    }
+    
     try:
-        # Search for the page title first
-        search_url = "https://en.wikipedia.org/w/api.php"
-        search_params = {
-            "action": "query",
-            "format": "json",
-            "list": "search",
-            "srsearch": destination,
-            "srlimit": 1
-        }
-        headers = {
-            "User-Agent": "TripMate/1.0 (contact@example.com)"
-        }
-        
-        response = httpx.get(search_url, params=search_params, headers=headers, timeout=5.0)
-        
-        if response.status_code != 200:
-            print(f"Wikipedia Search Error: {response.status_code} - {response.text}")
-            return None
-            
-        data = response.json()
-        
-        if not data.get("query", {}).get("search"):
-            return None
-            
-        page_title = data["query"]["search"][0]["title"]
+        response = await client.get(WIKIPEDIA_API_URL, params=search_params)
+    except httpx.HTTPError as e:
+        raise UpstreamLookupError(f"Wikipedia Search Error: {e}")
+    
+    if response.status_code != 200:
+        raise UpstreamLookupError(f"Wikipedia Search Error: {response.status_code} - {response.text}")
         
-        # Get the page summary/image
-        summary_url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{page_title}"
-        response = httpx.get(summary_url, headers=headers, timeout=5.0)
+    data = response.json()
+    
+    if not data.get("query", {}).get("search"):
+        return {"title": None, "image_url": None}
         
-        if response.status_code == 200:
-            summary_data = response.json()
-            return summary_data.get("thumbnail", {}).get("source")
-        else:
-             print(f"Wikipedia Summary Error: {response.status_code} - {response.text}")
-             return None
-            
+    page_title = data["query"]["search"][0]["title"]
+    
+    # Get the page summary/image
+    try:
+        response = await client.get(f"{WIKIPEDIA_REST_URL}/page/summary/{page_title}")
+    except httpx.HTTPError as e:
+        raise UpstreamLookupError(f"Wikipedia Summary Error: {e}")
+    
+    if response.status_code == 200:
+        summary_data = response.json()
+        return {"title": page_title, "image_url": summary_data.get("thumbnail", {}).get("source")}
+    if response.status_code == 404:
+        return {"title": page_title, "image_url": None}
+    raise UpstreamLookupError(f"Wikipedia Summary Error: {response.status_code} - {response.text}")
+
+async def resolve_destination_image(destination: str, refresh: bool = False) -> dict:
+    """Cached lookup_wikipedia_image. Concurrent calls for one destination share a single upstream request."""
+    key = canonical_destination(destination)
+
+    if not refresh:
+        entry = await asyncio.to_thread(image_store.get, key)
+        if entry is not None:
+            await asyncio.to_thread(image_store.incr, "hits")
+            return entry.value
+        await asyncio.to_thread(image_store.incr, "coalesced" if image_lookups.in_flight(key) else "misses")
+
+    async def load():
+        with metrics.track("wikipedia"):
+            resolved = await lookup_wikipedia_image(destination)
+        ttl = IMAGE_CACHE_TTL if resolved["image_url"] else IMAGE_NEGATIVE_CACHE_TTL
+        await asyncio.to_thread(image_store.set, key, resolved, ttl)
+        return resolved
+
+    return await image_lookups.do(key, load)
+
+async def fetch_destination_image(destination: str) -> str | None:
+    try:
+        resolved = await resolve_destination_image(destination)
+        return resolved["image_url"]
     except Exception as e:
-        print(f"Error fetching image for {destination}: {e}")
+        logger.warning(f"Error fetching image for {destination}: {e}")
         return None
 
+async def prewarm_destination_images(limit: int = 100) -> int:
+    """Resolves the most planned destinations from saved trips into the image cache."""
+    def top_destinations():
+        with database.SessionLocal() as db:
+            rows = db.query(models.Trip.destination, func.count(models.Trip.id).label("n")) \
+                .group_by(models.Trip.destination) \
+                .order_by(func.count(models.Trip.id).desc()) \
+                .limit(limit).all()
+        return [r.destination for r in rows if r.destination]
+
+    destinations = await asyncio.to_thread(top_destinations)
+    warmed = 0
+    for destination in destinations:
+        entry = await asyncio.to_thread(image_store.get, canonical_destination(destination))
+        if entry is not None:
+            continue
+        try:
+            await resolve_destination_image(destination, refresh=True)
+            warmed += 1
+        except Exception as e:
+            logger.warning(f"Image prewarm failed for {destination}: {e}")
+    logger.info(f"Image cache prewarm: {warmed} new of {len(destinations)} top destinations")
+    return warmed
+
+async def with_deadline(coro, seconds: float, default, label: str):
+    """Awaits `coro` for at most `seconds`; on timeout or error returns `default`."""
+    try:
+        return await asyncio.wait_for(coro, timeout=seconds)
+    except asyncio.TimeoutError:
+        logger.warning(f"Plan: {label} missed its {seconds}s deadline, continuing without it")
+    except Exception as e:
+        logger.warning(f"Plan: {label} failed ({e}), continuing without it")
+    return default
+
 from serpapi import GoogleSearch
-import os
-import random
-from datetime import datetime, timedelta
+from datetime import datetime
 
-def get_sky_ids(query: str, headers: dict) -> tuple[str, str] | None:
-    # This helper is no longer needed for SerpApi but kept to minimize diff noise or can be removed.
-    # For cleanliness, I will allow the tool to just replace the whole function block.
-    pass 
+# Leg-level SerpApi cache. Entries are fresh for FLIGHT_CACHE_TTL; with
+# FLIGHT_CACHE_SWR=1 an entry up to FLIGHT_CACHE_STALE_TTL old is served as-is
+# while one background refresh replaces it.
+FLIGHT_CACHE_TTL = float(os.getenv("FLIGHT_CACHE_TTL", "900"))
+FLIGHT_CACHE_STALE_TTL = float(os.getenv("FLIGHT_CACHE_STALE_TTL", "3600"))
+FLIGHT_CACHE_SWR = os.getenv("FLIGHT_CACHE_SWR", "1") == "1"
+FLIGHT_CURRENCY = "INR"
+SERPAPI_BASE_URL = os.getenv("SERPAPI_BASE_URL", "https://serpapi.com")
+flight_store = get_store("flight_leg", max_entries=int(os.getenv("FLIGHT_CACHE_MAX_ENTRIES", "20000")))
+flight_lookups = SingleFlight()
+_background_refreshes: set[asyncio.Task] = set()
 
-def fetch_real_flights(source: str, destination: str, start_date: str, end_date: str) -> list[dict]:
+def search_flight_leg(origin: str, dest: str, date: str, currency: str = FLIGHT_CURRENCY) -> dict | None:
     """
-    Fetches exactly TWO 'Best' flights:
-    1. Best Outbound (Source -> Dest) on Start Date
-    2. Best Return (Dest -> Source) on End Date
-    Uses SerpApi (Google Flights). Falls back to Mock if failed.
+    Best SerpApi (Google Flights) match for one one-way leg, or None when
+    there is no flight. Raises on upstream errors. Blocking.
     """
     serpapi_key = os.getenv("SERPAPI_API_KEY")
-    flight_results = []
-    
-    # Helper to fetch one leg
-    def fetch_leg(origin, dest, date, label):
-        if not serpapi_key: return None
-        try:
-            print(f"Fetching {label} flight: {origin} -> {dest} on {date}")
-            params = {
-                "engine": "google_flights",
-                "departure_id": origin,
-                "arrival_id": dest,
-                "outbound_date": date, 
-                "currency": "INR",
-                "hl": "en",
-                "api_key": serpapi_key,
-                "type": "2" # One-way search for this leg
-            }
-            search = GoogleSearch(params)
-            results = search.get_dict()
-            
-            # Get the single Best match
-            flights_list = results.get("best_flights", []) or results.get("other_flights", [])
-            if not flights_list: return None
-            
-            best_flight = flights_list[0]
-            
-            # Parse
-            flight_leg = best_flight.get("flights", [{}])[0]
-            airline = flight_leg.get("airline", "Unknown Airline")
-            flight_no = flight_leg.get("flight_number", "")
-            
-            dep_time = flight_leg.get("departure_airport", {}).get("time", "")
-            arr_time = flight_leg.get("arrival_airport", {}).get("time", "")
-            
-            duration = (best_flight.get("total_duration") or "0") + " min"
-            price = best_flight.get("price", 0)
-            
-            # Specific booking link
-            query = f"flights from {origin} to {dest} on {date} {airline}"
-            booking_link = f"https://www.google.com/travel/flights?q={query.replace(' ', '+')}"
-            
-            return {
-                "airline": f"{label}: {airline}", # Label it "Going" or "Return"
-                "flight_number": flight_no,
-                "departure_time": dep_time,
-                "arrival_time": arr_time,
-                "duration": f"{int(duration.split(' ')[0]) // 60}h {int(duration.split(' ')[0]) % 60}m",
-                "price": f"₹{price}",
-                "booking_link": booking_link
-            }
-        except Exception as e:
-            print(f"Error fetching {label}: {e}")
+    logger.info(f"Fetching flight: {origin} -> {dest} on {date}", extra={"origin": origin, "dest": dest, "date": date})
+    params = {
+        "engine": "google_flights",
+        "departure_id": origin,
+        "arrival_id": dest,
+        "outbound_date": date, 
+        "currency": currency,
+        "hl": "en",
+        "api_key": serpapi_key,
+        "type": "2" # One-way search for this leg
+    }
+    search = GoogleSearch(params)
+    search.timeout = FLIGHTS_DEADLINE # library default is 60000s
+    search.BACKEND = SERPAPI_BASE_URL
+    results = search.get_dict()
+    if "error" in results and not results.get("best_flights") and not results.get("other_flights"):
+        # SerpApi reports "no results" as an error message too
+        if "returned any results" in str(results["error"]):
             return None
+        raise UpstreamLookupError(f"SerpApi Error: {results['error']}")
 
-    # 1. Fetch Outbound
-    outbound = fetch_leg(source, destination, start_date, "Going")
-    if outbound: flight_results.append(outbound)
-    
-    # 2. Fetch Return
-    inbound = fetch_leg(destination, source, end_date, "Return")
-    if inbound: flight_results.append(inbound)
+    # Get the single Best match
+    flights_list = results.get("best_flights", []) or results.get("other_flights", [])
+    if not flights_list: return None
 
-    # Return if we found both/any
-    if flight_results:
-        return flight_results
-        
-    # --- MOCK FALLBACK ---
-    print("Using Mock Flight Data (Fallback)")
-    mock_flights = []
-    
-    # Mock Outbound
-    base_mins = 120 + random.randint(0, 100)
-    dep_dt = datetime.strptime(f"{random.randint(6, 20)}:00", "%H:%M")
-    arr_dt = dep_dt + timedelta(minutes=base_mins)
-    mock_flights.append({
-        "airline": "Going: IndiGo (Best)",
-        "flight_number": "6E-501",
-        "departure_time": dep_dt.strftime("%H:%M"),
-        "arrival_time": arr_dt.strftime("%H:%M"),
-        "duration": f"{base_mins//60}h {base_mins%60}m",
-        "price": f"₹{random.randint(4000, 8000):,}",
-        "booking_link": f"https://www.google.com/travel/flights?q=flights+from+{source}+to+{destination}+on+{start_date}+IndiGo"
-    })
-    
-    # Mock Return
-    dep_dt_ret = datetime.strptime(f"{random.randint(6, 20)}:00", "%H:%M")
-    arr_dt_ret = dep_dt_ret + timedelta(minutes=base_mins)
-    mock_flights.append({
-        "airline": "Return: Air India (Best)",
-        "flight_number": "AI-804",
-        "departure_time": dep_dt_ret.strftime("%H:%M"),
-        "arrival_time": arr_dt_ret.strftime("%H:%M"),
-        "duration": f"{base_mins//60}h {base_mins%60}m",
-        "price": f"₹{random.randint(4000, 8000):,}",
-        "booking_link": f"https://www.google.com/travel/flights?q=flights+from+{destination}+to+{source}+on+{end_date}+Air+India"
-    })
-    
-    return mock_flights
+    best_flight = flights_list[0]
 
-@router.post("/plan")
-def plan_trip(req: PlanRequest):
+    # Parse
+    flight_leg = best_flight.get("flights", [{}])[0]
+    airline = flight_leg.get("airline", "Unknown Airline")
+    flight_no = flight_leg.get("flight_number", "")
+
+    dep_time = flight_leg.get("departure_airport", {}).get("time", "")
+    arr_time = flight_leg.get("arrival_airport", {}).get("time", "")
+
+    # SerpApi sends total_duration as minutes (int)
+    minutes = int(best_flight.get("total_duration") or 0)
+    price = best_flight.get("price", 0)
+
+    # Specific booking link
+    query = f"flights from {origin} to {dest} on {date} {airline}"
+    booking_link = f"https://www.google.com/travel/flights?q={query.replace(' ', '+')}"
+
+    return {
+        "airline": airline,
+        "flight_number": flight_no,
+        "departure_time": dep_time,
+        "arrival_time": arr_time,
+        "duration": f"{minutes // 60}h {minutes % 60}m",
+        "price": f"₹{price}",
+        "booking_link": booking_link
+    }
+
+def flight_cache_key(origin: str, dest: str, date: str, currency: str) -> str:
+    return f"{origin.strip().upper()}|{dest.strip().upper()}|{date}|{currency}"
+
+async def get_flight_leg(origin: str, dest: str, date: str, currency: str = FLIGHT_CURRENCY) -> dict | None:
+    """Cached, coalesced search_flight_leg: one SerpApi call per route/date per TTL window."""
+    key = flight_cache_key(origin, dest, date, currency)
+
+    async def load():
+        with metrics.track("serpapi"):
+            flight = await asyncio.to_thread(search_flight_leg, origin, dest, date, currency)
+        ttl = FLIGHT_CACHE_STALE_TTL if FLIGHT_CACHE_SWR else FLIGHT_CACHE_TTL
+        await asyncio.to_thread(flight_store.set, key, {"flight": flight}, ttl)
+        return {"flight": flight}
+
+    entry = await asyncio.to_thread(flight_store.get, key)
+    if entry is not None and entry.age < FLIGHT_CACHE_TTL:
+        await asyncio.to_thread(flight_store.incr, "hits")
+        return entry.value["flight"]
+
+    if entry is not None and FLIGHT_CACHE_SWR:
+        # Stale but usable: answer now, refresh once in the background
+        await asyncio.to_thread(flight_store.incr, "stale_hits")
+        if not flight_lookups.in_flight(key):
+            task = asyncio.create_task(flight_lookups.do(key, load), name=f"flight-refresh:{key}")
+            _background_refreshes.add(task)
+            task.add_done_callback(_finish_background_refresh)
+        return entry.value["flight"]
+
+    await asyncio.to_thread(flight_store.incr, "coalesced" if flight_lookups.in_flight(key) else "misses")
+    return (await flight_lookups.do(key, load))["flight"]
+
+def _finish_background_refresh(task: asyncio.Task):
+    _background_refreshes.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.warning(f"Flight cache refresh failed: {task.exception()}", extra={"flight_key": task.get_name().split(":", 1)[1]})
+
+async def fetch_flight_leg(origin: str, dest: str, date: str, label: str) -> dict | None:
+    """Labelled best flight for one leg, or None (no key, no flight, or upstream error)."""
+    if not os.getenv("SERPAPI_API_KEY"): return None
     try:
-        # Fetch image
-        image_url = fetch_destination_image(req.destination)
+        flight = await get_flight_leg(origin, dest, date)
+    except Exception as e:
+        logger.warning(f"Error fetching {label} flight: {e}", extra={"origin": origin, "dest": dest, "date": date})
+        return None
+    if not flight:
+        return None
+    return {**flight, "airline": f"{label}: {flight['airline']}"} # Label it "Going" or "Return"
 
-        # Skyscanner Redirect Link Generation
-        # Try to clean strings for URL (lowercase, hyphens)
-        def clean_for_url(s):
-            return s.lower().replace(" ", "-").replace(",", "")
+async def fetch_flight_legs(source: str, destination: str, start_date: str, end_date: str) -> list[dict]:
+    """Fetches the outbound and return legs concurrently, each with its own deadline."""
+    outbound, inbound = await asyncio.gather(
+        with_deadline(fetch_flight_leg(source, destination, start_date, "Going"), FLIGHTS_DEADLINE, None, "outbound flight"),
+        with_deadline(fetch_flight_leg(destination, source, end_date, "Return"), FLIGHTS_DEADLINE, None, "return flight"),
+    )
+    return [leg for leg in (outbound, inbound) if leg]
 
-        src_slug = clean_for_url(req.source)
-        dest_slug = clean_for_url(req.destination)
-        
-        # Skyscanner format: /transport/flights/{origin}/{destination}/{yymmdd}/{yymmdd}
-        # Dates needed in YYMMDD
-        try:
-            from datetime import datetime as dt
-            s_date = dt.strptime(req.start_date, "%Y-%m-%d").strftime("%y%m%d")
-            e_date = dt.strptime(req.end_date, "%Y-%m-%d").strftime("%y%m%d")
-            
-            # Simple deep link attempt using slugs - Skyscanner is smart enough to handle city names often
-            # or fallback to search.
-            skyscanner_link = f"https://www.skyscanner.co.in/transport/flights/{src_slug}/{dest_slug}/{s_date}/{e_date}"
-        except:
-            skyscanner_link = "https://www.skyscanner.co.in/"
-
-        # Calculate actual number of days for the prompt
-        from datetime import datetime as dt
-        start = dt.strptime(req.start_date, "%Y-%m-%d")
-        end = dt.strptime(req.end_date, "%Y-%m-%d")
-        num_days = (end - start).days + 1  # Include both start and end dates
-
-        # Dummy flight object for frontend to render the button
-        flight_data = [{
-            "airline": "Skyscanner Search",
-            "flight_number": "SKY-LINK",
-            "departure_time": "",
-            "arrival_time": "",
-            "duration": "",
-            "price": "Check Prices",
-            "booking_link": skyscanner_link
-        }]
-
-        prompt = (
-            f"Create a detailed, deep-dive {num_days}-day trip plan for {req.destination} "
-            f"for {req.travelers} traveler(s), from {req.start_date} to {req.end_date}. "
-            f"Budget: ₹{req.budget_inr or 'flexible'}. "
-            f"Preferences: {', '.join(req.preferences or [])}. "
-            f"\n\n"
-            f"Please structure your response STRICTLY as follows:\n"
-            f"1. **Accommodations**: Suggest 3 specific, highly-rated hotels/resorts with estimated prices per night.\n"
-            f"2. **Detailed Itinerary**: A COMPLETE, IMMERSIVE day-by-day itinerary for ALL {num_days} days. "
-            f"For each day, use format '### Day X - [Date]' (e.g., ### Day 1 - {req.start_date}). "
-            f"Provide specific timings (Morning, Afternoon, Evening) with deep explanations of *why* to visit each spot, history, or vibe. "
-            f"Make it feel like a professional travel guide.\n"
-            f"3. **Budget Breakdown**: A table summarizing costs STRICTLY for: Hotels, Food, Activities, and Local Transport. "
-            f"❌ DO NOT INCLUDE FLIGHT COSTS in this table.\n\n"
-            f"**Tone & Formatting**: \n"
-            f"- Use **Header 1 (#)** for main title, **Header 2 (##)** for sections like Itinerary/Budget.\n"
-            f"- Use **Bold** for key places and times.\n"
-            f"- Use emojis ✨🌊🍛 *generously* to make it visually engaging and fun.\n"
-            f"- Use varied font sizes (headers) to organize information clearly."
-        )
-
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "HTTP-Referer": "http://localhost:8000",
-            "Content-Type": "application/json",
-        }
-
-        data = {
-            "model": MODEL,
-            "messages": [{"role": "user", "content": prompt}],
-        }
-
-        response = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=data)
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-
-        itinerary_body = response.json()["choices"][0]["message"]["content"]
-        
-        return {
-            "itinerary_markdown": itinerary_body,
-            "flights": flight_data,
-            "image_url": image_url
-        }
+def clean_for_url(s):
+    # Try to clean strings for URL (lowercase, hyphens)
+    return s.lower().replace(" ", "-").replace(",", "")
+
+def build_skyscanner_flights(req: PlanRequest) -> list[dict]:
+    """Dummy flight object for frontend to render the Skyscanner search button."""
+    src_slug = clean_for_url(req.source)
+    dest_slug = clean_for_url(req.destination)
+
+    # Skyscanner format: /transport/flights/{origin}/{destination}/{yymmdd}/{yymmdd}
+    # Dates needed in YYMMDD
+    try:
+        s_date = datetime.strptime(req.start_date, "%Y-%m-%d").strftime("%y%m%d")
+        e_date = datetime.strptime(req.end_date, "%Y-%m-%d").strftime("%y%m%d")
+
+        # Simple deep link attempt using slugs - Skyscanner is smart enough to handle city names often
+        # or fallback to search.
+        skyscanner_link = f"https://www.skyscanner.co.in/transport/flights/{src_slug}/{dest_slug}/{s_date}/{e_date}"
+    except:
+        skyscanner_link = "https://www.skyscanner.co.in/"
+
+    return [{
+        "airline": "Skyscanner Search",
+        "flight_number": "SKY-LINK",
+        "departure_time": "",
+        "arrival_time": "",
+        "duration": "",
+        "price": "Check Prices",
+        "booking_link": skyscanner_link
+    }]
+
+def count_trip_days(req: PlanRequest) -> int:
+    start = datetime.strptime(req.start_date, "%Y-%m-%d")
+    end = datetime.strptime(req.end_date, "%Y-%m-%d")
+    return (end - start).days + 1  # Include both start and end dates
+
+def is_long_trip(num_days: int) -> bool:
+    return bool(LONG_TRIP_DAYS) and num_days >= LONG_TRIP_DAYS
+
+def plan_template(num_days: int) -> prompts.PromptTemplate:
+    """The template that writes the days of a `num_days` plan; its id is stored on the Trip."""
+    return prompts.PLAN_CHUNK if is_long_trip(num_days) else prompts.PLAN
+
+def trip_fields(req: PlanRequest, num_days: int) -> dict:
+    # The per-request part of the planning templates (utils/prompts.py)
+    return {
+        "num_days": num_days,
+        "destination": req.destination,
+        "travelers": req.travelers,
+        "start_date": req.start_date,
+        "end_date": req.end_date,
+        "budget": req.budget_inr or "flexible",
+        "preferences": ", ".join(req.preferences or []) or "none",
+    }
+
+async def lookup_cached_itinerary(req: PlanRequest, num_days: int) -> itinerary.Itinerary | None:
+    if not itinerary_cache.ITINERARY_CACHE_ENABLED or req.fresh:
+        return None
+    key = itinerary_cache.cache_key(req, num_days, MODEL, plan_template(num_days).id)
+    try:
+        cached = await asyncio.to_thread(itinerary_cache.lookup, key, req.start_date)
+        return itinerary.assign_dates(itinerary.Itinerary.model_validate(cached), req.start_date) if cached else None
+    except Exception as e:
+        logger.warning(f"Itinerary cache read failed: {e}")
+        return None
+
+async def store_cached_itinerary(req: PlanRequest, num_days: int, plan: itinerary.Itinerary):
+    if not itinerary_cache.ITINERARY_CACHE_ENABLED:
+        return
+    key = itinerary_cache.cache_key(req, num_days, MODEL, plan_template(num_days).id)
+    try:
+        await asyncio.to_thread(itinerary_cache.store, key, req.start_date, plan.model_dump(exclude_none=True))
+    except Exception as e:
+        logger.warning(f"Itinerary cache write failed: {e}")
+
+def plan_request_kwargs(template: prompts.PromptTemplate) -> dict:
+    response_format = itinerary.response_format(template.schema)
+    return {"response_format": response_format} if response_format else {}
+
+async def complete_validated(template: prompts.PromptTemplate, fields: dict, parse,
+                             candidates: list[str] = PLAN_MODELS, what: str = "itinerary"):
+    """
+    Generates from `template` until parse(text) stops raising ItineraryError,
+    at most PLAN_JSON_ATTEMPTS times. Returns (parsed, model that served it);
+    raises LLMError.
+    """
+    messages = template.messages(**fields)
+    with metrics.prompt_label(template.id):
+        for attempt in range(PLAN_JSON_ATTEMPTS):
+            text, served_by = await llm_gateway.complete(
+                messages, models=candidates, timeout=PLAN_LLM_TIMEOUT, **plan_request_kwargs(template)
+            )
+            try:
+                return parse(text), served_by
+            except itinerary.ItineraryError as e:
+                logger.warning(f"Plan: unusable {what} from {served_by}: {e}", extra={"attempt": attempt + 1, "prompt": template.id})
+    raise llm.LLMError(502, "AI returned an invalid itinerary. Please try again.")
+
+async def generate_itinerary(req: PlanRequest, num_days: int) -> tuple[itinerary.Itinerary, str]:
+    """Whole plan in one completion. Returns (itinerary, model that served it); raises LLMError."""
+    return await complete_validated(
+        prompts.PLAN, trip_fields(req, num_days), lambda text: itinerary.parse_itinerary(text, req.start_date, num_days)
+    )
+
+async def generate_long_itinerary(req: PlanRequest, num_days: int, emit=None) -> tuple[itinerary.Itinerary, str]:
+    """
+    Long-trip mode: outline first, then the days in concurrent chunks, stitched
+    in order. `emit(event, data)`, if given, is awaited with "outline" and
+    "hotels" once the outline is ready and with each "day" as its chunk
+    completes (chunks finish in any order). Returns (itinerary, model that
+    wrote the days, MODEL unless a fallback did); raises LLMError.
+    """
+    fields = trip_fields(req, num_days)
+    outline, _ = await complete_validated(
+        prompts.PLAN_OUTLINE, fields, lambda text: itinerary.parse_outline(text, num_days), OUTLINE_MODELS, "outline"
+    )
+    if emit:
+        await emit("outline", [
+            {**day.model_dump(), "date": itinerary.day_date(req.start_date, day.day)} for day in outline.days
+        ])
+        await emit("hotels", [hotel.model_dump(exclude_none=True) for hotel in outline.hotels])
+
+    fields["outline"] = "\n".join(f"Day {day.day}: {day.area} - {day.theme}" for day in outline.days)
+    fields["hotels"] = ", ".join(hotel.name for hotel in outline.hotels) or "not chosen yet"
+    limit = asyncio.Semaphore(PLAN_CHUNK_CONCURRENCY)
+
+    async def write_chunk(first: int, last: int):
+        async with limit:
+            days, served_by = await complete_validated(
+                prompts.PLAN_CHUNK,
+                {**fields, "first": first, "last": last, "count": last - first + 1},
+                lambda text: itinerary.parse_days(text, first, last - first + 1, req.start_date),
+                what="days",
+            )
+        if emit:
+            for day in days:
+                await emit("day", day.model_dump(exclude_none=True))
+        return days, served_by
+
+    tasks = [
+        asyncio.create_task(write_chunk(first, min(first + PLAN_CHUNK_DAYS - 1, num_days)))
+        for first in range(1, num_days + 1, PLAN_CHUNK_DAYS)
+    ]
+    try:
+        chunks = await asyncio.gather(*tasks)
+    except BaseException:
+        # One chunk failed for good (or we were cancelled): the plan is lost, stop the rest
+        for t in tasks:
+            t.cancel()
+        raise
+    plan = itinerary.Itinerary(
+        title=outline.title, summary=outline.summary, hotels=outline.hotels, budget=outline.budget,
+        days=[day for days, _ in chunks for day in days],
+    )
+    served_by = next((model for _, model in chunks if model != MODEL), MODEL)
+    return plan, served_by
+
+def day_edit_fields(trip: dict, plan: itinerary.Itinerary, first: int, last: int, instruction: str) -> dict:
+    # Only the days being replaced and their direct neighbours go in, so the
+    # prompt and the reply grow with the edit, not with the trip
+    def days_text(start: int, end: int) -> str:
+        return "\n\n".join(itinerary.render_day(day) for day in plan.days[max(start, 1) - 1:end])
+
+    neighbours = ""
+    if first > 1:
+        neighbours += f"The day before (keep it in mind, do not rewrite it):\n{days_text(first - 1, first - 1)}\n\n"
+    if last < len(plan.days):
+        neighbours += f"The day after (keep it in mind, do not rewrite it):\n{days_text(last + 1, last + 1)}\n\n"
+    return {
+        "num_days": len(plan.days),
+        "destination": trip["destination"],
+        "travelers": trip["travelers"],
+        "start_date": trip["start_date"],
+        "end_date": trip["end_date"],
+        "budget": trip["budget_inr"] or "flexible",
+        "hotels": ", ".join(hotel.name for hotel in plan.hotels) or "not chosen yet",
+        "neighbours": neighbours,
+        "current": days_text(first, last),
+        "first": first,
+        "last": last,
+        "count": last - first + 1,
+        "instruction": instruction,
+    }
+
+async def regenerate_days(trip: dict, plan: itinerary.Itinerary, first: int, last: int, instruction: str) -> list[itinerary.Day]:
+    """New versions of days first..last (1-based) of a saved trip. Raises LLMError."""
+    days, _ = await complete_validated(
+        prompts.DAY_EDIT,
+        day_edit_fields(trip, plan, first, last, instruction),
+        lambda text: itinerary.parse_days(text, first, last - first + 1, trip["start_date"]),
+        what="days",
+    )
+    return days
+
+def plan_result(req: PlanRequest, plan: itinerary.Itinerary, flights: list[dict], image_url: str | None) -> dict:
+    result = {
+        "itinerary": plan.model_dump(exclude_none=True),
+        "prompt_version": plan_template(count_trip_days(req)).id, # Saved on the Trip
+        "flights": flights,
+        "image_url": image_url,
+    }
+    if req.markdown:
+        result["itinerary_markdown"] = itinerary.render_markdown(plan)
+    return result
+
+async def generate_plan(req: PlanRequest) -> dict:
+    """The /plan response body. Raises LLMError when no itinerary could be generated."""
+    # Calculate actual number of days for the prompt
+    num_days = count_trip_days(req)
+
+    # Fan out: image lookup, both flight legs and the LLM completion run
+    # concurrently, so latency is roughly the slowest of them, not the sum.
+    image_task = asyncio.create_task(
+        with_deadline(fetch_destination_image(req.destination), IMAGE_DEADLINE, None, "image")
+    )
+    flights_task = asyncio.create_task(
+        fetch_flight_legs(req.source, req.destination, req.start_date, req.end_date)
+    )
+    try:
+        # The itinerary is the product: its failure fails the request
+        plan = await lookup_cached_itinerary(req, num_days)
+        if plan is None:
+            if is_long_trip(num_days):
+                plan, served_by = await generate_long_itinerary(req, num_days)
+            else:
+                plan, served_by = await generate_itinerary(req, num_days)
+            if served_by == MODEL:
+                # Fallback-model plans are served but not cached under MODEL's key
+                await store_cached_itinerary(req, num_days, plan)
+    except BaseException:
+        image_task.cancel()
+        flights_task.cancel()
+        raise
 
+    image_url, real_flights = await asyncio.gather(image_task, flights_task)
+
+    # Real SerpApi legs when available, plus the Skyscanner search button
+    flight_data = real_flights + build_skyscanner_flights(req)
+
+    return plan_result(req, plan, flight_data, image_url)
+
+@router.post("/plan")
+async def plan_trip(req: PlanRequest):
+    try:
+        return await generate_plan(req)
+    except llm.LLMError as e:
+        # Every model and retry exhausted: pass the upstream status through (503 / 504 / ...)
+        logger.error(f"Plan Trip Error: {e.detail}", extra={"status": e.status_code})
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.retry_headers())
     except Exception as e:
-        print(f"Plan Trip Error: {e}")
+        logger.exception(f"Plan Trip Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/plan/stream")
+async def plan_trip_stream(req: PlanRequest):
+    """
+    Same plan as /plan, sent as Server-Sent Events:
+      event: flights -> flight list, once the flight legs resolve
+      event: image   -> {"image_url": ...} as soon as the lookup resolves
+      event: outline -> long trips only: [{"day", "date", "area", "theme"}] for every day
+      event: hotels  -> hotel list, as soon as the model has written it
+      event: day     -> one itinerary day, as soon as the model has written it
+                        (long trips: in chunk completion order, place by "day")
+      event: done    -> the full /plan response once everything finished
+      event: error   -> {"status_code": ..., "detail": ...}
+    """
+    try:
+        num_days = count_trip_days(req)
+        messages = prompts.PLAN.messages(**trip_fields(req, num_days))
+    except Exception as e:
+        logger.exception(f"Plan Trip Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        # Image lookup and the LLM stream both feed one queue so each event
+        # goes out the moment it is ready, whichever finishes first.
+        queue: asyncio.Queue = asyncio.Queue()
+        result = {"plan": None, "flights": build_skyscanner_flights(req), "image_url": None}
+
+        async def image_producer():
+            try:
+                result["image_url"] = await with_deadline(
+                    fetch_destination_image(req.destination), IMAGE_DEADLINE, None, "image"
+                )
+                await queue.put(format_event("image", {"image_url": result["image_url"]}))
+            except Exception as e:
+                logger.warning(f"Error fetching image for {req.destination}: {e}")
+                await queue.put(format_event("image", {"image_url": None}))
+            finally:
+                await queue.put(None)
+
+        async def flights_producer():
+            try:
+                real_flights = await fetch_flight_legs(req.source, req.destination, req.start_date, req.end_date)
+                result["flights"] = real_flights + result["flights"]
+            finally:
+                await queue.put(format_event("flights", result["flights"]))
+                await queue.put(None)
+
+        async def itinerary_producer():
+            parts = []
+            try:
+                cached = await lookup_cached_itinerary(req, num_days)
+                if cached is not None:
+                    # Whole itinerary in one go, no generation needed
+                    await queue.put(format_event("hotels", [h.model_dump(exclude_none=True) for h in cached.hotels]))
+                    for day in cached.days:
+                        await queue.put(format_event("day", day.model_dump(exclude_none=True)))
+                    result["plan"] = cached
+                    return
+                if is_long_trip(num_days):
+                    async def emit(event: str, data):
+                        await queue.put(format_event(event, data))
+
+                    result["plan"], served_by = await generate_long_itinerary(req, num_days, emit)
+                else:
+                    with metrics.prompt_label(prompts.PLAN.id):
+                        served_by, deltas = await llm_gateway.open_stream(
+                            messages, models=PLAN_MODELS, timeout=PLAN_LLM_TIMEOUT,
+                            **plan_request_kwargs(prompts.PLAN)
+                        )
+                        parser, days_sent = itinerary.StreamParser(), 0
+                        async for delta in deltas:
+                            parts.append(delta)
+                            for field, value in parser.feed(delta):
+                                if field == "hotels":
+                                    await queue.put(format_event("hotels", value))
+                                elif field == "day":
+                                    try:
+                                        day = itinerary.Day.model_validate(value)
+                                    except ValueError:
+                                        continue # The final validation reports it
+                                    days_sent += 1
+                                    day.day, day.date = days_sent, itinerary.day_date(req.start_date, days_sent)
+                                    await queue.put(format_event("day", day.model_dump(exclude_none=True)))
+                    result["plan"] = itinerary.parse_itinerary("".join(parts), req.start_date, num_days)
+                if served_by == MODEL:
+                    await store_cached_itinerary(req, num_days, result["plan"])
+            except itinerary.ItineraryError as e:
+                logger.error(f"Plan Stream Error: {e}")
+                await queue.put(format_event("error", {"status_code": 502, "detail": "AI returned an invalid itinerary. Please try again."}))
+            except llm.LLMError as e:
+                logger.error(f"Plan Stream Error: {e.detail}", extra={"status": e.status_code})
+                await queue.put(format_event("error", {"status_code": e.status_code, "detail": e.detail}))
+            except Exception as e:
+                logger.exception(f"Plan Stream Error: {e}")
+                await queue.put(format_event("error", {"status_code": 500, "detail": str(e)}))
+            finally:
+                await queue.put(None)
+
+        tasks = [
+            asyncio.create_task(image_producer()),
+            asyncio.create_task(flights_producer()),
+            asyncio.create_task(itinerary_producer()),
+        ]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                event = await queue.get()
+                if event is None:
+                    remaining -= 1
+                    continue
+                yield event
+            if result["plan"] is not None:
+                yield format_event("done", plan_result(req, result["plan"], result["flights"], result["image_url"]))
+        finally:
+            # Client went away (or we finished): stop upstream work
+            for t in tasks:
+                t.cancel()
+
+    return event_stream_response(events())
+
+@router.get("/plan/cache/stats")
+async def plan_cache_stats():
+    return {
+        "itinerary": await asyncio.to_thread(itinerary_cache.itinerary_store.stats),
+        "destination_image": await asyncio.to_thread(image_store.stats),
+        "flight_leg": await asyncio.to_thread(flight_store.stats),
+    }
+
+@router.get("/plan/llm/stats")
+async def plan_llm_stats():
+    # Per-model attempts, latency percentiles and circuit breaker state (this worker)
+    return llm_gateway.stats()
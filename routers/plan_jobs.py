@@ -0,0 +1,232 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+import crud, schemas, database
+from routers import auth
+from routers.plan import PlanRequest, generate_plan, count_trip_days
+from utils import llm, log
+
+router = APIRouter(tags=["plan"])
+logger = log.get_logger("plan_jobs")
+
+# --- CONFIG ---
+PLAN_JOBS_ENABLED = os.getenv("PLAN_JOBS_ENABLED", "1") == "1"
+PLAN_JOB_CONCURRENCY = int(os.getenv("PLAN_JOB_CONCURRENCY", "2")) # Jobs run at once, per worker
+PLAN_JOB_POLL_INTERVAL = float(os.getenv("PLAN_JOB_POLL_INTERVAL", "2")) # Pick up other workers' / orphaned jobs
+# The running worker renews its lease every third of it. A job still
+# "running" past its lease is assumed orphaned and taken over by any worker.
+PLAN_JOB_LEASE = float(os.getenv("PLAN_JOB_LEASE", "90"))
+PLAN_JOB_MAX_ATTEMPTS = int(os.getenv("PLAN_JOB_MAX_ATTEMPTS", "3"))
+PLAN_JOB_RETRY_DELAY = float(os.getenv("PLAN_JOB_RETRY_DELAY", "30"))
+PLAN_JOB_RETENTION = float(os.getenv("PLAN_JOB_RETENTION", str(7 * 24 * 3600)))
+CLEANUP_INTERVAL = 600 # Finished jobs past PLAN_JOB_RETENTION are deleted this often
+
+# Upstream trouble worth another go later; anything else fails the job
+RETRYABLE_STATUS = {429, 503, 504}
+
+
+class PlanJobRequest(PlanRequest):
+    save_as_trip: bool = False # Store the finished plan as a Trip (needs a signed-in user)
+
+
+def job_to_dict(job) -> dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "error": job.error,
+        "trip_id": job.trip_id,
+        "result": job.result if job.status == "succeeded" else None,
+    }
+
+
+def save_job_trip(job_id: str, user_id: int, req: PlanRequest, result: dict) -> str:
+    # The job id doubles as the trip id, so a job re-run after a crash
+    # between these two steps finds its trip instead of saving a second one
+    with database.SessionLocal() as db:
+        if crud.get_trip(db, job_id, user_id) is None:
+            trip = schemas.TripCreate(
+                id=job_id,
+                destination=req.destination,
+                start_date=req.start_date,
+                end_date=req.end_date,
+                travelers=req.travelers,
+                budget_inr=req.budget_inr,
+                itinerary=result["itinerary"],
+                prompt_version=result["prompt_version"],
+                flights=result["flights"],
+                image_url=result["image_url"],
+            )
+            crud.create_trip(db, trip, user_id)
+    return job_id
+
+
+class PlanJobRunner:
+    """
+    Runs queued plan jobs in this worker, PLAN_JOB_CONCURRENCY at a time.
+    Jobs are claimed from the database, so every worker's runner shares one
+    queue; new jobs from this worker are started right away via wake().
+    """
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._tasks: list[asyncio.Task] = []
+        self._wakeups: asyncio.Semaphore | None = None
+        self._last_cleanup = 0.0
+
+    def start(self):
+        self._wakeups = asyncio.Semaphore(0)
+        self._tasks = [asyncio.create_task(self._loop(slot)) for slot in range(PLAN_JOB_CONCURRENCY)]
+        logger.info(f"Plan job runner {self.worker_id}: {PLAN_JOB_CONCURRENCY} slots")
+
+    def wake(self):
+        if self._wakeups is not None:
+            self._wakeups.release()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Hand unfinished jobs straight back instead of waiting out their lease
+        try:
+            async with database.AsyncSessionLocal() as db:
+                await crud.release_plan_jobs_async(db, self.worker_id)
+        except Exception as e:
+            logger.error(f"Plan job release failed: {e}")
+
+    async def _loop(self, slot: int):
+        while True:
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    if slot == 0 and time.monotonic() - self._last_cleanup > CLEANUP_INTERVAL:
+                        self._last_cleanup = time.monotonic()
+                        await crud.delete_finished_plan_jobs_async(
+                            db, datetime.utcnow() - timedelta(seconds=PLAN_JOB_RETENTION)
+                        )
+                    job = await crud.claim_plan_job_async(db, self.worker_id, PLAN_JOB_LEASE)
+            except Exception as e:
+                logger.error(f"Plan job claim failed: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeups.acquire(), timeout=PLAN_JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _keep_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(PLAN_JOB_LEASE / 3)
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    renewed = await crud.update_plan_job_async(
+                        db, job_id, self.worker_id,
+                        lease_expires_at=datetime.utcnow() + timedelta(seconds=PLAN_JOB_LEASE),
+                    )
+            except Exception as e:
+                logger.error(f"Plan job {job_id}: lease renewal failed: {e}")
+                continue # Try again next beat; the lease still has two thirds left
+            if not renewed:
+                logger.warning(f"Plan job {job_id}: lease lost to another worker")
+                return
+
+    async def _run(self, job):
+        # Log lines of this run carry the job id where a request id would be
+        log.request_id_var.set(f"job:{job.id}")
+        logger.info(f"Plan job {job.id}: attempt {job.attempts} on {self.worker_id}")
+        heartbeat = asyncio.create_task(self._keep_lease(job.id))
+        try:
+            if job.attempts > PLAN_JOB_MAX_ATTEMPTS:
+                raise RuntimeError(f"Gave up after {PLAN_JOB_MAX_ATTEMPTS} attempts")
+            req = PlanRequest(**job.request)
+            result = await generate_plan(req)
+            trip_id = None
+            if job.save_as_trip and job.user_id is not None:
+                trip_id = await asyncio.to_thread(save_job_trip, job.id, job.user_id, req, result)
+            outcome = {"status": "succeeded", "result": result, "trip_id": trip_id, "error": None}
+        except asyncio.CancelledError:
+            raise # Shutdown: stop() requeues the job
+        except Exception as e:
+            detail = e.detail if isinstance(e, llm.LLMError) else str(e)
+            logger.warning(f"Plan job {job.id} failed: {detail}")
+            retry = (
+                isinstance(e, llm.LLMError)
+                and e.status_code in RETRYABLE_STATUS
+                and job.attempts < PLAN_JOB_MAX_ATTEMPTS
+            )
+            if retry:
+                delay = e.retry_after or PLAN_JOB_RETRY_DELAY * job.attempts
+                outcome = {"status": "queued", "error": detail, "run_after": datetime.utcnow() + timedelta(seconds=delay)}
+            else:
+                outcome = {"status": "failed", "error": detail}
+        finally:
+            heartbeat.cancel()
+
+        if outcome["status"] == "queued":
+            outcome.update(locked_by=None, lease_expires_at=None)
+        else:
+            outcome["finished_at"] = datetime.utcnow()
+        try:
+            async with database.AsyncSessionLocal() as db:
+                if not await crud.update_plan_job_async(db, job.id, self.worker_id, **outcome):
+                    logger.warning(f"Plan job {job.id}: lease lost, result discarded")
+        except Exception as e:
+            logger.error(f"Plan job {job.id}: could not record outcome: {e}")
+
+
+runner = PlanJobRunner()
+
+
+@router.post("/plan/jobs", status_code=202)
+async def create_plan_job(
+    req: PlanJobRequest,
+    response: Response,
+    current_user: schemas.CurrentUser | None = Depends(auth.get_optional_user),
+    db: AsyncSession = Depends(database.get_async_db),
+):
+    """
+    Queues a /plan run and returns at once. Poll GET /plan/jobs/{id} until
+    status is "succeeded" (result holds the /plan response) or "failed".
+    The job runs to completion whether or not the client stays connected.
+    """
+    if req.save_as_trip and current_user is None:
+        raise HTTPException(status_code=401, detail="Sign in to save the plan as a trip")
+    try:
+        count_trip_days(req)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+
+    job = await crud.create_plan_job_async(
+        db,
+        job_id=uuid.uuid4().hex,
+        user_id=current_user.id if current_user else None,
+        request=req.dict(exclude={"save_as_trip"}),
+        save_as_trip=req.save_as_trip,
+    )
+    runner.wake()
+    response.headers["Location"] = f"/plan/jobs/{job.id}"
+    return job_to_dict(job)
+
+
+@router.get("/plan/jobs/{job_id}")
+async def get_plan_job(
+    job_id: str,
+    current_user: schemas.CurrentUser | None = Depends(auth.get_optional_user),
+    db: AsyncSession = Depends(database.get_async_db),
+):
+    job = await crud.get_plan_job_async(db, job_id)
+    # A user's jobs are theirs only; anonymous jobs are guarded by the unguessable id
+    if job is None or (job.user_id is not None and (current_user is None or current_user.id != job.user_id)):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_dict(job)
@@ -1,35 +1,111 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 from typing import List
-import crud, models, schemas, database
+import crud, schemas, database
 from routers import auth
+from utils.pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor
+from utils.conditional import make_etag, if_none_match, set_validators, not_modified
+from utils import itinerary, llm
+from routers.plan import DAY_EDIT_MAX_DAYS, regenerate_days
 
+# Every route below takes current_user, which protects it. No router-level
+# dependency on top of that, so auth is resolved once per request.
 router = APIRouter(
     prefix="/trips",
     tags=["trips"],
-    dependencies=[Depends(auth.get_current_user)] # Protect all trip routes
 )
 
 @router.post("/", response_model=schemas.Trip)
 def create_trip(
     trip: schemas.TripCreate, 
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.CurrentUser = Depends(auth.get_current_user)
 ):
     return crud.create_trip(db=db, trip=trip, user_id=current_user.id)
 
-@router.get("/", response_model=List[schemas.Trip])
+@router.get("/", response_model=List[schemas.TripSummary])
 def read_trips(
+    request: Request,
+    response: Response,
+    before: str | None = Query(None, description="Cursor from a previous page's X-Next-Cursor header"),
+    limit: int = Query(20, ge=1, le=100),
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.CurrentUser = Depends(auth.get_current_user)
 ):
-    return crud.get_trips(db=db, user_id=current_user.id)
+    # Newest first. X-Next-Cursor is set when older trips exist (pass it back as ?before=)
+    before_key = decode_cursor(before) if before else None
+
+    # Polling: if nothing changed since the client's copy, skip the listing query
+    version, changed_at = crud.get_change_version(db, current_user.id, crud.TRIPS_SCOPE)
+    etag = make_etag(crud.TRIPS_SCOPE, current_user.id, version, before, limit)
+    if if_none_match(request, etag):
+        return not_modified(etag, changed_at)
+    set_validators(response, etag, changed_at)
+
+    trips, has_more = crud.get_trip_summaries(db=db, user_id=current_user.id, limit=limit, before=before_key)
+    if has_more and trips:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(trips[-1].created_at, trips[-1].id)
+    return trips
+
+@router.get("/{trip_id}", response_model=schemas.Trip)
+def read_trip(
+    trip_id: str,
+    markdown: bool = Query(False, description="Also render the itinerary as markdown"),
+    db: Session = Depends(database.get_db),
+    current_user: schemas.CurrentUser = Depends(auth.get_current_user)
+):
+    trip = crud.get_trip(db=db, trip_id=trip_id, user_id=current_user.id)
+    if trip is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    if markdown and trip["itinerary"] is not None:
+        trip["itinerary_markdown"] = itinerary.render_markdown(itinerary.Itinerary.model_validate(trip["itinerary"]))
+    return trip
+
+@router.post("/{trip_id}/days/regenerate", response_model=schemas.Trip)
+async def regenerate_trip_days(
+    trip_id: str,
+    edit: schemas.TripDayEdit,
+    markdown: bool = Query(False, description="Also render the itinerary as markdown"),
+    current_user: schemas.CurrentUser = Depends(auth.get_current_user)
+):
+    """
+    Regenerates days from_day..to_day of a saved trip following `instruction`,
+    with the neighbouring days as context, and patches them into the stored
+    itinerary. Returns the updated trip.
+    """
+    # Short sessions on either side: no connection is held during generation
+    async with database.AsyncSessionLocal() as db:
+        trip = await crud.get_trip_async(db, trip_id, current_user.id)
+    if trip is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    if trip["itinerary"] is None:
+        raise HTTPException(status_code=409, detail="This trip was saved before editable itineraries. Plan it again to edit days.")
+    plan = itinerary.Itinerary.model_validate(trip["itinerary"])
+    if edit.to_day > len(plan.days):
+        raise HTTPException(status_code=400, detail=f"The trip has {len(plan.days)} days")
+    if edit.to_day - edit.from_day + 1 > DAY_EDIT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {DAY_EDIT_MAX_DAYS} days can be regenerated at once")
+
+    try:
+        days = await regenerate_days(trip, plan, edit.from_day, edit.to_day, edit.instruction)
+    except llm.LLMError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.retry_headers())
+
+    async with database.AsyncSessionLocal() as db:
+        trip = await crud.replace_trip_days_async(
+            db, trip_id, current_user.id, [day.model_dump(exclude_none=True) for day in days]
+        )
+    if trip is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    if markdown:
+        trip["itinerary_markdown"] = itinerary.render_markdown(itinerary.Itinerary.model_validate(trip["itinerary"]))
+    return trip
 
 @router.delete("/{trip_id}")
 def delete_trip(
     trip_id: str, 
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: schemas.CurrentUser = Depends(auth.get_current_user)
 ):
     success = crud.delete_trip(db=db, trip_id=trip_id, user_id=current_user.id)
     if not success:
@@ -1,6 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 from typing import List, Optional
 from datetime import datetime
+from utils.itinerary import Itinerary
 
 # --- Token Schemas ---
 class Token(BaseModel):
@@ -9,6 +10,8 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: str | None = None
+    user_id: int | None = None
+    version: int | None = None
 
 # --- User Schemas ---
 class UserBase(BaseModel):
@@ -27,6 +30,10 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class CurrentUser(User):
+    # Snapshot of the authenticated user, cached in-process by the auth layer
+    token_version: int = 0
+
 # --- Trip Schemas ---
 # Matches Flutter TripPlan logic
 
@@ -46,13 +53,47 @@ class TripBase(BaseModel):
     end_date: str
     travelers: int
     budget_inr: Optional[float] = None
-    itinerary_markdown: str
+    itinerary: Optional[Itinerary] = None
+    itinerary_markdown: Optional[str] = None # Legacy trips; rendered from `itinerary` on request
+    prompt_version: Optional[str] = None # From the /plan response
     flights: Optional[List[Flight]] = None
     image_url: Optional[str] = None
     created_at: Optional[datetime] = None
 
 class TripCreate(TripBase):
-    pass
+    @model_validator(mode="after")
+    def has_itinerary(self):
+        if self.itinerary is None and not self.itinerary_markdown:
+            raise ValueError("itinerary (or itinerary_markdown) is required")
+        return self
+
+class TripDayEdit(BaseModel):
+    # Regenerate days from_day..to_day (1-based, inclusive) following the instruction
+    from_day: int
+    to_day: Optional[int] = None # Defaults to from_day
+    instruction: str
+
+    @model_validator(mode="after")
+    def check_range(self):
+        if self.to_day is None:
+            self.to_day = self.from_day
+        if self.from_day < 1 or self.to_day < self.from_day:
+            raise ValueError("from_day must be >= 1 and to_day >= from_day")
+        if not self.instruction.strip():
+            raise ValueError("instruction is required")
+        return self
+
+class TripSummary(BaseModel):
+    # Lightweight row for trip lists; full detail comes from GET /trips/{id}
+    id: str
+    destination: str
+    start_date: str
+    end_date: str
+    image_url: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
 
 class Trip(TripBase):
     user_id: int 
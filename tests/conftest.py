@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Before any app module is imported: they read their config at import time
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+os.environ["CACHE_BACKEND"] = "memory"
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="tripmate-tests-"), "test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
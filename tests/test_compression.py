@@ -0,0 +1,77 @@
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, insert, select, text
+
+from utils import compression
+from utils.compression import CompressedJSON, CompressedText
+
+ITINERARY = {"title": "Goa ✨", "days": [{"day": n, "title": f"Beaches of North Goa, day {n}"} for n in range(1, 8)]}
+MARKDOWN = "### Day 1: Beaches 🌊\n- **Morning** — Baga\n" * 20
+DICTIONARY = b'{"day": "title": "Beaches of North Goa, "slots": [{"time": "Morning", "Afternoon", "Evening"' * 40
+
+
+@pytest.fixture(autouse=True)
+def no_dictionaries(monkeypatch):
+    # Each test registers its own dictionaries
+    monkeypatch.setattr(compression, "_dicts", {})
+    monkeypatch.setattr(compression, "_active", {})
+
+
+@pytest.fixture
+def table():
+    engine = create_engine("sqlite://")
+    trips = Table(
+        "trips", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("itinerary", CompressedJSON),
+        Column("markdown", CompressedText),
+    )
+    trips.metadata.create_all(engine)
+    with engine.connect() as conn:
+        yield conn, trips
+
+
+def round_trip(conn, trips):
+    conn.execute(insert(trips).values(id=1, itinerary=ITINERARY, markdown=MARKDOWN))
+    stored = conn.execute(text("SELECT itinerary, markdown FROM trips")).one()
+    row = conn.execute(select(trips.c.itinerary, trips.c.markdown)).one()
+    return stored, row
+
+
+@pytest.mark.parametrize("with_dictionary", [False, True])
+def test_zlib_round_trip(monkeypatch, table, with_dictionary):
+    monkeypatch.setattr(compression, "ITINERARY_CODEC", "zlib")
+    if with_dictionary:
+        compression.register_dictionary(1, compression.CODEC_ZLIB, DICTIONARY)
+    stored, row = round_trip(*table)
+    assert row == (ITINERARY, MARKDOWN)
+    magic, codec, dict_id = compression.HEADER.unpack_from(stored.markdown)
+    assert (magic, codec, dict_id) == (compression.MAGIC, compression.CODEC_ZLIB, int(with_dictionary))
+    assert len(stored.markdown) < len(MARKDOWN.encode())
+
+
+def test_zstd_round_trip_with_dictionary(monkeypatch, table):
+    pytest.importorskip("zstandard")
+    monkeypatch.setattr(compression, "ITINERARY_CODEC", "zstd")
+    compression.register_dictionary(2, compression.CODEC_ZSTD, DICTIONARY)
+    stored, row = round_trip(*table)
+    assert row == (ITINERARY, MARKDOWN)
+    assert compression.HEADER.unpack_from(stored.itinerary) == (compression.MAGIC, compression.CODEC_ZSTD, 2)
+
+
+def test_older_dictionary_still_reads(monkeypatch, table):
+    monkeypatch.setattr(compression, "ITINERARY_CODEC", "zlib")
+    compression.register_dictionary(1, compression.CODEC_ZLIB, DICTIONARY)
+    round_trip(*table)
+    compression.register_dictionary(3, compression.CODEC_ZLIB, b"a newer dictionary" * 10)
+    conn, trips = table
+    assert conn.execute(select(trips.c.itinerary)).scalar_one() == ITINERARY
+
+
+def test_legacy_plain_text_rows(table):
+    conn, trips = table
+    conn.execute(text("INSERT INTO trips (id, itinerary, markdown) VALUES (1, :itinerary, :markdown)"),
+                 {"itinerary": '{"title": "Old trip", "days": []}', "markdown": MARKDOWN})
+    conn.execute(text("INSERT INTO trips (id, markdown) VALUES (2, :markdown)"), {"markdown": MARKDOWN.encode()})
+    rows = conn.execute(select(trips.c.itinerary, trips.c.markdown).order_by(trips.c.id)).all()
+    assert rows[0] == ({"title": "Old trip", "days": []}, MARKDOWN)
+    assert rows[1] == (None, MARKDOWN)
@@ -0,0 +1,45 @@
+import asyncio
+import os
+
+os.environ["SERPAPI_API_KEY"] = "test"
+
+from routers import plan  # noqa: E402
+from utils.cache import MemoryStore  # noqa: E402
+
+
+class FakeSearch:
+    calls = 0
+
+    def __init__(self, params):
+        self.params = params
+
+    def get_dict(self):
+        FakeSearch.calls += 1
+        return {"best_flights": [{
+            "flights": [{
+                "airline": "IndiGo",
+                "flight_number": "6E 101",
+                "departure_airport": {"time": "2026-01-01 08:10"},
+                "arrival_airport": {"time": "2026-01-01 10:25"},
+            }],
+            "total_duration": 135, # An int, as SerpApi sends it
+            "price": 5400,
+        }]}
+
+
+def test_int_total_duration_is_parsed_and_cached(monkeypatch):
+    monkeypatch.setattr(plan, "GoogleSearch", FakeSearch)
+    monkeypatch.setattr(plan, "flight_store", MemoryStore("flight_leg", max_entries=100))
+    FakeSearch.calls = 0
+
+    async def lookups():
+        first = await plan.fetch_flight_leg("BOM", "DXB", "2026-01-01", "Going")
+        second = await plan.fetch_flight_leg("BOM", "DXB", "2026-01-01", "Going")
+        return first, second
+
+    first, second = asyncio.run(lookups())
+    assert first["duration"] == "2h 15m"
+    assert first["airline"] == "Going: IndiGo"
+    assert second == first
+    assert FakeSearch.calls == 1
+    assert plan.flight_store.stats()["hits"] == 1
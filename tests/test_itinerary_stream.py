@@ -0,0 +1,95 @@
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import plan
+from utils import itinerary
+
+
+def day(n: int, title: str = "") -> dict:
+    return {"day": n, "title": title or f"Day {n}", "slots": [{"time": "Morning", "title": "Beach", "places": [{"name": "Baga"}]}]}
+
+
+PLAN = {
+    "title": "Goa",
+    "summary": "Sun and sand",
+    "hotels": [{"name": "Taj", "price_per_night_inr": 9000}],
+    "days": [day(1), day(2), day(3)],
+    "budget": [{"category": "Food", "amount_inr": 6000}],
+    "travelers": 2, # A bare number last: only closed by the final brace
+}
+TEXT = json.dumps(PLAN, ensure_ascii=False, indent=1)
+
+
+def feed(text: str, size: int) -> list[tuple[str, object]]:
+    parser = itinerary.StreamParser()
+    found = []
+    for start in range(0, len(text), size):
+        found += parser.feed(text[start:start + size])
+    return found
+
+
+EXPECTED = [
+    ("title", "Goa"), ("summary", "Sun and sand"), ("hotels", PLAN["hotels"]),
+    ("day", day(1)), ("day", day(2)), ("day", day(3)), ("days", PLAN["days"]),
+    ("budget", PLAN["budget"]), ("travelers", 2),
+]
+
+
+def test_fields_and_days_come_out_in_order():
+    assert feed(TEXT, len(TEXT)) == EXPECTED
+
+
+def test_chunk_boundaries_do_not_matter():
+    for size in (1, 2, 3, 7, 64):
+        assert feed(TEXT, size) == EXPECTED
+
+
+def test_braces_and_quotes_inside_strings():
+    tricky = day(1, 'Fort {Aguada} ] [ "old" \\ lighthouse }')
+    text = json.dumps({"title": "a } b", "days": [tricky, day(2)]})
+    assert feed(text, 1) == [("title", "a } b"), ("day", tricky), ("day", day(2)), ("days", [tricky, day(2)])]
+
+
+def test_code_fenced_reply():
+    assert feed("```json\n" + TEXT + "\n```", 5) == EXPECTED
+
+
+def test_stream_sends_hotels_days_then_done(monkeypatch):
+    async def no_image(destination):
+        return None
+
+    async def no_flights(*args):
+        return []
+
+    async def nothing_cached(req, num_days):
+        return None
+
+    async def store(*args):
+        pass
+
+    async def open_stream(messages, models, **kwargs):
+        async def deltas():
+            for start in range(0, len(TEXT), 16):
+                yield TEXT[start:start + 16]
+        return models[0], deltas()
+
+    monkeypatch.setattr(plan, "fetch_destination_image", no_image)
+    monkeypatch.setattr(plan, "fetch_flight_legs", no_flights)
+    monkeypatch.setattr(plan, "lookup_cached_itinerary", nothing_cached)
+    monkeypatch.setattr(plan, "store_cached_itinerary", store)
+    monkeypatch.setattr(plan.llm_gateway, "open_stream", open_stream)
+    app = FastAPI()
+    app.include_router(plan.router)
+
+    response = TestClient(app).post("/plan/stream", json={
+        "source": "Mumbai", "destination": "Goa", "start_date": "2026-01-01", "end_date": "2026-01-03", "travelers": 2,
+    })
+    lines = response.text.splitlines()
+    events = [(line[7:], json.loads(data[6:])) for line, data in zip(lines, lines[1:]) if line.startswith("event: ")]
+    itinerary_events = [name for name, _ in events if name not in ("image", "flights")]
+    assert itinerary_events == ["hotels", "day", "day", "day", "done"]
+    assert [data["day"] for name, data in events if name == "day"] == [1, 2, 3]
+    assert [data["date"] for name, data in events if name == "day"] == ["2026-01-01", "2026-01-02", "2026-01-03"]
+    assert events[-1][1]["itinerary"]["title"] == "Goa"
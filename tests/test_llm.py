@@ -0,0 +1,30 @@
+import asyncio
+
+import httpx
+import pytest
+
+from utils import llm
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def use_upstream(monkeypatch, handler):
+    monkeypatch.setattr(llm, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+
+def test_reply_text_is_returned(monkeypatch):
+    use_upstream(monkeypatch, lambda request: httpx.Response(200, json={"choices": [{"message": {"content": "hello"}}]}))
+    assert asyncio.run(llm.chat_completion(MESSAGES, "m")) == "hello"
+
+
+@pytest.mark.parametrize("reply", [
+    httpx.Response(200, text="<html>Bad gateway</html>"),
+    httpx.Response(200, json={"choices": []}),
+    httpx.Response(200, json={"choices": [{"delta": {}}]}),
+    httpx.Response(200, json=["not", "an", "object"]),
+])
+def test_malformed_reply_is_an_upstream_error(monkeypatch, reply):
+    use_upstream(monkeypatch, lambda request: reply)
+    with pytest.raises(llm.LLMError) as e:
+        asyncio.run(llm.chat_completion(MESSAGES, "m"))
+    assert e.value.status_code == 502
@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from utils import llm, llm_gateway
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+class Upstream:
+    """Stubbed OpenRouter: replies per model from a script, records who was called."""
+
+    def __init__(self, **script):
+        self.script = {model.replace("_", "-"): list(replies) for model, replies in script.items()}
+        self.calls: list[str] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        model = json.loads(request.content)["model"]
+        self.calls.append(model)
+        replies = self.script[model]
+        status = replies.pop(0) if len(replies) > 1 else replies[0]
+        if status != 200:
+            return httpx.Response(status, text="upstream trouble")
+        return httpx.Response(200, json={"model": model, "choices": [{"message": {"content": f"from {model}"}}]})
+
+
+@pytest.fixture(autouse=True)
+def gateway(monkeypatch):
+    # Fresh breakers and stats, no real backoff waits
+    monkeypatch.setattr(llm_gateway, "_breakers", {})
+    monkeypatch.setattr(llm_gateway, "_stats", {})
+    monkeypatch.setattr(llm_gateway, "LLM_RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(llm_gateway, "LLM_MAX_RETRIES", 2)
+    monkeypatch.setattr(llm_gateway, "LLM_HEDGE_AFTER", 0)
+
+
+def use_upstream(monkeypatch, upstream: Upstream):
+    monkeypatch.setattr(llm, "_client", httpx.AsyncClient(transport=httpx.MockTransport(upstream)))
+
+
+def complete(models: list[str]):
+    return asyncio.run(llm_gateway.complete(MESSAGES, models=models))
+
+
+def test_retryable_error_then_success(monkeypatch):
+    upstream = Upstream(primary=[429, 200])
+    use_upstream(monkeypatch, upstream)
+    assert complete(["primary"]) == ("from primary", "primary")
+    assert upstream.calls == ["primary", "primary"]
+    assert llm_gateway.breaker("primary").state == "closed"
+
+
+def test_client_error_is_not_retried(monkeypatch):
+    upstream = Upstream(primary=[400], backup=[200])
+    use_upstream(monkeypatch, upstream)
+    with pytest.raises(llm.LLMError) as e:
+        complete(["primary", "backup"])
+    assert e.value.status_code == 400
+    assert upstream.calls == ["primary"]
+
+
+def test_fallback_model_serves_when_primary_fails(monkeypatch):
+    upstream = Upstream(primary=[503], backup=[200])
+    use_upstream(monkeypatch, upstream)
+    assert complete(["primary", "backup"]) == ("from backup", "backup")
+    assert upstream.calls == ["primary"] * 3 + ["backup"]
+    assert llm_gateway.stats()["backup"]["fallbacks"] == 1
+
+
+def test_breaker_opens_then_half_opens(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_BREAKER_FAILURES", 3)
+    monkeypatch.setattr(llm_gateway, "LLM_BREAKER_COOLDOWN", 0.2)
+    upstream = Upstream(primary=[503, 503, 503, 200], backup=[200])
+    use_upstream(monkeypatch, upstream)
+
+    # Three straight failures open the breaker; the backup serves
+    assert complete(["primary", "backup"]) == ("from backup", "backup")
+    assert llm_gateway.breaker("primary").state == "open"
+
+    # Open: primary is skipped without an upstream call
+    upstream.calls.clear()
+    assert complete(["primary", "backup"]) == ("from backup", "backup")
+    assert upstream.calls == ["backup"]
+
+    # After the cooldown one probe goes through, and its success closes the breaker
+    asyncio.run(asyncio.sleep(0.25))
+    assert llm_gateway.breaker("primary").state == "half-open"
+    upstream.calls.clear()
+    assert complete(["primary", "backup"]) == ("from primary", "primary")
+    assert upstream.calls == ["primary"]
+    assert llm_gateway.breaker("primary").state == "closed"
+
+
+def test_failed_probe_reopens_the_breaker(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_BREAKER_FAILURES", 3)
+    monkeypatch.setattr(llm_gateway, "LLM_BREAKER_COOLDOWN", 0.2)
+    upstream = Upstream(primary=[503], backup=[200])
+    use_upstream(monkeypatch, upstream)
+    complete(["primary", "backup"])
+    asyncio.run(asyncio.sleep(0.25))
+
+    upstream.calls.clear()
+    assert complete(["primary", "backup"]) == ("from backup", "backup")
+    assert upstream.calls == ["primary", "backup"] # One probe, not a full retry round
+    assert llm_gateway.breaker("primary").state == "open"
@@ -0,0 +1,37 @@
+import asyncio
+
+import crud
+import database
+from routers import plan_jobs
+
+REQUEST = {
+    "source": "Mumbai", "destination": "Goa", "start_date": "2026-01-01", "end_date": "2026-01-03", "travelers": 2,
+}
+
+
+def test_lease_is_renewed_while_the_job_runs(monkeypatch):
+    database.Base.metadata.create_all(bind=database.engine)
+    monkeypatch.setattr(plan_jobs, "PLAN_JOB_LEASE", 0.3)
+
+    async def slow_plan(req):
+        await asyncio.sleep(1.2) # Four leases long
+        return {"itinerary": "ok"}
+
+    monkeypatch.setattr(plan_jobs, "generate_plan", slow_plan)
+    runner = plan_jobs.PlanJobRunner()
+
+    async def scenario():
+        async with database.AsyncSessionLocal() as db:
+            await crud.create_plan_job_async(db, "lease-job", None, REQUEST, False)
+            job = await crud.claim_plan_job_async(db, runner.worker_id, plan_jobs.PLAN_JOB_LEASE)
+        run = asyncio.create_task(runner._run(job))
+        await asyncio.sleep(0.8)
+        async with database.AsyncSessionLocal() as db:
+            stolen = await crud.claim_plan_job_async(db, "other-worker", plan_jobs.PLAN_JOB_LEASE)
+        await run
+        async with database.AsyncSessionLocal() as db:
+            return stolen, await crud.get_plan_job_async(db, "lease-job")
+
+    stolen, job = asyncio.run(scenario())
+    assert stolen is None
+    assert job.status == "succeeded" and job.locked_by == runner.worker_id
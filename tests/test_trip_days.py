@@ -0,0 +1,42 @@
+import asyncio
+
+import crud
+import database
+import models
+
+
+def make_trip(trip_id: str, num_days: int) -> int:
+    database.Base.metadata.create_all(bind=database.engine)
+    with database.SessionLocal() as db:
+        user = models.User(email=f"{trip_id}@example.com", hashed_password="x")
+        db.add(user)
+        db.flush()
+        db.add(models.Trip(
+            id=trip_id, user_id=user.id, destination="Goa", start_date="2026-01-01", end_date="2026-01-04",
+            travelers=2, itinerary={"title": "Goa", "days": [{"day": n, "title": f"Day {n}"} for n in range(1, num_days + 1)]},
+        ))
+        db.commit()
+        return user.id
+
+
+def test_concurrent_day_edits_are_all_kept(monkeypatch):
+    user_id = make_trip("concurrent-edits", 4)
+    bump = crud.bump_change_version_async
+
+    async def slow_bump(*args):
+        await asyncio.sleep(0.05) # Between the read and the commit: let the other edits read too
+        await bump(*args)
+
+    monkeypatch.setattr(crud, "bump_change_version_async", slow_bump)
+
+    async def edit(day: int):
+        async with database.AsyncSessionLocal() as db:
+            return await crud.replace_trip_days_async(db, "concurrent-edits", user_id, [{"day": day, "title": f"New {day}"}])
+
+    async def edits():
+        await asyncio.gather(*(edit(day) for day in range(1, 5)))
+        async with database.AsyncSessionLocal() as db:
+            return await crud.get_trip_async(db, "concurrent-edits", user_id)
+
+    trip = asyncio.run(edits())
+    assert [day["title"] for day in trip["itinerary"]["days"]] == ["New 1", "New 2", "New 3", "New 4"]
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from utils import metrics
+
+# --- CONFIG ---
+# "sqlite" shares entries between all gunicorn workers on the box,
+# "memory" keeps them per process (handy for tests / single worker dev).
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "./tripmate_cache.db")
+
+# Only rewrite last_access when it is this stale, so hot keys don't turn
+# every read into a write.
+TOUCH_INTERVAL = 30.0
+
+
+@dataclass
+class CacheEntry:
+    value: object
+    stored_at: float
+    expires_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.stored_at
+
+
+class CacheStore(ABC):
+    """
+    Namespaced key/value store with TTL and LRU eviction.
+    Values must be JSON serializable. All methods are blocking; call them via
+    asyncio.to_thread from async code.
+    """
+
+    def __init__(self, namespace: str, max_entries: int):
+        self.namespace = namespace
+        self.max_entries = max_entries
+
+    @abstractmethod
+    def get(self, key: str) -> CacheEntry | None:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value, ttl: float):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def incr(self, counter: str, amount: int = 1):
+        ...
+
+    @abstractmethod
+    def counters(self) -> dict:
+        ...
+
+    def stats(self) -> dict:
+        counters = self.counters()
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        total = hits + misses
+        return {
+            "namespace": self.namespace,
+            "backend": type(self).__name__,
+            **counters,
+            "hit_ratio": round(hits / total, 4) if total else None,
+        }
+
+
+class MemoryStore(CacheStore):
+    def __init__(self, namespace: str, max_entries: int):
+        super().__init__(namespace, max_entries)
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._entries[key] = CacheEntry(value, now, now + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, counter, amount=1):
+        metrics.CACHE_EVENTS.labels(self.namespace, counter).inc(amount)
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def counters(self):
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries)}
+
+
+# Connections are shared by every store in the process (cache namespaces, rate
+# limiter), so is the lock that serializes their use
+_conns: dict[str, sqlite3.Connection] = {}
+connection_lock = threading.RLock()
+
+
+def shared_connection(path: str) -> sqlite3.Connection:
+    """Autocommit connection to `path`; use it with connection_lock held."""
+    # One connection per process and file. Connections must not survive a
+    # fork, so the pid is part of the key.
+    conn_key = f"{os.getpid()}:{path}"
+    with connection_lock:
+        conn = _conns.get(conn_key)
+        if conn is None:
+            conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _conns[conn_key] = conn
+        return conn
+
+
+class SQLiteStore(CacheStore):
+    """One local SQLite file shared by every worker process (WAL mode)."""
+
+    _lock = connection_lock
+
+    def __init__(self, namespace: str, max_entries: int, path: str = CACHE_DB_PATH):
+        super().__init__(namespace, max_entries)
+        self.path = path
+        with self._lock:
+            conn = self._connect()
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                );
+                CREATE INDEX IF NOT EXISTS ix_cache_entries_lru ON cache_entries (namespace, last_access);
+                CREATE TABLE IF NOT EXISTS cache_counters (
+                    namespace TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    value INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (namespace, name)
+                );
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return shared_connection(self.path)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, stored_at, expires_at, last_access FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            value, stored_at, expires_at, last_access = row
+            if expires_at <= now:
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+                return None
+            if now - last_access > TOUCH_INTERVAL:
+                conn.execute(
+                    "UPDATE cache_entries SET last_access = ? WHERE namespace = ? AND key = ?",
+                    (now, self.namespace, key),
+                )
+        return CacheEntry(json.loads(value), stored_at, expires_at)
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, stored_at, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, payload, now, now + ttl, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?", (self.namespace, now))
+        (count,) = conn.execute("SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)).fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY last_access LIMIT ?)",
+                (self.namespace, self.namespace, overflow),
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._connect().execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def incr(self, counter, amount=1):
+        metrics.CACHE_EVENTS.labels(self.namespace, counter).inc(amount)
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO cache_counters (namespace, name, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(namespace, name) DO UPDATE SET value = value + excluded.value",
+                (self.namespace, counter, amount),
+            )
+
+    def counters(self):
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute("SELECT name, value FROM cache_counters WHERE namespace = ?", (self.namespace,)).fetchall()
+            (entries,) = conn.execute("SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)).fetchone()
+        return {**dict(rows), "entries": entries}
+
+
+_stores: dict[str, CacheStore] = {}
+
+
+def get_store(namespace: str, max_entries: int = 10000) -> CacheStore:
+    """Returns the process-wide store for `namespace` using the configured backend."""
+    store = _stores.get(namespace)
+    if store is None:
+        if CACHE_BACKEND == "memory":
+            store = MemoryStore(namespace, max_entries)
+        else:
+            store = SQLiteStore(namespace, max_entries)
+        _stores[namespace] = store
+    return store
@@ -0,0 +1,164 @@
+import os
+import math
+import asyncio
+import crud, database
+from utils import llm_gateway
+from utils.coalesce import SingleFlight
+from utils.log import get_logger
+
+try:
+    import tiktoken
+except ImportError: # Optional: a character-based estimate is used when it is missing
+    tiktoken = None
+
+# --- CONFIG ---
+# Whole prompt: system prompt + rolling summary + as many recent turns as fit
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "3000"))
+# Any one message is cut to this, so a long itinerary reply can't eat the window
+CHAT_MESSAGE_TOKEN_CAP = int(os.getenv("CHAT_MESSAGE_TOKEN_CAP", "800"))
+CHAT_CONTEXT_MAX_MESSAGES = int(os.getenv("CHAT_CONTEXT_MAX_MESSAGES", "40")) # Rows read per request
+# Refresh the summary once this much history has fallen out of the window
+CHAT_SUMMARY_TRIGGER_TOKENS = int(os.getenv("CHAT_SUMMARY_TRIGGER_TOKENS", "600"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "400"))
+CHAT_SUMMARY_BATCH_MESSAGES = 20
+CHAT_SUMMARY_MESSAGE_TOKEN_CAP = 400
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", os.getenv("MODEL", "meta-llama/llama-3.1-8b-instruct"))
+MESSAGE_OVERHEAD_TOKENS = 4 # Role and separators around each chat message
+TRUNCATION_MARKER = " … [truncated]"
+
+logger = get_logger("chat_context")
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and a travel-planning assistant. "
+    "Update the current summary with the new messages. Keep durable facts: the user's name, home city, "
+    "travel dates, destinations discussed, budget, preferences and decisions already made. Drop small talk. "
+    "Reply with the updated summary only, at most 150 words."
+)
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception: # Encoding files unavailable offline
+        _encoding = None
+
+_summaries = SingleFlight()
+_background: set[asyncio.Task] = set()
+
+
+def estimate_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # ~4 characters per token for English; non-ASCII scripts (Hindi, emoji)
+    # run close to one token per character
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return math.ceil((len(text) - non_ascii) / 4) + non_ascii
+
+
+def payload_tokens(messages: list[dict]) -> int:
+    return sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max(max_tokens - estimate_tokens(TRUNCATION_MARKER), 0)
+    cut = len(text)
+    while cut > 0 and (tokens := estimate_tokens(text[:cut])) > limit:
+        cut = int(cut * limit / tokens * 0.95)
+    return text[:cut].rstrip() + TRUNCATION_MARKER
+
+
+async def build_context(db, user_id: int, system_prompt: str) -> list[dict]:
+    """
+    Messages payload for the next reply: the system prompt, the user's rolling
+    summary of older turns, then the newest turns that fit the token budget
+    (oldest first). Schedules a summary refresh once enough history has
+    dropped out of the window.
+    """
+    messages = [{"role": "system", "content": system_prompt}]
+    summary = await crud.get_chat_summary_async(db, user_id)
+    through_id = summary.through_message_id if summary else 0
+    if summary and summary.summary:
+        messages.append({
+            "role": "system",
+            "content": "Summary of the earlier conversation with this user:\n"
+            + truncate_to_tokens(summary.summary, CHAT_SUMMARY_MAX_TOKENS),
+        })
+    budget = CHAT_CONTEXT_TOKEN_BUDGET - payload_tokens(messages)
+
+    # Only turns the summary doesn't cover yet, newest first
+    recent = await crud.get_messages_between_async(
+        db, user_id, after_id=through_id, limit=CHAT_CONTEXT_MAX_MESSAGES, newest_first=True
+    )
+    window = []
+    for msg in recent:
+        content = msg.content or ""
+        if window: # The newest message (the one being answered) goes in whole
+            content = truncate_to_tokens(content, CHAT_MESSAGE_TOKEN_CAP)
+        cost = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        if window and cost > budget:
+            break
+        window.append({"role": msg.role, "content": content})
+        budget -= cost
+    messages.extend(reversed(window))
+
+    overflow = recent[len(window):]
+    if overflow:
+        overflow_tokens = sum(
+            estimate_tokens(truncate_to_tokens(m.content or "", CHAT_SUMMARY_MESSAGE_TOKEN_CAP)) for m in overflow
+        )
+        # A full page means even older unsummarized turns may exist
+        if overflow_tokens >= CHAT_SUMMARY_TRIGGER_TOKENS or len(recent) == CHAT_CONTEXT_MAX_MESSAGES:
+            schedule_summary_refresh(user_id, before_id=recent[len(window) - 1].id)
+    return messages
+
+
+def schedule_summary_refresh(user_id: int, before_id: int):
+    """Folds turns older than `before_id` into the summary, in the background."""
+    key = str(user_id)
+    if _summaries.in_flight(key):
+        return
+    task = asyncio.create_task(_summaries.do(key, lambda: refresh_summary(user_id, before_id)))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def summarize(summary: str, batch) -> str:
+    transcript = "\n".join(
+        f"{'User' if m.role == 'user' else 'Assistant'}: "
+        f"{truncate_to_tokens(m.content or '', CHAT_SUMMARY_MESSAGE_TOKEN_CAP)}"
+        for m in batch
+    )
+    text, _ = await llm_gateway.complete(
+        [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"},
+        ],
+        models=[CHAT_SUMMARY_MODEL],
+        timeout=60,
+        max_tokens=CHAT_SUMMARY_MAX_TOKENS,
+    )
+    return text
+
+
+async def refresh_summary(user_id: int, before_id: int):
+    # Own session: runs after the request that scheduled it has finished
+    try:
+        async with database.AsyncSessionLocal() as db:
+            row = await crud.get_chat_summary_async(db, user_id)
+            summary = row.summary if row else ""
+            through_id = row.through_message_id if row else 0
+            while True:
+                batch = await crud.get_messages_between_async(
+                    db, user_id, after_id=through_id, before_id=before_id, limit=CHAT_SUMMARY_BATCH_MESSAGES
+                )
+                if not batch:
+                    break
+                summary = (await summarize(summary, batch)).strip()
+                through_id = batch[-1].id
+                await crud.save_chat_summary_async(db, user_id, summary, through_id)
+            logger.debug(f"Chat summary for user {user_id} now covers messages up to {through_id}")
+    except Exception as e:
+        # The next request retries; until then the older turns are just left out
+        logger.error(f"CHAT SUMMARY ERROR: {e}")
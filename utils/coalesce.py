@@ -0,0 +1,25 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Merges concurrent calls for the same key into one upstream call.
+    Every caller awaiting a key while it is in flight gets the same result
+    (or exception). Per-process only.
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: str, fn):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        # shield: one caller hitting its own deadline must not cancel the
+        # lookup the other callers are still waiting on
+        return await asyncio.shield(task)
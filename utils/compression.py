@@ -0,0 +1,164 @@
+import os
+import json
+import struct
+import threading
+import zlib
+from sqlalchemy import LargeBinary
+from sqlalchemy.types import TypeDecorator
+
+try:
+    import zstandard
+except ImportError: # Optional: zlib (stdlib) is used when it is missing
+    zstandard = None
+
+# --- Stored format ---
+# b"TZ" + codec byte + 2-byte dictionary id (0 = no dictionary) + payload.
+# Anything else is a legacy row stored as plain text and returned as-is.
+MAGIC = b"TZ"
+HEADER = struct.Struct(">2scH")
+CODEC_ZLIB = b"z"
+CODEC_ZSTD = b"s"
+
+ITINERARY_CODEC = os.getenv("ITINERARY_CODEC", "zstd" if zstandard else "zlib")
+ZLIB_LEVEL = int(os.getenv("ZLIB_LEVEL", "9"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "19"))
+# zlib only looks back 32 KB, so a bigger preset dictionary is wasted
+ZLIB_MAX_DICT_SIZE = 32 * 1024
+ZSTD_DICT_SIZE = 64 * 1024
+
+# Dictionaries live in the compression_dicts table (models.CompressionDict);
+# this is the per-process copy, filled by load_dictionaries().
+_dicts: dict[int, tuple[bytes, bytes]] = {} # id -> (codec, data)
+_active: dict[bytes, int] = {} # codec -> newest dictionary id
+_lock = threading.Lock()
+
+
+def codec_byte(name: str) -> bytes:
+    if name == "zstd":
+        if zstandard is None:
+            raise RuntimeError("ITINERARY_CODEC=zstd needs the 'zstandard' package")
+        return CODEC_ZSTD
+    return CODEC_ZLIB
+
+
+def register_dictionary(dict_id: int, codec: bytes, data: bytes):
+    with _lock:
+        _dicts[dict_id] = (codec, data)
+        if dict_id > _active.get(codec, 0):
+            _active[codec] = dict_id
+
+
+def load_dictionaries(connection):
+    """Loads every stored dictionary; call once per process with a sync connection."""
+    rows = connection.exec_driver_sql("SELECT id, codec, data FROM compression_dicts").fetchall()
+    for dict_id, codec, data in rows:
+        register_dictionary(dict_id, codec.encode(), bytes(data))
+
+
+def _get_dictionary(dict_id: int) -> bytes:
+    if dict_id not in _dicts:
+        # Trained by another process after we started: fetch it once
+        from database import engine
+        with engine.connect() as conn:
+            load_dictionaries(conn)
+    if dict_id not in _dicts:
+        raise ValueError(f"Unknown compression dictionary {dict_id}")
+    return _dicts[dict_id][1]
+
+
+def compress_text(text: str, codec_name: str = None) -> bytes:
+    codec = codec_byte(codec_name or ITINERARY_CODEC)
+    dict_id = _active.get(codec, 0)
+    raw = text.encode("utf-8")
+    if codec == CODEC_ZSTD:
+        zdict = zstandard.ZstdCompressionDict(_get_dictionary(dict_id)) if dict_id else None
+        payload = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=zdict).compress(raw)
+    else:
+        if dict_id:
+            compressor = zlib.compressobj(ZLIB_LEVEL, zdict=_get_dictionary(dict_id))
+        else:
+            compressor = zlib.compressobj(ZLIB_LEVEL)
+        payload = compressor.compress(raw) + compressor.flush()
+    return HEADER.pack(MAGIC, codec, dict_id) + payload
+
+
+def decompress_text(value) -> str:
+    if isinstance(value, str):
+        return value # Legacy plain-text row
+    value = bytes(value)
+    if len(value) < HEADER.size or value[:2] != MAGIC:
+        return value.decode("utf-8")
+    _, codec, dict_id = HEADER.unpack_from(value)
+    payload = value[HEADER.size:]
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Row is zstd-compressed but 'zstandard' is not installed")
+        zdict = zstandard.ZstdCompressionDict(_get_dictionary(dict_id)) if dict_id else None
+        return zstandard.ZstdDecompressor(dict_data=zdict).decompress(payload).decode("utf-8")
+    if dict_id:
+        decompressor = zlib.decompressobj(zdict=_get_dictionary(dict_id))
+    else:
+        decompressor = zlib.decompressobj()
+    return (decompressor.decompress(payload) + decompressor.flush()).decode("utf-8")
+
+
+def train_dictionary(samples: list[str], codec_name: str = None) -> bytes:
+    """Builds a shared dictionary from existing itineraries."""
+    codec = codec_byte(codec_name or ITINERARY_CODEC)
+    encoded = [s.encode("utf-8") for s in samples if s]
+    if codec == CODEC_ZSTD:
+        return zstandard.train_dictionary(ZSTD_DICT_SIZE, encoded).as_bytes()
+
+    # zlib has no trainer: use the lines that recur across itineraries
+    # (headings, table rows, boilerplate phrases). Most common go last, since
+    # zlib encodes matches closer to the data more cheaply.
+    counts: dict[bytes, int] = {}
+    for sample in encoded:
+        for line in set(sample.splitlines()):
+            if len(line) >= 8:
+                counts[line] = counts.get(line, 0) + 1
+    common = sorted((n, line) for line, n in counts.items() if n > 1)
+    chosen, size = [], 0
+    for _, line in reversed(common):
+        if size + len(line) + 1 > ZLIB_MAX_DICT_SIZE:
+            break
+        chosen.append(line)
+        size += len(line) + 1
+    return b"\n".join(reversed(chosen))
+
+
+class CompressedText(TypeDecorator):
+    """
+    Text column stored compressed (zstd or zlib, optionally with a shared
+    dictionary). Reads always return the original str, and legacy plain-text
+    rows keep working, so callers never see the difference.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decompress_text(value)
+
+
+class CompressedJSON(CompressedText):
+    """JSON document stored like CompressedText; reads return the parsed value."""
+
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_text(json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return json.loads(decompress_text(value))
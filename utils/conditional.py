@@ -0,0 +1,48 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from fastapi import Request, Response
+
+# Validators for polled listings, derived from the per-user change version
+# (models.ChangeVersion) rather than from the response body, so a matching
+# If-None-Match is answered before the listing query runs.
+#
+# Last-Modified is sent for information only: it has one-second resolution, so
+# two changes within the same second would look identical. Clients should
+# revalidate with If-None-Match.
+
+# Per-user data: never stored by shared caches, always revalidated by the client
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(scope: str, user_id: int, version: int, *params) -> str:
+    """Strong ETag for one page of a listing; query params pick the page."""
+    page = hashlib.sha1(repr(params).encode()).hexdigest()[:10]
+    return f'"{scope}-{user_id}-{version}-{page}"'
+
+
+def http_date(value: datetime) -> str:
+    # Stored timestamps are naive UTC (datetime.utcnow)
+    return format_datetime(value.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def if_none_match(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return "*" in tags or etag in (t.removeprefix("W/") for t in tags)
+
+
+def set_validators(response: Response, etag: str, last_modified: datetime | None):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    if last_modified is not None:
+        response.headers["Last-Modified"] = http_date(last_modified)
+
+
+def not_modified(etag: str, last_modified: datetime | None) -> Response:
+    response = Response(status_code=304)
+    set_validators(response, etag, last_modified)
+    return response
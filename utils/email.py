@@ -2,6 +2,9 @@ import os
 from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
 from pydantic import EmailStr, BaseModel
 from typing import List
+from utils.log import get_logger
+
+logger = get_logger("email")
 
 class EmailSchema(BaseModel):
     email: List[EmailStr]
@@ -39,8 +42,8 @@ async def send_verification_email(email: str, token: str):
     fm = FastMail(conf)
     try:
         await fm.send_message(message)
-        print(f"Email sent to {email}")
+        logger.info("Verification email sent")
         return True
     except Exception as e:
-        print(f"Error sending email: {e}")
+        logger.error(f"Error sending email: {e}")
         return False
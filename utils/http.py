@@ -0,0 +1,23 @@
+import httpx
+
+# Shared client for the small upstream lookups (Wikipedia etc.). Like the LLM
+# client it is created lazily so every gunicorn worker gets its own pool.
+_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            headers={"User-Agent": "TripMate/1.0 (contact@example.com)"},
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            timeout=httpx.Timeout(5.0),
+        )
+    return _client
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
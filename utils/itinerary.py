@@ -0,0 +1,318 @@
+import os
+import re
+import json
+from datetime import datetime, timedelta
+from typing import Annotated
+from pydantic import BaseModel, BeforeValidator, ValidationError
+
+# Structured itineraries: the planner asks the model for JSON in this shape,
+# validates it here, stores it on the Trip and only renders markdown when a
+# client asks for it.
+
+# --- CONFIG ---
+# "json_object": JSON mode, shape given in the prompt (widest model support)
+# "json_schema": also send the JSON schema (providers that support it enforce it)
+# "off": no response_format, rely on the prompt alone
+PLAN_RESPONSE_FORMAT = os.getenv("PLAN_RESPONSE_FORMAT", "json_object")
+
+# Bump when the models below change incompatibly (part of the itinerary cache key)
+SCHEMA_VERSION = 1
+
+
+class ItineraryError(ValueError):
+    """Model output that is not a valid itinerary."""
+
+
+def _inr(value):
+    # Models write prices as 4500, "4500", "₹4,500" or "4,500-6,000" (first number wins)
+    if isinstance(value, str):
+        match = re.search(r"\d[\d,]*(?:\.\d+)?", value)
+        return float(match.group(0).replace(",", "")) if match else None
+    return value
+
+
+INR = Annotated[float | None, BeforeValidator(_inr)]
+
+
+class Place(BaseModel):
+    name: str
+    area: str | None = None
+
+
+class TimeSlot(BaseModel):
+    time: str # "Morning" / "Afternoon" / "Evening" or a clock time
+    title: str
+    description: str = ""
+    places: list[Place] = []
+    cost_inr: INR = None
+
+
+class Day(BaseModel):
+    day: int
+    date: str | None = None
+    title: str = ""
+    slots: list[TimeSlot]
+
+
+class Hotel(BaseModel):
+    name: str
+    area: str | None = None
+    price_per_night_inr: INR = None
+    description: str = ""
+
+
+class BudgetItem(BaseModel):
+    category: str
+    amount_inr: INR = None
+    note: str = ""
+
+
+class Itinerary(BaseModel):
+    title: str
+    summary: str = ""
+    hotels: list[Hotel] = []
+    days: list[Day]
+    budget: list[BudgetItem] = []
+
+
+# Shape description for the prompt (JSON mode alone does not convey one)
+DAY_SHAPE = (
+    '{"day": int, "date": "YYYY-MM-DD", "title": str, "slots": [{"time": "Morning|Afternoon|Evening", '
+    '"title": str, "description": str, "places": [{"name": str, "area": str}], "cost_inr": number}]}'
+)
+JSON_SHAPE = (
+    '{"title": str, "summary": str, '
+    '"hotels": [{"name": str, "area": str, "price_per_night_inr": number, "description": str}], '
+    '"days": [' + DAY_SHAPE + '], '
+    '"budget": [{"category": str, "amount_inr": number, "note": str}]}'
+)
+# Reply shape when only some days are (re)generated
+DAYS_JSON_SHAPE = '{"days": [' + DAY_SHAPE + ']}'
+
+
+class DayList(BaseModel):
+    days: list[Day]
+
+
+class OutlineDay(BaseModel):
+    day: int
+    area: str = ""
+    theme: str = ""
+
+
+class Outline(BaseModel):
+    """Long-trip plan skeleton: everything but the days' details."""
+    title: str
+    summary: str = ""
+    hotels: list[Hotel] = []
+    budget: list[BudgetItem] = []
+    days: list[OutlineDay]
+
+
+OUTLINE_JSON_SHAPE = (
+    '{"title": str, "summary": str, '
+    '"hotels": [{"name": str, "area": str, "price_per_night_inr": number, "description": str}], '
+    '"budget": [{"category": str, "amount_inr": number, "note": str}], '
+    '"days": [{"day": int, "area": str, "theme": str}]}'
+)
+
+
+def response_format(schema: type[BaseModel] | None = None) -> dict | None:
+    """
+    `response_format` for a completion whose reply should validate as
+    `schema`, per PLAN_RESPONSE_FORMAT. Without a schema, json_schema mode
+    falls back to plain JSON mode.
+    """
+    if PLAN_RESPONSE_FORMAT == "json_schema" and schema is not None:
+        return {"type": "json_schema", "json_schema": {"name": schema.__name__.lower(), "schema": schema.model_json_schema()}}
+    if PLAN_RESPONSE_FORMAT in ("json_object", "json_schema"):
+        return {"type": "json_object"}
+    return None
+
+
+def _json_text(text: str) -> str:
+    # Tolerate ```json fences and chatter around the object
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise ItineraryError("No JSON object in the model output")
+    return text[start:end + 1]
+
+
+def parse_itinerary(text: str, start_date: str | None = None, num_days: int | None = None) -> Itinerary:
+    """
+    Validates model output into an Itinerary. Days are put in order and, with
+    `start_date`, dated from it. Raises ItineraryError.
+    """
+    try:
+        itinerary = Itinerary.model_validate(json.loads(_json_text(text)))
+    except (ValueError, ValidationError) as e:
+        raise ItineraryError(f"Invalid itinerary: {e}")
+    if not itinerary.days:
+        raise ItineraryError("Itinerary has no days")
+    if num_days is not None and len(itinerary.days) < num_days:
+        raise ItineraryError(f"Itinerary covers {len(itinerary.days)} of {num_days} days")
+    itinerary.days.sort(key=lambda d: d.day)
+    if start_date:
+        assign_dates(itinerary, start_date)
+    return itinerary
+
+
+def parse_days(text: str, first_day: int, count: int, start_date: str | None = None) -> list[Day]:
+    """
+    Validates model output holding {"days": [...]} with at least `count` days.
+    Returns the first `count`, numbered from `first_day` and, with
+    `start_date`, dated. Raises ItineraryError.
+    """
+    try:
+        days = DayList.model_validate(json.loads(_json_text(text))).days
+    except (ValueError, ValidationError) as e:
+        raise ItineraryError(f"Invalid days: {e}")
+    if len(days) < count:
+        raise ItineraryError(f"Got {len(days)} of {count} days")
+    days = sorted(days, key=lambda d: d.day)[:count]
+    for index, day in enumerate(days):
+        day.day = first_day + index
+        day.date = day_date(start_date, day.day) if start_date else None
+    return days
+
+
+def parse_outline(text: str, num_days: int) -> Outline:
+    """Validates an outline covering `num_days` days, numbered 1..num_days. Raises ItineraryError."""
+    try:
+        outline = Outline.model_validate(json.loads(_json_text(text)))
+    except (ValueError, ValidationError) as e:
+        raise ItineraryError(f"Invalid outline: {e}")
+    if len(outline.days) < num_days:
+        raise ItineraryError(f"Outline covers {len(outline.days)} of {num_days} days")
+    outline.days = sorted(outline.days, key=lambda d: d.day)[:num_days]
+    for index, day in enumerate(outline.days):
+        day.day = index + 1
+    return outline
+
+
+def day_date(start_date: str, day: int) -> str:
+    """Date of day `day` (1-based) of a trip starting on `start_date`."""
+    return (datetime.strptime(start_date, "%Y-%m-%d") + timedelta(days=day - 1)).strftime("%Y-%m-%d")
+
+
+def assign_dates(itinerary: Itinerary, start_date: str) -> Itinerary:
+    """Numbers the days 1..N and dates them from `start_date` (the model's own dates are not trusted)."""
+    for index, day in enumerate(itinerary.days):
+        day.day = index + 1
+        day.date = day_date(start_date, day.day)
+    return itinerary
+
+
+class StreamParser:
+    """
+    Picks complete values out of a streamed itinerary object: each element of
+    "days" as soon as it closes, and every other top-level field once its
+    value is complete. feed() returns the newly completed (field, value)
+    pairs, with field "day" for days.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.key = None
+        self.value_start = None
+        self.day_start = None
+
+    def feed(self, text: str) -> list[tuple[str, object]]:
+        self.buffer += text
+        found = []
+        while self.pos < len(self.buffer):
+            i, char = self.pos, self.buffer[self.pos]
+            self.pos += 1
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1 and self.value_start is None:
+                        self.key = self.buffer[self.string_start + 1:i]
+                continue
+
+            if self.depth == 1 and self.key is not None and self.value_start is None and char not in " \t\r\n:":
+                self.value_start = i
+            if char == '"':
+                self.in_string = True
+                self.string_start = i
+            elif char in "{[":
+                self.depth += 1
+                if self.depth == 3 and self.key == "days" and char == "{":
+                    self.day_start = i
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 2 and self.key == "days" and self.day_start is not None:
+                    found += self._emit("day", self.day_start, i + 1)
+                    self.day_start = None
+                elif self.depth == 1 and self.value_start is not None:
+                    found += self._emit(self.key, self.value_start, i + 1)
+                    self.key = self.value_start = None
+                elif self.depth == 0 and self.value_start is not None:
+                    # Last field was a bare number / literal
+                    found += self._emit(self.key, self.value_start, i)
+                    self.key = self.value_start = None
+            elif char == "," and self.depth == 1 and self.value_start is not None:
+                found += self._emit(self.key, self.value_start, i)
+                self.key = self.value_start = None
+        return found
+
+    def _emit(self, field: str, start: int, end: int) -> list[tuple[str, object]]:
+        try:
+            return [(field, json.loads(self.buffer[start:end]))]
+        except ValueError:
+            return []
+
+
+def _money(amount: float | None) -> str:
+    return f"₹{amount:,.0f}" if amount is not None else "—"
+
+
+def render_day(day: Day) -> str:
+    heading = f"### Day {day.day}" + (f" - {day.date}" if day.date else "") + (f": {day.title}" if day.title else "")
+    lines = [heading, ""]
+    for slot in day.slots:
+        places = ", ".join(p.name + (f" ({p.area})" if p.area else "") for p in slot.places)
+        line = f"- **{slot.time}** — **{slot.title}**"
+        if places:
+            line += f" at {places}"
+        if slot.description:
+            line += f": {slot.description}"
+        if slot.cost_inr:
+            line += f" _(~{_money(slot.cost_inr)})_"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def render_markdown(itinerary: Itinerary) -> str:
+    """The itinerary in the markdown layout clients rendered before structured output."""
+    parts = [f"# {itinerary.title}"]
+    if itinerary.summary:
+        parts.append(itinerary.summary)
+    if itinerary.hotels:
+        hotels = ["## 🏨 Accommodations", ""]
+        for hotel in itinerary.hotels:
+            line = f"- **{hotel.name}**" + (f" ({hotel.area})" if hotel.area else "")
+            if hotel.price_per_night_inr:
+                line += f" — {_money(hotel.price_per_night_inr)}/night"
+            if hotel.description:
+                line += f". {hotel.description}"
+            hotels.append(line)
+        parts.append("\n".join(hotels))
+    parts.append("## 🗓️ Detailed Itinerary")
+    parts += [render_day(day) for day in itinerary.days]
+    if itinerary.budget:
+        rows = ["## 💰 Budget Breakdown", "", "| Category | Estimated Cost | Notes |", "|---|---|---|"]
+        rows += [f"| {item.category} | {_money(item.amount_inr)} | {item.note} |" for item in itinerary.budget]
+        total = sum(item.amount_inr or 0 for item in itinerary.budget)
+        rows.append(f"| **Total** | **{_money(total)}** | |")
+        parts.append("\n".join(rows))
+    return "\n\n".join(parts) + "\n"
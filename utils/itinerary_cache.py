@@ -0,0 +1,150 @@
+import os
+import re
+import json
+import hashlib
+import unicodedata
+from datetime import datetime
+from utils.cache import get_store
+from utils.itinerary import SCHEMA_VERSION
+
+# --- CONFIG ---
+ITINERARY_CACHE_ENABLED = os.getenv("ITINERARY_CACHE_ENABLED", "1") == "1"
+ITINERARY_CACHE_TTL = float(os.getenv("ITINERARY_CACHE_TTL", str(7 * 24 * 3600)))
+ITINERARY_CACHE_MAX_ENTRIES = int(os.getenv("ITINERARY_CACHE_MAX_ENTRIES", "5000"))
+
+# Old / alternate city names people still type
+DESTINATION_ALIASES = {
+    "bombay": "mumbai",
+    "madras": "chennai",
+    "calcutta": "kolkata",
+    "bengaluru": "bangalore",
+    "new delhi": "delhi",
+    "gurugram": "gurgaon",
+}
+
+itinerary_store = get_store("itinerary", max_entries=ITINERARY_CACHE_MAX_ENTRIES)
+
+
+def canonical_destination(destination: str) -> str:
+    text = unicodedata.normalize("NFKD", destination).encode("ascii", "ignore").decode()
+    text = re.sub(r"[^\w,]+", " ", text.casefold())
+    parts = [" ".join(p.split()) for p in text.split(",")]
+    parts = [DESTINATION_ALIASES.get(p, p) for p in parts if p]
+    return ", ".join(parts)
+
+
+def traveler_bucket(travelers: int) -> str:
+    if travelers <= 1:
+        return "solo"
+    if travelers == 2:
+        return "couple"
+    if travelers <= 4:
+        return "small-group"
+    return "group"
+
+
+def budget_bucket(budget_inr: float | None, travelers: int, num_days: int) -> str:
+    if not budget_inr:
+        return "flexible"
+    # Per person per day, so a 2-person and a 4-person trip compare fairly
+    per_day = budget_inr / max(travelers, 1) / max(num_days, 1)
+    if per_day < 2000:
+        return "budget"
+    if per_day < 6000:
+        return "mid"
+    if per_day < 15000:
+        return "comfort"
+    return "luxury"
+
+
+def normalize_plan_request(req, num_days: int) -> dict:
+    """Fields of a PlanRequest that actually change the itinerary, in canonical form."""
+    preferences = sorted({p.strip().casefold() for p in (req.preferences or []) if p.strip()})
+    return {
+        "destination": canonical_destination(req.destination),
+        "days": num_days,
+        "travelers": traveler_bucket(req.travelers),
+        "budget": budget_bucket(req.budget_inr, req.travelers, num_days),
+        "preferences": preferences,
+    }
+
+
+def cache_key(req, num_days: int, model: str, prompt: str) -> str:
+    normalized = normalize_plan_request(req, num_days)
+    normalized["model"] = model
+    normalized["prompt"] = prompt # Template id: a new prompt version starts a fresh cache
+    normalized["schema"] = SCHEMA_VERSION # Entries of an older itinerary shape are never read
+    raw = json.dumps(normalized, sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+# "January 5, 2026" / "Jan 5, 2026" / "5 January 2026"
+LONG_DATE_RE = re.compile(
+    r"\b(?:(?P<month1>[A-Z][a-z]{2,8})\.? (?P<day1>\d{1,2}), (?P<year1>\d{4})"
+    r"|(?P<day2>\d{1,2}) (?P<month2>[A-Z][a-z]{2,8}) (?P<year2>\d{4}))\b"
+)
+
+
+def _parse_month(name: str) -> int | None:
+    for fmt in ("%B", "%b"):
+        try:
+            return datetime.strptime(name, fmt).month
+        except ValueError:
+            continue
+    return None
+
+
+def redate_itinerary(markdown: str, cached_start: str, new_start: str) -> str:
+    """Shifts every date in a cached itinerary so Day 1 lands on `new_start`."""
+    shift = datetime.strptime(new_start, "%Y-%m-%d") - datetime.strptime(cached_start, "%Y-%m-%d")
+    if not shift:
+        return markdown
+
+    def shift_iso(match):
+        try:
+            d = datetime(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        except ValueError:
+            return match.group(0)
+        return (d + shift).strftime("%Y-%m-%d")
+
+    def shift_long(match):
+        if match.group("month1"):
+            month_name, day, year = match.group("month1"), match.group("day1"), match.group("year1")
+        else:
+            month_name, day, year = match.group("month2"), match.group("day2"), match.group("year2")
+        month = _parse_month(month_name)
+        if month is None:
+            return match.group(0)
+        try:
+            d = datetime(int(year), month, int(day)) + shift
+        except ValueError:
+            return match.group(0)
+        # Keep the style the model used (full vs. abbreviated month, order)
+        month_fmt = "%B" if len(month_name) > 3 else "%b"
+        if match.group("month1"):
+            return f"{d.strftime(month_fmt)} {d.day}, {d.year}"
+        return f"{d.day} {d.strftime(month_fmt)} {d.year}"
+
+    markdown = ISO_DATE_RE.sub(shift_iso, markdown)
+    return LONG_DATE_RE.sub(shift_long, markdown)
+
+
+def lookup(key: str, start_date: str) -> dict | None:
+    """Cached itinerary (as a dict) re-dated to `start_date`, or None. Blocking."""
+    entry = itinerary_store.get(key)
+    if entry is None:
+        itinerary_store.incr("misses")
+        return None
+    itinerary_store.incr("hits")
+    # Dates in the JSON text shift like they would in markdown; quotes are never touched
+    text = json.dumps(entry.value["itinerary"], ensure_ascii=False)
+    return json.loads(redate_itinerary(text, entry.value["start_date"], start_date))
+
+
+def store(key: str, start_date: str, itinerary: dict):
+    itinerary_store.set(
+        key,
+        {"itinerary": itinerary, "start_date": start_date},
+        ttl=ITINERARY_CACHE_TTL,
+    )
@@ -0,0 +1,192 @@
+import os
+import json
+import math
+import time
+import asyncio
+import httpx
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from utils import rate_limit, metrics
+
+load_dotenv()
+
+# --- CONFIG ---
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+if not OPENROUTER_API_KEY:
+    raise ValueError("Missing OPENROUTER_API_KEY in .env file")
+
+BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+COMPLETIONS_URL = f"{BASE_URL}/chat/completions"
+
+# Upper bound on completions in flight per worker. Anything above this waits
+# for a free slot instead of opening yet another upstream connection.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "256"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "64"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_DEFAULT_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+DEFAULT_HEADERS = {
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+    "Content-Type": "application/json",
+    "HTTP-Referer": "http://localhost:8000",
+    "X-Title": "TripMate AI",
+}
+
+
+class LLMError(Exception):
+    """Upstream returned an error or an unusable response."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float | None = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after # Seconds, from a 429/503 Retry-After header
+
+    def retry_headers(self) -> dict | None:
+        # For the HTTPException the routers raise from this error
+        return {"Retry-After": str(math.ceil(self.retry_after))} if self.retry_after else None
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+class LLMTimeout(LLMError):
+    def __init__(self, detail: str = "AI provider timed out"):
+        super().__init__(504, detail)
+
+
+class LLMOverloaded(LLMError):
+    """Every global upstream slot stayed busy past the queue deadline."""
+
+    def __init__(self):
+        super().__init__(503, "AI Assistant is busy. Please try again shortly.", retry_after=5)
+
+
+# The client and semaphore are created lazily so that each gunicorn worker
+# builds its own after the fork, bound to its own event loop.
+_client: httpx.AsyncClient | None = None
+_semaphore: asyncio.Semaphore | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=True,
+            headers=DEFAULT_HEADERS,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONCURRENCY,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                keepalive_expiry=60.0,
+            ),
+            timeout=httpx.Timeout(LLM_DEFAULT_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+    return _client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _semaphore
+
+
+@asynccontextmanager
+async def _upstream_slot():
+    # Global cap shared by all workers (queued up to LLM_QUEUE_DEADLINE),
+    # then this worker's own cap
+    try:
+        async with rate_limit.llm_slot():
+            async with _get_semaphore():
+                yield
+    except rate_limit.QueueTimeout:
+        raise LLMOverloaded()
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def chat_completion(messages: list[dict], model: str, timeout: float | None = None, **extra) -> str:
+    """
+    Runs one chat completion and returns the assistant text.
+    Raises LLMTimeout / LLMError so routers can map them to HTTP errors.
+    """
+    payload = {"model": model, "messages": messages, **extra}
+    request_timeout = httpx.Timeout(timeout or LLM_DEFAULT_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+    async with _upstream_slot():
+        with metrics.track("openrouter"):
+            try:
+                response = await get_client().post(COMPLETIONS_URL, json=payload, timeout=request_timeout)
+            except httpx.TimeoutException:
+                raise LLMTimeout()
+            except httpx.HTTPError as e:
+                raise LLMError(502, f"OpenRouter connection error: {e}")
+            if response.status_code != 200:
+                raise LLMError(response.status_code, f"OpenRouter Error: {response.text}", _retry_after(response))
+
+    # A 200 with a non-JSON body (proxy error page) or without choices is still an upstream error
+    try:
+        data = response.json()
+        content = data["choices"][0]["message"]["content"]
+    except (ValueError, LookupError, TypeError):
+        raise LLMError(502, "Invalid response from AI provider")
+    metrics.record_tokens(data.get("model") or model, data.get("usage"))
+    return content
+
+
+async def stream_chat_completion(messages: list[dict], model: str, timeout: float | None = None, **extra):
+    """
+    Streams one chat completion, yielding text deltas as OpenRouter sends them.
+    Errors before the first token raise LLMTimeout / LLMError like chat_completion.
+    """
+    # include_usage: the last chunk carries the token counts, for metrics
+    payload = {"model": model, "messages": messages, "stream": True, "stream_options": {"include_usage": True}, **extra}
+    request_timeout = httpx.Timeout(timeout or LLM_DEFAULT_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+    started = time.perf_counter()
+    first_token = True
+
+    async with _upstream_slot():
+        with metrics.track("openrouter"):
+            try:
+                async with get_client().stream("POST", COMPLETIONS_URL, json=payload, timeout=request_timeout) as response:
+                    if response.status_code != 200:
+                        body = (await response.aread()).decode(errors="replace")
+                        raise LLMError(response.status_code, f"OpenRouter Error: {body}", _retry_after(response))
+
+                    async for line in response.aiter_lines():
+                        # SSE frames: "data: {...}", keep-alive comments start with ":"
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            chunk = json.loads(data)
+                        except ValueError:
+                            continue
+                        if "error" in chunk:
+                            raise LLMError(502, f"OpenRouter Error: {chunk['error']}")
+                        if chunk.get("usage"):
+                            metrics.record_tokens(chunk.get("model") or model, chunk["usage"])
+                        choices = chunk.get("choices") or []
+                        if not choices:
+                            continue
+                        delta = choices[0].get("delta", {}).get("content")
+                        if delta:
+                            if first_token:
+                                first_token = False
+                                metrics.LLM_FIRST_TOKEN.labels(model).observe(time.perf_counter() - started)
+                            yield delta
+            except httpx.TimeoutException:
+                raise LLMTimeout()
+            except httpx.HTTPError as e:
+                raise LLMError(502, f"OpenRouter connection error: {e}")
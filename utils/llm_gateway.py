@@ -0,0 +1,315 @@
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from utils import llm
+from utils.log import get_logger
+
+# Resilience layer over utils/llm.py. For a list of models (best first) every
+# call gets:
+#   - retries with full-jitter exponential backoff on 429 / 5xx / timeouts
+#   - a per-model circuit breaker, so a browned-out model is skipped at once
+#   - an optional hedge: if an attempt is still running after LLM_HEDGE_AFTER
+#     seconds, the next model (or the same one) is raced against it
+#   - fallback down the list once a model's retries are exhausted
+# Every attempt's latency and outcome is recorded (see stats()). State is per
+# worker process.
+
+# --- CONFIG ---
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2")) # Per model, after the first attempt
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# 0 disables hedging. For streams this is the wait for the first token.
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5")) # Consecutive, to open
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30")) # Open -> one probe allowed
+# Whole call, across retries and fallbacks
+LLM_GATEWAY_DEADLINE = float(os.getenv("LLM_GATEWAY_DEADLINE", "180"))
+LATENCY_WINDOW = 500 # Attempts kept per model for percentiles
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+logger = get_logger("llm")
+
+
+def model_list(primary: str, fallbacks: str = "") -> list[str]:
+    """Primary model followed by a comma-separated fallback list, without duplicates."""
+    models = [primary] + [m.strip() for m in fallbacks.split(",") if m.strip()]
+    return list(dict.fromkeys(models))
+
+
+def is_retryable(error: llm.LLMError) -> bool:
+    if isinstance(error, llm.LLMOverloaded):
+        return False # Our own global cap is full: more attempts only add load
+    return isinstance(error, llm.LLMTimeout) or error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+
+
+class CircuitOpen(llm.LLMError):
+    def __init__(self, model: str):
+        super().__init__(503, f"AI model {model} is temporarily unavailable")
+
+
+class CircuitBreaker:
+    """closed -> (N consecutive failures) -> open -> (cooldown) -> half-open: one probe."""
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < LLM_BREAKER_COOLDOWN:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= LLM_BREAKER_FAILURES:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release(self):
+        # Attempt ended without a verdict (cancelled hedge loser)
+        self.probing = False
+
+
+class ModelStats:
+    def __init__(self):
+        self.counts: dict[str, int] = {}
+        self.latencies: deque = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, outcome: str, latency: float):
+        self.counts[outcome] = self.counts.get(outcome, 0) + 1
+        if outcome == "ok":
+            self.latencies.append(latency)
+
+    def incr(self, name: str):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_stats: dict[str, ModelStats] = {}
+
+
+def breaker(model: str) -> CircuitBreaker:
+    return _breakers.setdefault(model, CircuitBreaker())
+
+
+def model_stats(model: str) -> ModelStats:
+    return _stats.setdefault(model, ModelStats())
+
+
+def _percentile(values: list[float], pct: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * pct), len(values) - 1)], 3)
+
+
+def stats() -> dict:
+    """Per-model attempt outcomes, success latency percentiles and breaker state."""
+    report = {}
+    for model, s in _stats.items():
+        latencies = list(s.latencies)
+        report[model] = {
+            **s.counts,
+            "latency_p50": _percentile(latencies, 0.50),
+            "latency_p95": _percentile(latencies, 0.95),
+            "latency_p99": _percentile(latencies, 0.99),
+            "breaker": breaker(model).state,
+        }
+    return report
+
+
+async def _attempt(call, model: str, timeout: float):
+    """One upstream attempt: times it and feeds the model's breaker and stats."""
+    started = time.monotonic()
+    try:
+        result = await call(model, timeout)
+    except asyncio.CancelledError:
+        model_stats(model).record("cancelled", time.monotonic() - started)
+        breaker(model).release()
+        raise
+    except llm.LLMError as e:
+        latency = time.monotonic() - started
+        outcome = "timeout" if isinstance(e, llm.LLMTimeout) else f"error_{e.status_code}"
+        model_stats(model).record(outcome, latency)
+        logger.warning("LLM attempt failed", extra={"model": model, "outcome": outcome, "latency": round(latency, 3)})
+        if is_retryable(e):
+            breaker(model).record_failure()
+        else:
+            breaker(model).release() # Our request was bad, not the model
+        raise
+    model_stats(model).record("ok", time.monotonic() - started)
+    breaker(model).record_success()
+    return result
+
+
+async def _hedged(call, model: str, hedge_model: str | None, timeout: float, discard):
+    """
+    Runs `call` on `model`; past LLM_HEDGE_AFTER also on `hedge_model`. The
+    first success wins, the other attempt is cancelled (or discarded if it
+    also finished). Fails only when every started attempt failed.
+    """
+    tasks = {asyncio.create_task(_attempt(call, model, timeout)): model}
+    winner = None
+    try:
+        if LLM_HEDGE_AFTER and hedge_model and LLM_HEDGE_AFTER < timeout:
+            done, _ = await asyncio.wait(tasks, timeout=LLM_HEDGE_AFTER)
+            if not done and breaker(hedge_model).allow():
+                logger.info(f"LLM hedge: {model} slower than {LLM_HEDGE_AFTER}s, also trying {hedge_model}")
+                model_stats(hedge_model).incr("hedges")
+                tasks[asyncio.create_task(_attempt(call, hedge_model, timeout - LLM_HEDGE_AFTER))] = hedge_model
+
+        pending, errors = set(tasks), []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and winner is None:
+                    winner = task
+                elif task.exception() is not None:
+                    errors.append(task.exception())
+            if winner is not None:
+                return winner.result(), tasks[winner]
+        raise errors[0]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif task is not winner and not task.cancelled() and task.exception() is None:
+                await discard(task.result())
+
+
+async def _call(call, models: list[str], timeout: float | None, deadline: float | None, discard):
+    """Retries, breakers and fallback over `models`. Returns (result, model)."""
+    timeout = timeout or llm.LLM_DEFAULT_TIMEOUT
+    deadline_at = time.monotonic() + (deadline or LLM_GATEWAY_DEADLINE)
+    last_error: llm.LLMError | None = None
+
+    for index, model in enumerate(models):
+        if index:
+            model_stats(model).incr("fallbacks")
+        # Hedge onto the next model down, or the same one if it is the last
+        hedge_model = models[index + 1] if index + 1 < len(models) else model
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise last_error or llm.LLMTimeout()
+            if not breaker(model).allow():
+                last_error = CircuitOpen(model)
+                break # Straight to the next model
+            try:
+                return await _hedged(call, model, hedge_model, min(timeout, remaining), discard)
+            except llm.LLMError as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+            if attempt < LLM_MAX_RETRIES:
+                # Full jitter, unless the provider said how long to wait
+                delay = last_error.retry_after or random.uniform(
+                    0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt)
+                )
+                if time.monotonic() + delay >= deadline_at:
+                    break
+                await asyncio.sleep(delay)
+    raise last_error or llm.LLMError(503, "No AI model available")
+
+
+async def _discard_nothing(_result):
+    pass
+
+
+async def complete(messages: list[dict], models: list[str], timeout: float | None = None,
+                   deadline: float | None = None, **extra) -> tuple[str, str]:
+    """
+    Chat completion through the gateway. Returns (text, model that served it).
+    Raises LLMTimeout / LLMError once every model and retry is exhausted.
+    """
+    async def call(model, attempt_timeout):
+        return await llm.chat_completion(messages, model=model, timeout=attempt_timeout, **extra)
+
+    return await _call(call, models, timeout, deadline, _discard_nothing)
+
+
+_END = object()
+
+
+class _StreamAttempt:
+    """One upstream stream, pumped by its own task into a queue."""
+
+    def __init__(self, messages: list[dict], model: str, timeout: float, extra: dict):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.started = asyncio.get_running_loop().create_future()
+        self.task = asyncio.create_task(self._pump(messages, model, timeout, extra))
+
+    async def _pump(self, messages, model, timeout, extra):
+        try:
+            async for delta in llm.stream_chat_completion(messages, model=model, timeout=timeout, **extra):
+                if not self.started.done():
+                    self.started.set_result(None)
+                await self.queue.put(delta)
+            if not self.started.done():
+                self.started.set_result(None) # Empty reply
+            await self.queue.put(_END)
+        except Exception as e:
+            if not self.started.done():
+                self.started.set_exception(e)
+            else:
+                await self.queue.put(e)
+
+    def cancel(self):
+        self.task.cancel()
+
+    async def deltas(self):
+        try:
+            while True:
+                item = await self.queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.cancel()
+
+
+async def open_stream(messages: list[dict], models: list[str], timeout: float | None = None,
+                      deadline: float | None = None, **extra):
+    """
+    Streaming completion through the gateway. Retries, hedging and fallback
+    apply until the first token arrives; after that the reply is committed to
+    one model and a failure surfaces from the iterator.
+    Returns (model, async iterator of text deltas).
+    """
+    async def call(model, attempt_timeout):
+        attempt = _StreamAttempt(messages, model, attempt_timeout, extra)
+        try:
+            await attempt.started
+        except BaseException:
+            attempt.cancel()
+            raise
+        return attempt
+
+    async def discard(attempt):
+        attempt.cancel()
+
+    attempt, model = await _call(call, models, timeout, deadline, discard)
+    return model, attempt.deltas()
@@ -0,0 +1,71 @@
+import os
+import sys
+import json
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+# --- CONFIG ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json": one JSON object per line (production); "text": readable lines for dev
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+# Set per request by the middleware in main.py (and per job by the plan job
+# runner); tasks spawned while handling a request inherit it.
+request_id_var: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+# Everything a LogRecord carries by itself; any other attribute came in via extra=
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": request_id_var.get(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = " ".join(f"{k}={v}" for k, v in _fields(record).items())
+        line = f"{record.levelname:<7} [{request_id_var.get() or '-'}] {record.name}: {record.getMessage()}"
+        if fields:
+            line += f" | {fields}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+_configured = False
+
+
+def setup_logging():
+    """Routes the app's "tripmate.*" loggers to stdout. Idempotent."""
+    global _configured
+    if _configured:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JSONFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    logger = logging.getLogger("tripmate")
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(handler)
+    logger.propagate = False
+    _configured = True
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger for a module, e.g. get_logger("chat"). Structured fields go in extra={...}."""
+    setup_logging()
+    return logging.getLogger(f"tripmate.{name}")
@@ -0,0 +1,170 @@
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+from utils.log import get_logger, request_id_var
+
+# Prometheus metrics for /metrics. Under gunicorn every worker writes its
+# samples to PROMETHEUS_MULTIPROC_DIR (set up in gunicorn.conf.py) and a
+# scrape of any worker aggregates all of them; without it the registry is
+# per process (uvicorn dev server, single worker).
+
+# --- CONFIG ---
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# Paths left out of the access log (still measured)
+QUIET_PATHS = {"/health", "/metrics"}
+
+logger = get_logger("http")
+
+# Seconds; spans fast DB reads up to long plan generations
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds", "Request latency by route template",
+    ["method", "route", "status"], buckets=BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being handled", multiprocess_mode="livesum",
+)
+UPSTREAM_DURATION = Histogram(
+    "upstream_request_duration_seconds", "Calls to OpenRouter, SerpApi, Wikipedia and the database",
+    ["upstream", "outcome"], buckets=BUCKETS,
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "upstream_requests_in_flight", "Upstream calls in progress", ["upstream"], multiprocess_mode="livesum",
+)
+# Prompt-cache effectiveness per template version:
+# rate(llm_tokens_total{kind="cached_prompt"}) / rate(llm_tokens_total{kind="prompt"}) by (prompt)
+LLM_TOKENS = Counter("llm_tokens", "Tokens reported by the LLM provider", ["model", "kind", "prompt"])
+LLM_FIRST_TOKEN = Histogram(
+    "llm_first_token_seconds", "Time to the first streamed token", ["model"], buckets=BUCKETS,
+)
+# hit_ratio = rate(cache_events_total{event="hits"}) / rate(cache_events_total{event=~"hits|misses"})
+CACHE_EVENTS = Counter("cache_events", "Cache lookups by outcome (hits, misses, coalesced, ...)", ["namespace", "event"])
+
+# Prompt template ("plan@1", see utils/prompts.py) behind the LLM calls made
+# in this context; "none" for untemplated ones such as chat
+prompt_var: ContextVar[str] = ContextVar("prompt", default="none")
+
+
+@contextmanager
+def track(upstream: str):
+    """Times the enclosed upstream call; outcome is ok, error or cancelled."""
+    started = time.perf_counter()
+    outcome = "ok"
+    UPSTREAM_IN_FLIGHT.labels(upstream).inc()
+    try:
+        yield
+    except BaseException as e:
+        # GeneratorExit: a streamed reply the client stopped reading
+        outcome = "cancelled" if type(e).__name__ in ("CancelledError", "GeneratorExit") else "error"
+        raise
+    finally:
+        UPSTREAM_IN_FLIGHT.labels(upstream).dec()
+        UPSTREAM_DURATION.labels(upstream, outcome).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def prompt_label(template_id: str):
+    """Labels the tokens of LLM calls started inside with `template_id`."""
+    token = prompt_var.set(template_id)
+    try:
+        yield
+    finally:
+        prompt_var.reset(token)
+
+
+def record_tokens(model: str, usage: dict | None):
+    """Counts an OpenAI-style usage block ({"prompt_tokens", "completion_tokens", ...})."""
+    if not usage:
+        return
+    prompt = prompt_var.get()
+    for kind in ("prompt", "completion"):
+        count = usage.get(f"{kind}_tokens")
+        if count:
+            LLM_TOKENS.labels(model, kind, prompt).inc(count)
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached:
+        LLM_TOKENS.labels(model, "cached_prompt", prompt).inc(cached)
+
+
+def instrument_engine(engine):
+    """Times every statement run on a (sync) SQLAlchemy engine as upstream "db"."""
+    from sqlalchemy import event
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+        UPSTREAM_IN_FLIGHT.labels("db").inc()
+
+    def finish(conn, outcome):
+        started = conn.info.get("metrics_started")
+        if started:
+            UPSTREAM_IN_FLIGHT.labels("db").dec()
+            UPSTREAM_DURATION.labels("db", outcome).observe(time.perf_counter() - started.pop())
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", lambda conn, *args: finish(conn, "ok"))
+    event.listen(engine, "handle_error", lambda context: finish(context.connection, "error") if context.connection else None)
+
+
+def render() -> tuple[bytes, str]:
+    """Exposition body and content type for GET /metrics."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+
+class RequestMetricsMiddleware:
+    """
+    Outermost middleware: assigns the request id (the caller's X-Request-ID,
+    if sane, else a new one) used by every log line, echoes it back, and
+    records latency per route template plus an access log line.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope.get("headers") or []).get(b"x-request-id", b"").decode("latin-1")
+        request_id = incoming if _REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        status = 500 # Unless a response gets started
+        started = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode())]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            duration = time.perf_counter() - started
+            # The route template, not the raw path: /trips/{trip_id}, not one series per trip.
+            # Starlette leaves the matched route in the scope; 404s and 429s have none.
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_DURATION.labels(scope["method"], route, str(status)).observe(duration)
+            if scope["path"] not in QUIET_PATHS:
+                logger.info(
+                    f"{scope['method']} {scope['path']} {status}",
+                    extra={"route": route, "status": status, "duration_ms": round(duration * 1000, 1)},
+                )
+            request_id_var.reset(token)
@@ -0,0 +1,125 @@
+import os
+from dataclasses import dataclass
+from pydantic import BaseModel
+from utils import itinerary
+
+# Versioned prompt templates for planning. Each prompt is sent as the static
+# instructions first (system message, byte-identical on every request) and
+# the per-request fields last, so providers that cache prompt prefixes can
+# reuse the instructions across requests instead of reprocessing them.
+#
+# Bump a template's version whenever its text changes. The id ("plan@1")
+# labels the llm_tokens_total metric (prompt vs cached_prompt tokens per
+# version), is stored on each Trip and is part of the itinerary cache key.
+
+# --- CONFIG ---
+# Also mark the instructions with a cache_control breakpoint. Anthropic and
+# Gemini models only cache at such breakpoints; providers that cache prefixes
+# automatically (OpenAI, DeepSeek, ...) ignore it.
+PROMPT_CACHE_CONTROL = os.getenv("PROMPT_CACHE_CONTROL", "1") == "1"
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    name: str
+    version: int
+    instructions: str # Static: no per-request values, ever
+    request: str # str.format() template for the per-request part
+    schema: type[BaseModel] | None = None # What the reply validates as (json_schema response format)
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    def messages(self, **fields) -> list[dict]:
+        if PROMPT_CACHE_CONTROL:
+            system = [{"type": "text", "text": self.instructions, "cache_control": {"type": "ephemeral"}}]
+        else:
+            system = self.instructions
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": self.request.format(**fields)},
+        ]
+
+
+_TRIP = (
+    "Trip: {num_days} days in {destination} for {travelers} traveler(s), from {start_date} to {end_date}.\n"
+    "Budget: ₹{budget}.\n"
+    "Preferences: {preferences}.\n"
+)
+
+PLAN = PromptTemplate(
+    name="plan",
+    version=1,
+    instructions=(
+        "You are a travel planner writing detailed, deep-dive trip plans.\n"
+        "Reply with ONE JSON object and nothing else (no markdown, no commentary), shaped like:\n"
+        f"{itinerary.JSON_SHAPE}\n\n"
+        "Fill it in STRICTLY as follows:\n"
+        "1. **hotels**: 3 specific, highly-rated hotels/resorts with estimated prices per night in INR.\n"
+        "2. **days**: A COMPLETE, IMMERSIVE day-by-day itinerary for ALL days of the trip, day 1 being its start date. "
+        "Give every day Morning, Afternoon and Evening slots with deep explanations of *why* to visit each spot, history, or vibe. "
+        "Make it feel like a professional travel guide.\n"
+        "3. **budget**: Estimated costs STRICTLY for: Hotels, Food, Activities, and Local Transport. "
+        "❌ DO NOT INCLUDE FLIGHT COSTS.\n\n"
+        "**Tone**: Use emojis ✨🌊🍛 in titles and descriptions to make it visually engaging and fun."
+    ),
+    request=_TRIP + "\nWrite the {num_days}-day plan.",
+    schema=itinerary.Itinerary,
+)
+
+# Long-trip mode (see routers/plan.py): outline first, then the days in chunks
+PLAN_OUTLINE = PromptTemplate(
+    name="plan_outline",
+    version=1,
+    instructions=(
+        "You outline long trips; the days themselves are written later from your outline.\n"
+        "Reply with ONE JSON object and nothing else (no markdown, no commentary), shaped like:\n"
+        f"{itinerary.OUTLINE_JSON_SHAPE}\n\n"
+        "Fill it in STRICTLY as follows:\n"
+        "1. **hotels**: 3 specific, highly-rated hotels/resorts with estimated prices per night in INR.\n"
+        "2. **days**: one entry for EVERY day of the trip: the area or region visited and a short theme. "
+        "Group nearby sights on the same or consecutive days and keep travel between days realistic.\n"
+        "3. **budget**: Estimated costs for the whole trip STRICTLY for: Hotels, Food, Activities, and Local Transport. "
+        "❌ DO NOT INCLUDE FLIGHT COSTS."
+    ),
+    request=_TRIP + "\nOutline the {num_days}-day plan.",
+    schema=itinerary.Outline,
+)
+
+PLAN_CHUNK = PromptTemplate(
+    name="plan_chunk",
+    version=1,
+    instructions=(
+        "You write some of the days of a longer trip plan. The other days are written separately from the same "
+        "outline: stick to the outline and do not reuse sights planned for other days.\n"
+        "Give every day Morning, Afternoon and Evening slots with deep explanations of *why* to visit each spot, "
+        "history, or vibe, like a professional travel guide. Use emojis ✨🌊🍛 in titles and descriptions.\n"
+        "Reply with ONE JSON object and nothing else, holding only the days asked for, shaped like:\n"
+        f"{itinerary.DAYS_JSON_SHAPE}"
+    ),
+    # Everything but the last line is the same for every chunk of one plan
+    request=_TRIP + "Hotels: {hotels}.\n\nOutline:\n{outline}\n\nWrite days {first}-{last}, holding exactly {count} day(s).",
+    schema=itinerary.DayList,
+)
+
+DAY_EDIT = PromptTemplate(
+    name="day_edit",
+    version=1,
+    instructions=(
+        "You edit part of an existing trip plan: rewrite only the days asked for, following the traveler's request. "
+        "Avoid repeating places from the neighbouring days and keep travel between consecutive days realistic. "
+        "Give every day Morning, Afternoon and Evening slots with the same depth and tone as before.\n"
+        "Reply with ONE JSON object and nothing else, holding only the rewritten days, shaped like:\n"
+        f"{itinerary.DAYS_JSON_SHAPE}"
+    ),
+    request=(
+        "Trip: {num_days} days in {destination} for {travelers} traveler(s), from {start_date} to {end_date}.\n"
+        "Budget: ₹{budget}.\n"
+        "Hotels: {hotels}.\n\n"
+        "{neighbours}"
+        "Current version of day(s) {first}-{last}:\n{current}\n\n"
+        "Rewrite day(s) {first}-{last}, holding exactly {count} day(s), following this request: {instruction}"
+    ),
+    schema=itinerary.DayList,
+)
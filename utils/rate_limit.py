@@ -0,0 +1,291 @@
+import os
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from utils.cache import CACHE_BACKEND, CACHE_DB_PATH, shared_connection, connection_lock
+from utils.log import get_logger
+
+# --- CONFIG ---
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# "sqlite" shares buckets / LLM slots between all gunicorn workers on the box,
+# "memory" keeps them per process (tests / single worker dev)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", CACHE_BACKEND)
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", CACHE_DB_PATH)
+# Behind a proxy that sets X-Forwarded-For (Render, Cloud Run), anonymous
+# clients are told apart by X-Forwarded-For instead of the proxy's address.
+# Only the entries our own proxies appended are trusted (the client can send
+# anything to the left of them): with RATE_LIMIT_TRUSTED_HOPS proxies in
+# front, the client is the entry that many places from the right.
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "0") == "1"
+RATE_LIMIT_TRUSTED_HOPS = max(1, int(os.getenv("RATE_LIMIT_TRUSTED_HOPS", "1")))
+
+# Token buckets per route class, "<burst>/<seconds>": up to <burst> requests at
+# once, refilled at <burst> per <seconds>
+ROUTE_LIMITS = {
+    "plan": os.getenv("RATE_LIMIT_PLAN", "10/60"),
+    "chat": os.getenv("RATE_LIMIT_CHAT", "30/60"),
+    "auth": os.getenv("RATE_LIMIT_AUTH", "10/60"),
+    "default": os.getenv("RATE_LIMIT_DEFAULT", "120/60"),
+}
+EXEMPT_PATHS = {"/", "/health", "/metrics", "/docs", "/openapi.json"}
+
+# Upstream LLM calls in flight across all workers (0 = no global cap). Calls
+# over the cap wait up to LLM_QUEUE_DEADLINE seconds for a slot.
+LLM_GLOBAL_CONCURRENCY = int(os.getenv("LLM_GLOBAL_CONCURRENCY", "32"))
+LLM_QUEUE_DEADLINE = float(os.getenv("LLM_QUEUE_DEADLINE", "10"))
+# A slot whose holder died is reclaimed after this long
+LLM_SLOT_LEASE = float(os.getenv("LLM_SLOT_LEASE", "600"))
+SLOT_POLL_INTERVAL = 0.05
+BUCKET_IDLE_TTL = 3600 # Idle buckets are full again long before this; drop them
+
+logger = get_logger("rate_limit")
+
+
+def parse_limit(spec: str) -> tuple[float, float]:
+    """"10/60" -> (capacity 10, refill 10/60 tokens per second)."""
+    burst, seconds = spec.split("/")
+    return float(burst), float(burst) / float(seconds)
+
+
+def route_class(path: str) -> str:
+    # Stats and job polling are cheap reads, not plan generations
+    if path.startswith("/plan") and not path.startswith(("/plan/cache", "/plan/llm", "/plan/jobs/")):
+        return "plan"
+    if path.startswith("/trips/") and path.endswith("/days/regenerate"):
+        return "plan"
+    if path.startswith("/chat"):
+        return "chat"
+    if path in ("/token", "/signup", "/resend-verification-email"):
+        return "auth"
+    return "default"
+
+
+class MemoryBuckets:
+    def __init__(self):
+        self._buckets: dict[str, tuple[float, float]] = {} # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float, cost: float = 1) -> tuple[bool, float]:
+        """Takes `cost` tokens if available. Returns (allowed, seconds until it would be)."""
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > 100000:
+                self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < BUCKET_IDLE_TTL}
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+
+class SQLiteBuckets:
+    """Buckets in the shared local SQLite file; BEGIN IMMEDIATE makes take() atomic across workers."""
+
+    def __init__(self, path: str = RATE_LIMIT_DB_PATH):
+        self.path = path
+        self._takes = 0
+        with connection_lock:
+            shared_connection(path).execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def take(self, key, capacity, rate, cost=1):
+        now = time.time()
+        with connection_lock:
+            conn = shared_connection(self.path)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated_at FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                conn.execute("INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, tokens, now))
+                self._takes += 1
+                if self._takes % 1000 == 0:
+                    conn.execute("DELETE FROM rate_buckets WHERE updated_at < ?", (now - BUCKET_IDLE_TTL,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+
+class MemorySlots:
+    """Per-process stand-in for the global LLM slot pool."""
+
+    def __init__(self, limit: int):
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self, deadline: float) -> object | None:
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=deadline)
+        except asyncio.TimeoutError:
+            return None
+        return True
+
+    async def release(self, lease):
+        self._semaphore.release()
+
+
+class SQLiteSlots:
+    """
+    LLM slots as leases in the shared SQLite file. Waiters poll for a free
+    slot (not strictly FIFO); leases of crashed workers expire.
+    """
+
+    def __init__(self, limit: int, path: str = RATE_LIMIT_DB_PATH):
+        self.limit = limit
+        self.path = path
+        with connection_lock:
+            shared_connection(path).execute(
+                "CREATE TABLE IF NOT EXISTS llm_slots (lease TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+            )
+
+    def _try_acquire(self) -> str | None:
+        now = time.time()
+        lease = uuid.uuid4().hex
+        with connection_lock:
+            conn = shared_connection(self.path)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM llm_slots WHERE expires_at <= ?", (now,))
+                (in_use,) = conn.execute("SELECT COUNT(*) FROM llm_slots").fetchone()
+                if in_use < self.limit:
+                    conn.execute("INSERT INTO llm_slots (lease, expires_at) VALUES (?, ?)", (lease, now + LLM_SLOT_LEASE))
+                else:
+                    lease = None
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return lease
+
+    def _release(self, lease: str):
+        with connection_lock:
+            shared_connection(self.path).execute("DELETE FROM llm_slots WHERE lease = ?", (lease,))
+
+    async def acquire(self, deadline: float) -> str | None:
+        give_up_at = time.monotonic() + deadline
+        while True:
+            lease = await asyncio.to_thread(self._try_acquire)
+            if lease is not None:
+                return lease
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(min(remaining, SLOT_POLL_INTERVAL * random.uniform(0.5, 1.5)))
+
+    async def release(self, lease):
+        await asyncio.to_thread(self._release, lease)
+
+
+class QueueTimeout(Exception):
+    """No global LLM slot freed up within the queue deadline."""
+
+
+_buckets = None
+_slots = None
+
+
+def get_buckets():
+    global _buckets
+    if _buckets is None:
+        _buckets = MemoryBuckets() if RATE_LIMIT_BACKEND == "memory" else SQLiteBuckets()
+    return _buckets
+
+
+def _get_slots():
+    # Created lazily: the memory semaphore must belong to the worker's event loop
+    global _slots
+    if _slots is None:
+        _slots = MemorySlots(LLM_GLOBAL_CONCURRENCY) if RATE_LIMIT_BACKEND == "memory" else SQLiteSlots(LLM_GLOBAL_CONCURRENCY)
+    return _slots
+
+
+@asynccontextmanager
+async def llm_slot(deadline: float = LLM_QUEUE_DEADLINE):
+    """Holds one of the LLM_GLOBAL_CONCURRENCY upstream slots; raises QueueTimeout past `deadline`."""
+    if not LLM_GLOBAL_CONCURRENCY:
+        yield
+        return
+    slots = _get_slots()
+    lease = await slots.acquire(deadline)
+    if lease is None:
+        raise QueueTimeout()
+    try:
+        yield
+    finally:
+        # Shielded: a cancelled caller must still hand its slot back
+        await asyncio.shield(slots.release(lease))
+
+
+class RateLimitMiddleware:
+    """
+    Token-bucket limit per (route class, client). Clients are the user id from
+    a valid bearer token, or the IP address for anonymous calls. Over-limit
+    requests get a 429 with Retry-After. `identify(authorization header)`
+    returns the user key or None.
+    """
+
+    def __init__(self, app, identify):
+        self.app = app
+        self.identify = identify
+        self.limits = {name: parse_limit(spec) for name, spec in ROUTE_LIMITS.items()}
+
+    def client_key(self, scope) -> str:
+        headers = dict(scope.get("headers") or [])
+        authorization = headers.get(b"authorization")
+        if authorization:
+            user = self.identify(authorization.decode("latin-1"))
+            if user:
+                return user
+        if RATE_LIMIT_TRUST_FORWARDED and b"x-forwarded-for" in headers:
+            hops = [hop.strip() for hop in headers[b"x-forwarded-for"].decode("latin-1").split(",")]
+            # A shorter chain than expected is all proxy-appended: take its first entry
+            return "ip:" + hops[max(0, len(hops) - RATE_LIMIT_TRUSTED_HOPS)]
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    async def __call__(self, scope, receive, send):
+        if (
+            not RATE_LIMIT_ENABLED
+            or scope["type"] != "http"
+            or scope["method"] == "OPTIONS" # CORS preflight
+            or scope["path"] in EXEMPT_PATHS
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        name = route_class(scope["path"])
+        capacity, rate = self.limits[name]
+        key = f"{name}:{self.client_key(scope)}"
+        try:
+            allowed, retry_after = await asyncio.to_thread(get_buckets().take, key, capacity, rate)
+        except Exception as e:
+            # Fail open: a broken limiter store must not take the API down
+            logger.error(f"Rate limiter error: {e}")
+            allowed, retry_after = True, 0.0
+
+        if allowed:
+            await self.app(scope, receive, send)
+            return
+
+        body = json.dumps({"detail": "Too many requests, please slow down."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(retry_after)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
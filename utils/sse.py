@@ -0,0 +1,20 @@
+import json
+from fastapi.responses import StreamingResponse
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    # Stop nginx / proxies from buffering the stream
+    "X-Accel-Buffering": "no",
+}
+
+
+def format_event(event: str, data) -> str:
+    """Serializes one Server-Sent Event. `data` is sent as JSON."""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def event_stream_response(events) -> StreamingResponse:
+    """Wraps an async generator of formatted events in a text/event-stream response."""
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
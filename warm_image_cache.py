@@ -0,0 +1,18 @@
+import asyncio
+import sys
+from routers.plan import prewarm_destination_images
+from utils import http
+from utils.log import get_logger
+
+logger = get_logger("warm_image_cache")
+
+async def main(limit):
+    try:
+        await prewarm_destination_images(limit)
+    finally:
+        await http.aclose()
+
+if __name__ == "__main__":
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    logger.info(f"Prewarming destination image cache for top {limit} destinations...")
+    asyncio.run(main(limit))